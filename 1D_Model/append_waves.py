@@ -0,0 +1,30 @@
+import os
+from argparse import ArgumentParser
+from glob import glob
+import numpy as np
+from tqdm import tqdm
+from src.config import BaseConfig
+from src.ingest import append_segments
+
+
+def prepare_append_args():
+    parser = ArgumentParser()
+    parser.add_argument('--input', type=str, required=True,
+                        help='folder with one (3, 4096) .npy file per new segment, the file name is its id')
+    parser.add_argument('--batch_size', type=int, default=4096, help='segments published at a time')
+    parser.add_argument('--no_whiten', action='store_true', help='only append to the raw packed test store')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arg = prepare_append_args()
+    Config = BaseConfig
+    paths = sorted(glob(os.path.join(arg.input, '*.npy')))
+    print(f"Append {len(paths)} segments from {arg.input}")
+    for start in tqdm(range(0, len(paths), arg.batch_size)):
+        batch = paths[start:start + arg.batch_size]
+        ids = [os.path.splitext(os.path.basename(path))[0] for path in batch]
+        waves = np.stack([np.load(path) for path in batch])
+        rows = append_segments(ids, waves, Config, whiten=not arg.no_whiten)
+    if paths:
+        print(f"New rows up to {rows[-1]}")
@@ -0,0 +1,92 @@
+import time
+from argparse import ArgumentParser
+import numpy as np
+import torch
+from src.config import read_config
+from src.dataset import read_data, read_synthetic, DataRetriever, DataRetrieverTest, get_loader
+from src.injection import SignalInjector
+from src.wave_store import WAVE_SHAPE
+from src.util import seed_torch
+
+
+def time_loader(loader, n_batches):
+    start = time.time()
+    n_samples = 0
+    for step, batch in enumerate(loader, 1):
+        n_samples += len(batch[0])
+        if step >= n_batches:
+            break
+    return n_samples / (time.time() - start)
+
+
+def bench_loader(Config, train_df, arg):
+    """samples/sec of the per-item and the batch read path over the same training data"""
+    dataset = DataRetriever(train_df["file_path"].values, train_df["target"].values,
+                            Config=Config, rows=train_df["row"].values)
+    for batch_read in [False, True]:
+        Config.batch_read = batch_read
+        loader = get_loader(dataset, Config, Config.batch_size, shuffle=True)
+        # the first pass warms the page cache, report the second one
+        for _ in range(2):
+            speed = time_loader(loader, arg.n_batches)
+        print(f"batch_read={batch_read}: {speed:.0f} samples/sec")
+
+
+def bench_sampler(Config, train_df, arg):
+    """
+    read MB/s of the random and the block shuffle sampler. Each sampler reads its own half of the data so that
+    neither profits from pages cached by the other, drop the page cache before running to measure cold reads.
+    """
+    halves = np.array_split(np.random.permutation(len(train_df)), 2)
+    for block_shuffle, half in zip([False, True], halves):
+        df = train_df.iloc[np.sort(half)]
+        dataset = DataRetrieverTest(df["file_path"].values, df["target"].values, Config=Config, rows=df["row"].values)
+        if dataset.reader is None:
+            sample_bytes = np.load(df["file_path"].values[0]).nbytes
+        else:
+            sample_bytes = np.prod(WAVE_SHAPE) * dataset.reader.train.waves.dtype.itemsize
+        Config.block_shuffle = block_shuffle
+        loader = get_loader(dataset, Config, Config.batch_size, shuffle=True)
+        speed = time_loader(loader, arg.n_batches)
+        print(f"block_shuffle={block_shuffle}: {speed * sample_bytes / 2 ** 20:.1f} MB/s ({speed:.0f} samples/sec)")
+
+
+def bench_inject(Config, train_df, arg):
+    """CPU time per batch of injecting synthetic signals sample by sample and into the whole batch at once"""
+    Config.synthetic = True
+    injector = SignalInjector(read_synthetic(Config))
+    x = torch.zeros((Config.batch_size,) + WAVE_SHAPE)
+    mask = torch.ones(Config.batch_size, dtype=torch.bool)
+    torch.set_num_threads(1)  # as in a DataLoader worker
+    for name, inject in [('per sample', lambda: [injector(x[i:i + 1], mask[:1]) for i in range(len(x))]),
+                         ('batch', lambda: injector(x, mask))]:
+        start = time.process_time()
+        for _ in range(arg.n_batches):
+            inject()
+        print(f"{name}: {(time.process_time() - start) / arg.n_batches * 1000:.1f} ms CPU per batch")
+
+
+BENCHMARKS = {'loader': bench_loader, 'sampler': bench_sampler, 'inject': bench_inject}
+
+
+def prepare_bench_args():
+    parser = ArgumentParser()
+    parser.add_argument('--model_config', type=str, default='V2', help='configuration to take the data setup from')
+    parser.add_argument('--bench', type=str, default='loader', choices=list(BENCHMARKS), help='benchmark to run')
+    parser.add_argument('--n_batches', type=int, default=100, help='number of batches to time')
+    parser.add_argument('--num_workers', type=int, default=None, help='override Config.num_workers')
+    parser.add_argument('--data_backend', type=str, default=None, help="override Config.data_backend ('npy', 'packed')")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arg = prepare_bench_args()
+    Config = read_config(arg.model_config)
+    if Config is not None:
+        if arg.num_workers is not None:
+            Config.num_workers = arg.num_workers
+        if arg.data_backend is not None:
+            Config.data_backend = arg.data_backend
+        seed_torch(seed=Config.seed)
+        train_df, test_df = read_data(Config)
+        BENCHMARKS[arg.bench](Config, train_df, arg)
@@ -0,0 +1,69 @@
+from argparse import ArgumentParser
+from src.config import BaseConfig, read_config
+from src.dataset import read_data
+from src.infer_helper import load_fold_model, get_tta_pred
+from src.util import fast_auc, get_device, seed_torch
+from src.wave_store import convert_store, compare_stores, packed_folders
+
+
+def compact_folder(folder, encoding):
+    return folder.rstrip('/') + f'-{encoding}/'
+
+
+def set_train_folder(Config, folder):
+    if Config.use_raw_wave:
+        Config.packed_train_folder = folder
+    else:
+        Config.packed_whiten_train_folder = folder
+
+
+def oof_auc_delta(Config, fold, ref_folder, folder):
+    """AUC of the fold model on its validation rows, read from the reference store and from the compact store"""
+    seed_torch(seed=Config.seed)
+    train_df, _ = read_data(Config)
+    oof = train_df.query(f"fold=={fold}").copy()
+    model = load_fold_model(fold, Config)
+    Config.data_backend = 'packed'
+    aucs = []
+    for train_folder in [ref_folder, folder]:
+        set_train_folder(Config, train_folder)
+        aucs.append(fast_auc(oof['target'], get_tta_pred(oof, model, Config, vflip=False, shuffle01=False)))
+    set_train_folder(Config, ref_folder)
+    return aucs
+
+
+def prepare_compact_args():
+    parser = ArgumentParser()
+    parser.add_argument('--encoding', type=str, default='int16', choices=['int16', 'float16'],
+                        help='int16 with a scale per sample and channel, or float16 with one global scale')
+    parser.add_argument('--whiten', action='store_true', help='convert the whitened stores instead of the raw ones')
+    parser.add_argument('--splits', nargs='+', default=['train', 'test'], help='splits to convert')
+    parser.add_argument('--chunk_size', type=int, default=4096, help='waves converted at a time')
+    parser.add_argument('--n_check', type=int, default=10000, help='rows compared against the source store')
+    parser.add_argument('--model_config', type=str, default=None,
+                        help='trained configuration used to report the OOF AUC on the compact train store')
+    parser.add_argument('--fold', type=int, default=0, help='fold of --model_config to validate')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arg = prepare_compact_args()
+    Config = BaseConfig
+    if arg.whiten:
+        folders = {'train': Config.packed_whiten_train_folder, 'test': Config.packed_whiten_test_folder}
+    else:
+        folders = {'train': Config.packed_train_folder, 'test': Config.packed_test_folder}
+    for split in arg.splits:
+        src = folders[split]
+        dst = compact_folder(src, arg.encoding)
+        print(f"Convert {src} to {arg.encoding} in {dst}")
+        convert_store(src, dst, encoding=arg.encoding, chunk_size=arg.chunk_size)
+        print(compare_stores(src, dst, n_samples=arg.n_check))
+
+    if arg.model_config is not None:
+        Config = read_config(arg.model_config)
+        Config.device = get_device()
+        ref_folder = packed_folders(Config)[0]
+        ref_auc, auc = oof_auc_delta(Config, arg.fold, ref_folder, compact_folder(ref_folder, arg.encoding))
+        print(f"Fold {arg.fold} OOF AUC: reference {ref_auc:.5f}, {arg.encoding} {auc:.5f}, "
+              f"delta {auc - ref_auc:+.5f}")
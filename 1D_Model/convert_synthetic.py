@@ -0,0 +1,18 @@
+from argparse import ArgumentParser
+from src.config import BaseConfig
+from src.dataset import convert_synthetic, bank_path
+
+
+def prepare_convert_args():
+    parser = ArgumentParser()
+    parser.add_argument('--src', type=str, default=BaseConfig.sim_data_path,
+                        help='pickled dict of synthetic signals')
+    parser.add_argument('--dst', type=str, default=bank_path(BaseConfig.sim_data_path), help='memory-mapped (K, 3, L) bank')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arg = prepare_convert_args()
+    print(f"Convert {arg.src} to {arg.dst}")
+    bank = convert_synthetic(arg.src, arg.dst)
+    print(f"{bank.shape[0]} signals of shape {bank.shape[1:]}")
@@ -0,0 +1,44 @@
+import os
+from argparse import ArgumentParser
+import numpy as np
+from src.config import BaseConfig
+from src.data_index import load_index, index_frame, index_paths
+from src.psd import estimate_psd, save_psd
+from src.wave_store import PackedWaveStore
+
+
+def prepare_psd_args():
+    parser = ArgumentParser()
+    parser.add_argument('--source', type=str, default='npy', choices=['npy', 'packed'],
+                        help='read raw waves from the competition .npy files or from the packed raw train store')
+    parser.add_argument('--window', type=str, default='tukey', help='window of the whitening fft (avr_w0)')
+    parser.add_argument('--alpha', type=float, default=0.5, help='shape parameter of the tukey window (avr_w0)')
+    parser.add_argument('--dc_alphas', type=float, nargs='+', default=[0.2],
+                        help='tukey shape parameters of the datasaurus design curves, one file each')
+    parser.add_argument('--dc_folder', type=str, default=BaseConfig.kaggleDataFolder,
+                        help='where the design curves go, the INPUT_PATH of datasaurus')
+    parser.add_argument('--chunk_size', type=int, default=1024, help='waves per fft batch')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--tol', type=float, default=None,
+                        help='stop early once the relative standard error of the estimates is below tol')
+    parser.add_argument('--min_samples', type=int, default=20000, help='waves averaged at least before stopping')
+    parser.add_argument('--seed', type=int, default=0, help='order in which the chunks are read')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arg = prepare_psd_args()
+    Config = BaseConfig
+    Config.use_raw_wave = True
+    index = load_index(Config.kaggleDataFolder, Config.index_path)
+    positions = np.flatnonzero(index_frame(index, 'train')['target'].values == 0)
+    if arg.source == 'packed':
+        source = PackedWaveStore(Config.packed_train_folder)
+    else:
+        source = index_paths(index, 'train', Config)
+    print(f"Estimate the noise spectra from {len(positions)} negative train waves")
+    avr_w0, design_curves, n = estimate_psd(source, positions, arg.window, arg.alpha,
+                                            [('tukey', alpha) for alpha in arg.dc_alphas],
+                                            chunk_size=arg.chunk_size, num_workers=arg.num_workers,
+                                            tol=arg.tol, min_samples=arg.min_samples, seed=arg.seed)
+    save_psd(avr_w0, design_curves, Config.avr_w0_path, arg.dc_folder)
@@ -0,0 +1,46 @@
+import json
+import os
+from argparse import ArgumentParser
+import numpy as np
+from src.config import BaseConfig
+from src.dataset import bank_path
+from src.data_index import load_index, index_frame, index_paths
+from src.synthetic import generate_bank, GW_SIM_SPEC
+
+
+def prepare_gen_args():
+    parser = ArgumentParser()
+    parser.add_argument('--n', type=int, default=300000, help='number of signals in the bank')
+    parser.add_argument('--out', type=str, default=bank_path(BaseConfig.sim_data_path), help='memory-mapped (n, 3, 4096) bank')
+    parser.add_argument('--spec', type=str, default=None,
+                        help='json file overriding entries of GW_SIM_SPEC, e.g. {"params": {"m1": ["uniform", 5, 80]}}')
+    parser.add_argument('--seed', type=int, default=0, help='row k is drawn from (seed, k), whatever the sharding')
+    parser.add_argument('--shard', type=int, default=0, help='index of the shard generated by this run')
+    parser.add_argument('--num_shards', type=int, default=1, help='number of runs sharing the bank')
+    parser.add_argument('--chunk_size', type=int, default=256, help='rows per task, the unit of resumption')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--psd_samples', type=int, default=1000,
+                        help='negative training waves averaged per detector for the PSD the signals are scaled with')
+    return parser.parse_args()
+
+
+def read_spec(path):
+    spec = json.loads(json.dumps(GW_SIM_SPEC))
+    if path is not None:
+        with open(path, 'r') as f:
+            override = json.load(f)
+        spec['params'].update(override.pop('params', {}))
+        spec.update(override)
+    return spec
+
+
+if __name__ == "__main__":
+    arg = prepare_gen_args()
+    Config = BaseConfig
+    index = load_index(Config.kaggleDataFolder, Config.index_path)
+    negatives = np.flatnonzero(index_frame(index, 'train')['target'].values == 0)
+    positions = np.random.RandomState(arg.seed).choice(negatives, arg.psd_samples, replace=False)
+    psd_paths = index_paths(index, 'train', Config, positions)
+    print(f"Generate {arg.out}: shard {arg.shard} of {arg.num_shards}, {arg.num_workers} workers")
+    generate_bank(arg.out, arg.n, psd_paths, spec=read_spec(arg.spec), seed=arg.seed, shard=arg.shard,
+                  num_shards=arg.num_shards, chunk_size=arg.chunk_size, num_workers=arg.num_workers)
@@ -12,9 +12,15 @@ if __name__ == "__main__":
     seed_torch(seed=Config.seed)
     Config.device=device
     cv_score = 0
-    if arg.gen_oof:
-        print("Generating OOF....")
-        cv_score, oof_all = get_oof_final(train_df, Config)
-    if arg.gen_test:
-        print("Generating test....")
-        test_avg = get_test_avg(cv_score, test_df, Config)
+    pool = get_worker_pool(Config)
+    try:
+        if arg.gen_oof:
+            print("Generating OOF....")
+            cv_score, oof_all = get_oof_final(train_df, Config, pool)
+        if arg.gen_test:
+            print("Generating test....")
+            test_avg = get_test_avg(cv_score, test_df, Config, pool)
+    finally:
+        if pool is not None:
+            pool.report()
+            pool.close()
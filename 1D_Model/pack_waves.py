@@ -0,0 +1,29 @@
+from argparse import ArgumentParser
+import pandas as pd
+from src.config import BaseConfig
+from src.util import id_2_path_wave
+from src.wave_store import build_packed_store, packed_folders
+
+
+def prepare_pack_args():
+    parser = ArgumentParser()
+    parser.add_argument('--whiten', action='store_true',
+                        help='pack the whitened waves (whiten_*_folder) instead of the raw competition data')
+    parser.add_argument('--splits', nargs='+', default=['train', 'test'], help='splits to pack')
+    parser.add_argument('--num_workers', type=int, default=BaseConfig.num_workers, help='processes reading .npy files')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arg = prepare_pack_args()
+    Config = BaseConfig
+    Config.use_raw_wave = not arg.whiten
+    train_folder, test_folder = packed_folders(Config)
+    for split in arg.splits:
+        train = split == 'train'
+        csv = '/training_labels.csv' if train else '/sample_submission.csv'
+        df = pd.read_csv(Config.kaggleDataFolder + csv)
+        paths = df['id'].apply(lambda x: id_2_path_wave(x, Config, train)).values
+        folder = train_folder if train else test_folder
+        print(f"Pack {len(df)} {split} waves into {folder}")
+        build_packed_store(df['id'].values, paths, folder, num_workers=arg.num_workers)
@@ -0,0 +1,60 @@
+import os
+from argparse import ArgumentParser
+import numpy as np
+import pandas as pd
+from src.config import BaseConfig
+from src.data_index import load_index, index_frame, index_paths
+from src.integrity import scan_waves, bad_sample_frame, save_bad_samples, FLAG_NAMES
+from src.wave_store import PackedWaveStore
+
+
+def prepare_scan_args():
+    parser = ArgumentParser()
+    parser.add_argument('--splits', nargs='+', default=['train', 'test'], help='splits to scan')
+    parser.add_argument('--source', type=str, default='npy', choices=['npy', 'packed'],
+                        help='scan the per-id .npy files or the packed stores')
+    parser.add_argument('--whiten', action='store_true', help='scan the whitened waves instead of the raw ones')
+    parser.add_argument('--max_amplitude', type=float, default=None,
+                        help='flag waves above this |amplitude|, 1e-18 for raw waves and no limit for whitened ones')
+    parser.add_argument('--chunk_size', type=int, default=4096, help='waves per task')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count(), help='worker processes')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arg = prepare_scan_args()
+    Config = BaseConfig
+    Config.use_raw_wave = not arg.whiten
+    store = 'whiten' if arg.whiten else 'raw'
+    max_amplitude = arg.max_amplitude
+    if max_amplitude is None:
+        max_amplitude = np.inf if arg.whiten else 1e-18
+    index = load_index(Config.kaggleDataFolder, Config.index_path)
+    bad_dfs = []
+    for split in arg.splits:
+        # the appended segments are only in the packed stores
+        df = index_frame(index, split, appended=arg.source == 'packed')
+        if arg.source == 'packed':
+            if split == 'train':
+                folder = Config.packed_whiten_train_folder if arg.whiten else Config.packed_train_folder
+            else:
+                folder = Config.packed_whiten_test_folder if arg.whiten else Config.packed_test_folder
+            source = PackedWaveStore(folder)
+        else:
+            source = index_paths(index, split, Config)
+        print(f"Scan {len(df)} {store} {split} waves")
+        flags = scan_waves(source, len(df), max_amplitude, chunk_size=arg.chunk_size, num_workers=arg.num_workers)
+        bad_df = bad_sample_frame(split, df['id'].values, df['row'].values, flags)
+        bad_df.insert(1, 'store', store)
+        for flag, name in FLAG_NAMES.items():
+            print(f"  {name}: {np.count_nonzero(flags & flag)}")
+        bad_dfs.append(bad_df)
+
+    # keep what earlier scans found in the other splits/stores
+    if os.path.exists(Config.exclude_path):
+        previous = pd.read_csv(Config.exclude_path)
+        scanned = previous['split'].isin(arg.splits) & (previous['store'] == store)
+        bad_dfs.insert(0, previous[~scanned])
+    bad_df = pd.concat(bad_dfs).reset_index(drop=True)
+    save_bad_samples(bad_df, Config.exclude_path)
+    print(f"{len(bad_df)} bad samples in {Config.exclude_path}")
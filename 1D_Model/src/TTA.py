@@ -1,17 +1,16 @@
 import math
-from torch.utils.data import Dataset
 import audiomentations as A
 import torch
 import numpy as np
+from .dataset import WaveDataset
 
 
-class TTA(Dataset):
+class TTA(WaveDataset):
     def __init__(self, paths, targets, use_raw_wave=True, vflip=False, shuffle_channels=False,
                  time_shift=False, tsl=96, tsr=96,
                  add_gaussian_noise=False, time_stretch=False, shuffle01=False,timemask=False,
-                 shift_channel=False,reduce_SNR=False):
-        self.paths = paths
-        self.targets = targets
+                 shift_channel=False,reduce_SNR=False, rows=None, reader=None):
+        super().__init__(paths, targets, rows, reader)
         self.use_raw_wave = use_raw_wave
         self.vflip = vflip
         self.shuffle_channels = shuffle_channels
@@ -33,13 +32,7 @@ class TTA(Dataset):
         if time_stretch:
             self.time_stretch = A.TimeStretch(min_rate=0.9, max_rate=1.111, leave_length_unchanged=True, p=1)
 
-    def __len__(self):
-        return len(self.paths)
-
-    def __getitem__(self, index):
-        path = self.paths[index]
-        waves = np.load(path)
-
+    def transform(self, waves):
         if self.vflip:
             waves = -waves
         if self.shuffle_channels:
@@ -54,9 +47,20 @@ class TTA(Dataset):
             waves[[0, 1]] = waves[[1, 0]]
         if self.timemask:
             waves = self.timemask(waves, sample_rate=2048)
+        return waves
 
+    def get_item(self, index):
+        waves = self.transform(self.load_wave(index))
         waves = torch.FloatTensor(waves * 1e20) if self.use_raw_wave else torch.FloatTensor(waves)
         target = torch.tensor(self.targets[index], dtype=torch.float)  # device=device,
         return waves, target
 
+    def get_items(self, indices):
+        waves = self.load_waves(indices)
+        for i in range(len(waves)):
+            waves[i] = self.transform(waves[i])
+        if self.use_raw_wave:
+            waves *= 1e20
+        return torch.from_numpy(waves), torch.tensor(self.targets[indices], dtype=torch.float)
+
 
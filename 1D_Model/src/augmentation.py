@@ -1,4 +1,5 @@
 import math
+from functools import partial
 import audiomentations as A
 import numpy as np
 
@@ -12,23 +13,60 @@ def addAugmentation(Config, name, cons_func, agg_fun, cons_list, cons_name_list,
         cons_name_list.append(name)
 
 
+# module-level transforms bound with partial, so that datasets holding them can be pickled (see worker_pool)
+def vflip_func(x, sample_rate=2048):
+    return -x
+
+
+def vflip_func_random(x, sample_rate=2048, proba=0.5):
+    if np.random.random() < proba:
+        return -x
+    else:
+        return x
+
+
+def shuffle01_func(x, sample_rate=2048):
+    return x[[1, 0, 2]]
+
+
+def shuffle01_func_random(x, sample_rate=2048, proba=0.5):
+    if np.random.random() < proba:
+        return x[[1, 0, 2]]
+    else:
+        return x
+
+
+def shift_channel_func(x, sample_rate=2048, left=0, right=0, proba=1):
+    channel = np.random.choice(3)
+    trans = A.Shift(min_fraction=-left * 1.0 / 4096,
+                    max_fraction=right * 1.0 / 4096,
+                    p=proba, rollover=False)
+    x[channel] = trans(x[channel], sample_rate=2048)
+    return x
+
+
+def reduce_SNR_func(x, sample_rate=2048, ratio=1.0):
+    multiplier = math.sqrt(1 - ratio ** 2)
+    x = x * ratio
+    trans = A.AddGaussianNoise(min_amplitude=multiplier, max_amplitude=multiplier, p=1)
+    x = trans(x, sample_rate=2048)
+    return x
+
+
+def reduce_SNR_func_random(x, sample_rate=2048, ratio=1.0, proba=0.5):
+    if np.random.random() < proba:
+        x = reduce_SNR_func(x, sample_rate, ratio)
+    return x
+
+
 def get_tranform_list(Config):
     cons_funcs = []
     aggr_funcs = []
     cons_func_names = []
     aggr_func_names = []
     if Config.vflip:
-        def vflip_func(x, sample_rate=2048):
-            return -x
-
-        def vflip_func_random(x, sample_rate=2048):
-            if np.random.random() < Config.vflip_proba:
-                return -x
-            else:
-                return x
-
         addAugmentation(Config, 'vflip',
-                        vflip_func_random,
+                        partial(vflip_func_random, proba=Config.vflip_proba),
                         vflip_func,
                         cons_funcs, cons_func_names,
                         aggr_funcs, aggr_func_names)
@@ -49,17 +87,8 @@ def get_tranform_list(Config):
                         aggr_funcs, aggr_func_names)
 
     if Config.shuffle01:
-        def shuffle01_func(x, sample_rate=2048):
-            return x[[1, 0, 2]]
-
-        def shuffle01_func_random(x, sample_rate=2048):
-            if np.random.random() < Config.shuffle01_proba:
-                return x[[1, 0, 2]]
-            else:
-                return x
-
         addAugmentation(Config, 'shuffle01',
-                        shuffle01_func_random,
+                        partial(shuffle01_func_random, proba=Config.shuffle01_proba),
                         shuffle01_func,
                         cons_funcs, cons_func_names,
                         aggr_funcs, aggr_func_names)
@@ -77,47 +106,17 @@ def get_tranform_list(Config):
                         aggr_funcs, aggr_func_names)
 
     if Config.shift_channel:
-        def shift_channel_func(x, sample_rate=2048):
-            channel = np.random.choice(3)
-            trans = A.Shift(min_fraction=-Config.shift_channel_left * 1.0 / 4096,
-                            max_fraction=Config.shift_channel_right * 1.0 / 4096,
-                            p=1, rollover=False)
-            x[channel] = trans(x[channel], sample_rate=2048)
-            return x
-
-        def shift_channel_func_random(x, sample_rate=2048):
-            channel = np.random.choice(3)
-            trans = A.Shift(min_fraction=-Config.shift_channel_left * 1.0 / 4096,
-                            max_fraction=Config.shift_channel_right * 1.0 / 4096,
-                            p=Config.shift_channel_proba, rollover=False)
-            x[channel] = trans(x[channel], sample_rate=2048)
-            return x
-
+        shift = dict(left=Config.shift_channel_left, right=Config.shift_channel_right)
         addAugmentation(Config, 'shift_channel',
-                        shift_channel_func_random,
-                        shift_channel_func,
+                        partial(shift_channel_func, proba=Config.shift_channel_proba, **shift),
+                        partial(shift_channel_func, **shift),
                         cons_funcs, cons_func_names,
                         aggr_funcs, aggr_func_names)
 
     if Config.reduce_SNR:
-        multiplier = math.sqrt(1 - Config.reduce_SNR_ratio ** 2)
-
-        def reduce_SNR_func(x, sample_rate=2048):
-            x = x * Config.reduce_SNR_ratio
-            trans = A.AddGaussianNoise(min_amplitude=multiplier, max_amplitude=multiplier, p=1)
-            x = trans(x, sample_rate=2048)
-            return x
-
-        def reduce_SNR_func_random(x, sample_rate=2048):
-            if np.random.random() < Config.reduce_SNR_proba:
-                x = x * Config.reduce_SNR_ratio
-                trans = A.AddGaussianNoise(min_amplitude=multiplier, max_amplitude=multiplier, p=1)
-                x = trans(x, sample_rate=2048)
-            return x
-
         addAugmentation(Config, 'reduce_SNR',
-                        reduce_SNR_func_random,
-                        reduce_SNR_func,
+                        partial(reduce_SNR_func_random, ratio=Config.reduce_SNR_ratio, proba=Config.reduce_SNR_proba),
+                        partial(reduce_SNR_func, ratio=Config.reduce_SNR_ratio),
                         cons_funcs, cons_func_names,
                         aggr_funcs, aggr_func_names)
 
@@ -0,0 +1,115 @@
+import math
+import torch
+import torch.nn.functional as F
+
+GAUSSIAN_NOISE = (0.001 * 0.015, 0.015 * 0.015)  # min/max amplitude of A.AddGaussianNoise in get_tranform_list
+TIMEMASK_PART = 0.03  # max_band_part of A.TimeMask
+
+
+def shift_waves(x, shifts):
+    """
+    (B, C, L) waves shifted right by the (B, C) or (B, 1) integer `shifts` (left if negative), zero-filled,
+    i.e. A.Shift(rollover=False) for every sample and channel in one gather
+    """
+    length = x.shape[-1]
+    index = torch.arange(length, device=x.device) - shifts[..., None]
+    # index `length` picks the zero column added by F.pad
+    index = torch.where((index >= 0) & (index < length), index, torch.full_like(index, length))
+    return torch.gather(F.pad(x, (0, 1)), -1, index.expand(x.shape))
+
+
+def phase_ramp(shifts, n, channels=1, bins=None):
+    """
+    (B * channels, bins) fft-bin factors exp(-2 pi i k s / n) delaying every sample by its shift s, each row
+    repeated for the channels of the sample, for the first `bins` bins (all n by default, n // 2 + 1 for a rfft).
+    Multiplying a spectrum by it is a circular shift of the wave.
+    """
+    k = torch.arange(n if bins is None else bins, device=shifts.device)
+    # k * s mod n keeps the angle exact for any integer shift
+    angle = (k * shifts.long().view(-1, 1)) % n * (-2 * math.pi / n)
+    return torch.polar(torch.ones_like(angle), angle).to(torch.complex64).repeat_interleave(channels, 0)
+
+
+class BatchAugment:
+    """
+    The conservative and aggressive augmentations of get_tranform_list applied to a whole (B, 3, L) batch with
+    per-sample masks and parameters. Every sample goes through the conservative transforms in turn, each with its
+    `*_proba`, then with probability `aggressive_aug_proba` through one aggressive transform picked by
+    `*_weight`, as in DataRetriever.augment. Without transforms, channels 0 and 1 are swapped and the sign is
+    flipped with probability 0.5 each. Random numbers come from torch.
+
+    With fuse_time_shift, time_shift does not move the samples but adds up the shifts, which __call__ returns
+    next to the batch. The model applies them with phase_ramp inside its whitening FFT: the whitened wave is
+    shifted instead of the raw one, so the samples shifted in come from the reflected extension of the whitening
+    rather than zeros.
+    """
+
+    def __init__(self, Config, fuse_time_shift=False, cons=None):
+        self.Config = Config
+        self.fuse_time_shift = fuse_time_shift
+        if cons is not None:
+            # only the given (name, proba) transforms, e.g. Config.echo_augment
+            self.cons = list(cons)
+            self.aggr = []
+        elif Config.cons_func_names or Config.aggr_func_names:
+            self.cons = [(name, getattr(Config, f'{name}_proba')) for name in Config.cons_func_names]
+            self.aggr = list(Config.aggr_func_names)
+        else:
+            self.cons = [('shuffle01', 0.5), ('vflip', 0.5)]
+            self.aggr = []
+        if self.aggr:
+            weights = torch.tensor([getattr(Config, f'{name}_weight') for name in self.aggr], dtype=torch.float)
+            self.aggr_probas = weights / weights.sum()
+
+    def __call__(self, x):
+        device = x.device
+        shifts = torch.zeros(len(x), dtype=torch.long, device=device) if self.fuse_time_shift else None
+        for name, proba in self.cons:
+            rows = torch.nonzero(torch.rand(len(x), device=device) < proba, as_tuple=True)[0]
+            x = self.apply(name, x, rows, shifts)
+        if self.aggr:
+            aggressive = torch.rand(len(x), device=device) < self.Config.aggressive_aug_proba
+            choice = torch.multinomial(self.aggr_probas.to(device), len(x), replacement=True)
+            for i, name in enumerate(self.aggr):
+                x = self.apply(name, x, torch.nonzero(aggressive & (choice == i), as_tuple=True)[0], shifts)
+        return x, shifts
+
+    def apply(self, name, x, rows, shifts):
+        if len(rows) == 0:
+            return x
+        n, length, device = len(rows), x.shape[-1], x.device
+        if name == 'vflip':
+            x[rows] = -x[rows]
+        elif name == 'shuffle01':
+            x[rows] = x[rows][:, [1, 0, 2]]
+        elif name == 'add_gaussian_noise':
+            amplitude = torch.empty(n, 1, 1, device=device).uniform_(*GAUSSIAN_NOISE)
+            x[rows] += torch.randn(x[rows].shape, device=device) * amplitude
+        elif name == 'timemask':
+            # t ~ U{0, ..., int(L * 0.03)}, t0 ~ U{0, ..., L - t}
+            t = torch.randint(int(length * TIMEMASK_PART) + 1, (n, 1), device=device)
+            t0 = (torch.rand(n, 1, device=device) * (length - t + 1)).long()
+            position = torch.arange(length, device=device)
+            x[rows] *= ~((position >= t0) & (position < t0 + t))[:, None]
+        elif name == 'time_shift':
+            fraction = torch.empty(n, device=device).uniform_(-self.Config.time_shift_left / length,
+                                                              self.Config.time_shift_right / length)
+            steps = torch.round(fraction * length).long()
+            if shifts is not None:
+                shifts[rows] += steps
+            else:
+                x[rows] = shift_waves(x[rows], steps[:, None])
+        elif name == 'shift_channel':
+            fraction = torch.empty(n, device=device).uniform_(-self.Config.shift_channel_left / length,
+                                                              self.Config.shift_channel_right / length)
+            channel = torch.randint(x.shape[1], (n,), device=device)
+            steps = torch.zeros(n, x.shape[1], dtype=torch.long, device=device)
+            steps[torch.arange(n, device=device), channel] = torch.round(fraction * length).long()
+            x[rows] = shift_waves(x[rows], steps)
+        elif name == 'reduce_SNR':
+            multiplier = math.sqrt(1 - self.Config.reduce_SNR_ratio ** 2)
+            noise = torch.randn(x[rows].shape, device=device) * multiplier
+            x[rows] = x[rows] * self.Config.reduce_SNR_ratio + noise
+        else:
+            raise ValueError(f"no batch version of {name}")
+        return x
@@ -14,24 +14,47 @@ class BaseConfig:
     whiten_train_folder = DATA_LOC + "/whiten-train-w0/"
     whiten_test_folder = DATA_LOC + "/whiten-test-w0/"
     avr_w0_path = DATA_LOC + "/avr_w0.pth"
-    sim_data_path = DATA_LOC + '/GW_sim_300k.pkl'
+    sim_data_path = DATA_LOC + '/GW_sim_300k.pkl'  # the GW_sim_300k.npy bank next to it is used once convert_synthetic.py built it
+    sim_data_query = None  # e.g. 'm1 > 30', only injects the bank rows whose gen_synthetic.py parameters match
+    index_path = DATA_LOC + "/dataset_index.npz"  # ids, paths and folds of the competition csv files, see data_index.py
+    exclude_path = DATA_LOC + "/bad_samples.csv"  # written by scan_waves.py, read_data leaves these samples out
+    # 'npy' loads one file per id, 'packed' reads rows of the memory-mapped stores built by pack_waves.py
+    data_backend = 'npy'
+    packed_train_folder = DATA_LOC + "/packed-train/"
+    packed_test_folder = DATA_LOC + "/packed-test/"
+    packed_whiten_train_folder = DATA_LOC + "/packed-whiten-train/"
+    packed_whiten_test_folder = DATA_LOC + "/packed-whiten-test/"
+    score_appended = False  # with data_backend 'packed', test_df also holds the segments added by append_waves.py
 
     use_raw_wave = True
+    fast_cqt = False  # CQT of the 2D models in the frequency domain, see cqt.py
+    native_cqt = False  # 2D models compute their CQT images at cqt_image_size instead of interpolating them to 256x256
+    cqt_image_size = (256, 256)  # frequency bins x time frames
+    cqt_drop_bands = ()  # (low, high) Hz bands left out of the native CQT images
     use_checkpoint = False
     checkpoint_folder=None
     prev_model_folder = None
     debug = False
     use_subset = False
     subset_frac = 0.4
+    # 'random' sample, or a 'kcenter'/'herding' coreset of the embeddings of a trained model, see coreset.py
+    subset_method = 'random'
+    subset_model_config = 'V2'  # configuration and fold of the checkpoint the coreset embeddings come from
+    subset_fold = 0
+    coreset_folder = DATA_LOC + "/coreset/"
     # augmentation
     do_advance_trans = False
     cons_funcs = None
     aggr_funcs = None
     cons_func_names = None
     aggr_func_names = None
+    batch_augment = False  # augment whole batches in torch instead of sample by sample, see batch_augment.py
+    fuse_time_shift = False  # with batch_augment and use_raw_wave, time_shift is applied in the model's whitening FFT
     vflip = False
     shuffle01 = False
     time_shift = False
+    time_shift_left = 96
+    time_shift_right = 96
     time_stretch = False
     shuffle_channels = False  # need normalization first
     add_gaussian_noise = False  # need normalization first
@@ -68,6 +91,24 @@ class BaseConfig:
     swa_anneal_ratio = 999,  # 999 means anneal til the end of the training
     # speedup
     num_workers = 7
+    worker_pool = False  # start the loader workers once and reuse them for every fold, phase and TTA variant
+    echo_factor = 1  # train on every loaded batch this many times, each with new echo_augment draws, see echo.py
+    echo_buffer = 1024  # samples in the shuffle buffer the echoed copies go through
+    echo_augment = {'vflip': 0.5, 'shuffle01': 0.5, 'time_shift': 0.5}  # transform: probability, for every copy
+    target_auc = None  # report the training time until the validation AUC first reaches it
+    loss_sampler = False  # oversample the training samples with a high loss, see sampler.LossAwareSampler
+    loss_sampler_warmup = 1  # epochs of uniform sampling while the per-sample loss EMA builds up
+    loss_sampler_momentum = 0.9
+    loss_sampler_floor = 0.2  # share of the uniform probability every sample keeps, importance weights <= 1 / floor
+    balanced_batches = False  # training batches with a fixed positive:negative mix, see sampler.PosNegBatchSampler
+    batch_pos_fraction = None  # share of positives among the 0/1 targets of a batch, None: their share in the data
+    batch_read = False  # read whole batches with one call instead of one sample at a time
+    shm_cache = False  # keep the waves read during training in shared memory for the later epochs and folds
+    shm_cache_bytes = 16 * 2 ** 30  # rows beyond this budget are read from disk
+    whiten_cache = False  # with use_raw_wave and shm_cache, cache the waves whitened and augment after whitening
+    block_shuffle = False  # shuffle blocks of neighbouring files/rows instead of single samples, see sampler.py
+    block_size = 256
+    block_window = 4  # blocks shuffled together
     use_cudnn = True
     use_dp = False  # dataparallel
     use_gradScaler = True
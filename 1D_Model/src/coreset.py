@@ -0,0 +1,172 @@
+import os
+import hashlib
+import numpy as np
+import torch
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import PCA
+from tqdm import tqdm
+
+
+class CellIndex:
+    """
+    Approximate nearest neighbour index (inverted file): the points are split into cells by k-means and a query
+    only looks at the points of the `n_probe` cells with the nearest (or best scoring) centroids
+    """
+
+    def __init__(self, x, n_cells, seed=0):
+        kmeans = MiniBatchKMeans(n_cells, batch_size=4096, n_init=3, random_state=seed).fit(x)
+        self.centroids = kmeans.cluster_centers_
+        order = np.argsort(kmeans.labels_, kind='stable')
+        self.cells = np.split(order, np.cumsum(np.bincount(kmeans.labels_, minlength=n_cells))[:-1])
+
+    def nearest_cells(self, q, n_probe):
+        dist = ((self.centroids - q) ** 2).sum(1)
+        return np.argsort(dist)[:n_probe]
+
+    def best_cells(self, w, n_probe):
+        return np.argsort(-(self.centroids @ w))[:n_probe]
+
+
+def kcenter_greedy(x, k, index, n_probe=8, seed=0):
+    """
+    Greedy k-center: every new center is the point farthest from the centers so far. Adding a center only updates
+    the distances of the points in its n_probe nearest cells, the farthest point is found through the per cell max.
+    """
+    min_dist = np.full(len(x), np.inf)
+    # cells without any center nearby come first, empty ones never
+    cell_max = np.array([np.inf if len(members) else -1.0 for members in index.cells])
+    cell_of = np.empty(len(x), dtype=int)
+    for c, members in enumerate(index.cells):
+        cell_of[members] = c
+    center = np.random.RandomState(seed).randint(len(x))
+    selected = []
+    for _ in tqdm(range(k)):
+        selected.append(center)
+        min_dist[center] = 0
+        cells = set(index.nearest_cells(x[center], n_probe)) | {cell_of[center]}
+        for c in cells:
+            members = index.cells[c]
+            if len(members) == 0:
+                continue
+            dist = ((x[members] - x[center]) ** 2).sum(1)
+            min_dist[members] = np.minimum(min_dist[members], dist)
+            cell_max[c] = min_dist[members].max()
+        members = index.cells[int(np.argmax(cell_max))]
+        center = members[np.argmax(min_dist[members])]
+    return np.array(selected)
+
+
+def herding(x, k, index, n_probe=8):
+    """
+    Kernel herding with a linear kernel: every step takes the point that best moves the mean of the selection
+    towards the mean of x, searched in the n_probe cells whose centroids score best
+    """
+    mu = x.mean(0)
+    w = mu.copy()
+    available = np.ones(len(x), dtype=bool)
+    selected = []
+    for _ in tqdm(range(k)):
+        candidates = np.concatenate([index.cells[c] for c in index.best_cells(w, n_probe)])
+        candidates = candidates[available[candidates]]
+        if len(candidates) == 0:
+            candidates = np.flatnonzero(available)
+        best = candidates[np.argmax(x[candidates] @ w)]
+        selected.append(best)
+        available[best] = False
+        w += mu - x[best]
+    return np.array(selected)
+
+
+def select_coreset(features, strata, frac, method='kcenter', seed=0, dim=32, n_probe=8):
+    """indices of a `frac` coreset of `features`, every stratum keeps its share of the samples"""
+    features = PCA(min(dim, features.shape[1]), random_state=seed).fit_transform(features)
+    selected = []
+    for stratum in np.unique(strata):
+        idx = np.flatnonzero(strata == stratum)
+        k = int(round(frac * len(idx)))
+        if k == 0:
+            continue
+        x = features[idx]
+        index = CellIndex(x, max(1, int(np.sqrt(len(idx)))), seed)
+        print(f"Stratum {stratum}: {k}/{len(idx)} samples, {len(index.cells)} cells")
+        if method == 'kcenter':
+            chosen = kcenter_greedy(x, k, index, n_probe, seed)
+        elif method == 'herding':
+            chosen = herding(x, k, index, n_probe)
+        else:
+            raise ValueError(f"unknown coreset method {method}")
+        selected.append(idx[chosen])
+    return np.sort(np.concatenate(selected))
+
+
+def checkpoint_key(path):
+    stat = os.stat(path)
+    return hashlib.sha1(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime}".encode()).hexdigest()[:12]
+
+
+def get_embeddings(train_df, Config):
+    """
+    Penultimate features (the input of the last layer of `model.head`) and BCE loss of every sample of train_df
+    under the fold Config.subset_fold checkpoint of Config.subset_model_config
+    """
+    from .config import read_config
+    from .data_index import load_index, index_paths
+    from .dataset import DataRetrieverTest, get_loader
+    from .infer_helper import load_fold_model, checkpoint_path, unwrap_model
+    from .util import get_device
+
+    EmbConfig = read_config(Config.subset_model_config)
+    EmbConfig.device = get_device()
+    path = checkpoint_path(Config.subset_fold, EmbConfig)
+    cache_path = os.path.join(Config.coreset_folder, f"embeddings_{checkpoint_key(path)}.npz")
+    rows = train_df['row'].values
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as f:
+            if np.array_equal(f['rows'], rows):
+                return f['features'], f['losses'], path
+
+    print(f"Embed {len(train_df)} samples with {path}")
+    # on the bare network, so the hook sees the batches whole and in order (DataParallel calls it once per replica)
+    model = unwrap_model(load_fold_model(Config.subset_fold, EmbConfig))
+    features = []
+    handle = model.head[-1].register_forward_hook(lambda module, inputs, output: features.append(inputs[0].float().cpu()))
+    index = load_index(EmbConfig.kaggleDataFolder, EmbConfig.index_path)
+    paths = index_paths(index, 'train', EmbConfig, rows)
+    dataset = DataRetrieverTest(paths, train_df['target'].values, Config=EmbConfig, rows=rows)
+    loader = get_loader(dataset, EmbConfig, EmbConfig.batch_size * 2, shuffle=False)
+    losses = []
+    with torch.no_grad():
+        for X, targets in tqdm(loader):
+            outputs = model(X.to(EmbConfig.device)).view(-1).float().cpu()
+            losses.append(torch.nn.functional.binary_cross_entropy_with_logits(
+                outputs, targets.view(-1).float(), reduction='none'))
+    handle.remove()
+    features, losses = torch.cat(features).numpy(), torch.cat(losses).numpy()
+    os.makedirs(Config.coreset_folder, exist_ok=True)
+    np.savez(cache_path + '.tmp.npz', features=features, losses=losses, rows=rows)
+    os.replace(cache_path + '.tmp.npz', cache_path)
+    return features, losses, path
+
+
+def coreset_rows(train_df, Config, n_loss_bins=4):
+    """
+    Rows of a Config.subset_frac coreset of train_df (Config.subset_method 'kcenter' or 'herding'), stratified by
+    target and by loss quantile within the target, cached by (checkpoint, method, fraction, seed)
+    """
+    features, losses, path = get_embeddings(train_df, Config)
+    cache_path = os.path.join(Config.coreset_folder, f"coreset_{checkpoint_key(path)}_{Config.subset_method}_"
+                                                     f"{Config.subset_frac}_{Config.seed}.npy")
+    if os.path.exists(cache_path):
+        return np.load(cache_path)
+
+    targets = np.round(train_df['target'].values).astype(int)
+    strata = np.zeros(len(train_df), dtype=int)
+    for target in np.unique(targets):
+        idx = np.flatnonzero(targets == target)
+        edges = np.quantile(losses[idx], np.linspace(0, 1, n_loss_bins + 1)[1:-1])
+        strata[idx] = target * n_loss_bins + np.searchsorted(edges, losses[idx])
+    selected = select_coreset(features, strata, Config.subset_frac, Config.subset_method, Config.seed)
+    rows = train_df['row'].values[selected]
+    np.save(cache_path + '.tmp.npy', rows)
+    os.replace(cache_path + '.tmp.npy', cache_path)
+    return rows
@@ -0,0 +1,123 @@
+import os
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import StratifiedKFold
+
+CSV_NAMES = {'train': 'training_labels.csv', 'test': 'sample_submission.csv'}
+
+# Dataset index: one .npz with, per split, the ids, targets and relative raw paths in csv order,
+# plus one fold column `fold_{seed}` per seed asked so far.
+# Segments added with append_index are kept in `appended_*` arrays and follow the test rows, they only exist in the
+# packed test stores and are left out of the test split unless asked for with `appended`.
+
+
+def _csv_stamp(data_folder):
+    paths = [os.path.join(data_folder, name) for name in CSV_NAMES.values()]
+    return np.array([[os.path.getsize(path), os.path.getmtime(path)] for path in paths])
+
+
+def _relpath(ids):
+    ids = pd.Series(ids)
+    return np.asarray(ids.str[0] + '/' + ids.str[1] + '/' + ids.str[2] + '/' + ids + '.npy', dtype=str)
+
+
+def build_index(data_folder):
+    index = {'stamp': _csv_stamp(data_folder)}
+    for split, name in CSV_NAMES.items():
+        df = pd.read_csv(os.path.join(data_folder, name))
+        index[f'{split}_id'] = np.asarray(df['id'], dtype=str)
+        index[f'{split}_target'] = df['target'].values
+        index[f'{split}_relpath'] = _relpath(df['id'])
+    return index
+
+
+def _split_array(index, split, name, appended=False):
+    values = index[f'{split}_{name}']
+    if appended and split == 'test' and f'appended_{name}' in index:
+        values = np.concatenate([values, index[f'appended_{name}']])
+    return values
+
+
+def assign_folds(target, seed, n_splits=5):
+    """same folds as StratifiedKFold(n_splits, shuffle=True, random_state=seed) over the rows of `target`"""
+    skf = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed)
+    fold = np.full(len(target), -1, dtype=np.int8)
+    for k, (_, valid_index) in enumerate(skf.split(target, target)):
+        fold[valid_index] = k
+    return fold
+
+
+def save_index(index, index_path):
+    tmp_path = index_path + '.tmp.npz'
+    np.savez(tmp_path, **index)
+    os.replace(tmp_path, index_path)
+
+
+def load_index(data_folder, index_path, seed=None):
+    """load the index, (re)building it when the competition csv files changed and adding the folds of `seed`"""
+    index = None
+    if os.path.exists(index_path):
+        with np.load(index_path) as f:
+            index = dict(f)
+        if not np.array_equal(index['stamp'], _csv_stamp(data_folder)):
+            print("Dataset index is out of date")
+            index = None
+    changed = index is None
+    if changed:
+        print("Build dataset index")
+        appended = {}
+        if os.path.exists(index_path):
+            with np.load(index_path) as f:
+                appended = {key: f[key] for key in f if key.startswith('appended_')}
+        index = dict(build_index(data_folder), **appended)
+    if seed is not None and f'fold_{seed}' not in index:
+        index[f'fold_{seed}'] = assign_folds(index['train_target'], seed)
+        changed = True
+    if changed:
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+        save_index(index, index_path)
+    return index
+
+
+def append_index(data_folder, index_path, ids, target=None):
+    """add new test segments after the existing test rows and return their global rows"""
+    index = load_index(data_folder, index_path)
+    ids = np.asarray(ids, dtype=str)
+    target = np.full(len(ids), 0.5) if target is None else np.asarray(target, dtype=float)
+    first_row = len(index['train_id']) + len(_split_array(index, 'test', 'id', appended=True))
+    for name, values in [('id', ids), ('target', target), ('relpath', _relpath(ids))]:
+        key = f'appended_{name}'
+        index[key] = np.concatenate([index[key], values]) if key in index else values
+    save_index(index, index_path)
+    return first_row + np.arange(len(ids))
+
+
+def index_frame(index, split, seed=None, appended=False):
+    """
+    id, target and global row (see wave_store.PackedWaveReader) of `split`, with the folds of `seed` for train and
+    the appended segments after the test rows with `appended`
+    """
+    offset = 0 if split == 'train' else len(index['train_id'])
+    df = pd.DataFrame({'id': _split_array(index, split, 'id', appended).astype(object),
+                       'target': _split_array(index, split, 'target', appended)})
+    df['row'] = offset + np.arange(len(df))
+    if seed is not None and split == 'train':
+        df['fold'] = index[f'fold_{seed}']
+    return df
+
+
+def index_positions(index, split, ids, appended=False):
+    return pd.Index(_split_array(index, split, 'id', appended)).get_indexer(ids)
+
+
+def index_paths(index, split, Config, positions=None, appended=False):
+    """vectorized id_2_path_wave for the index entries `positions` of `split` (all of them by default)"""
+    if Config.use_raw_wave:
+        folder = "{}/{}/".format(Config.kaggleDataFolder, split)
+        names, suffix = _split_array(index, split, 'relpath', appended), ''
+    else:
+        folder = "{}/".format(Config.whiten_train_folder if split == 'train' else Config.whiten_test_folder)
+        names, suffix = _split_array(index, split, 'id', appended), '.npy'
+    if positions is not None:
+        names = names[positions]
+    return folder + names.astype(object) + suffix
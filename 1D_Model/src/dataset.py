@@ -1,36 +1,102 @@
+import os
 import pickle5 as pickle
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, DataLoader, BatchSampler, RandomSampler, SequentialSampler
+from torch.utils.data.dataloader import default_collate
 import torch
 import random
 import numpy as np
 import pandas as pd
-from sklearn.model_selection import StratifiedKFold
-from .util import id_2_path_wave
+from .data_index import load_index, index_frame, index_paths, index_positions, assign_folds
+from .wave_store import get_wave_reader, WAVE_SHAPE
+from .sampler import BlockShuffleSampler, LossAwareSampler, PosNegBatchSampler
+from .injection import SignalInjector
+from .batch_augment import BatchAugment
+from .integrity import read_bad_samples, has_scan
+from .coreset import coreset_rows
+from .worker_pool import PooledLoader
 
 
-class DataRetriever(Dataset):
-    def __init__(self, paths, targets, synthetic=None, Config=None):
+class WaveDataset(Dataset):
+    """
+    Base class of the wave datasets. `dataset[index]` returns one sample, `dataset[list_of_indices]` returns
+    the whole batch at once, which is what `get_loader` asks for when Config.batch_read is set.
+    Subclasses define both, as get_item(index) and get_items(indices).
+    """
+
+    def __init__(self, paths, targets, rows=None, reader=None, cache=None, whitener=None):
         self.paths = paths
         self.targets = targets
+        self.rows = rows
+        self.reader = reader
+        self.cache = cache
+        # raw waves are whitened as they are read, so the cache holds the model input, see whiten.get_whitener
+        self.whitener = whitener
+
+    def __len__(self):
+        return len(self.paths)
+
+    def read_wave(self, index):
+        if self.reader is None:
+            wave = np.load(self.paths[index])
+        else:
+            wave = self.reader.read(self.rows[index])
+        return wave if self.whitener is None else self.whitener(wave[None])[0]
+
+    def read_waves(self, indices):
+        if self.reader is None:
+            waves = np.empty((len(indices),) + WAVE_SHAPE, dtype=np.float32)
+            for i, index in enumerate(indices):
+                waves[i] = np.load(self.paths[index])
+        else:
+            waves = self.reader.read_batch(self.rows[indices])
+        return waves if self.whitener is None else self.whitener(waves)
+
+    def load_wave(self, index):
+        if self.cache is None:
+            return self.read_wave(index)
+        row = self.rows[index]
+        wave = self.cache.read(row)
+        if wave is None:
+            wave = self.read_wave(index)
+            self.cache.write(row, wave)
+        return wave
+
+    def load_waves(self, indices):
+        if self.cache is None:
+            return self.read_waves(indices)
+        rows = self.rows[indices]
+        waves, hit = self.cache.read_batch(rows)
+        if not hit.all():
+            waves[~hit] = self.read_waves(indices[~hit])
+            self.cache.write_batch(rows[~hit], waves[~hit])
+        return waves
+
+    def __getitem__(self, index):
+        if isinstance(index, (list, np.ndarray)):
+            return self.get_items(np.asarray(index))
+        return self.get_item(index)
+
+
+class DataRetriever(WaveDataset):
+    def __init__(self, paths, targets, synthetic=None, Config=None, rows=None, cache=None, whitener=None):
+        super().__init__(paths, targets, rows, get_wave_reader(Config), cache, whitener)
+        # whitened waves go to the model as they are
+        self.use_raw_wave = Config.use_raw_wave and whitener is None
         self.synthetic = synthetic
-        self.synthetic_keys = list(self.synthetic.keys()) if synthetic is not None else None
-        self.neg_idxes = [i for i, t in enumerate(targets) if t == 0]
+        self.neg_idxes = np.flatnonzero(np.asarray(targets) == 0)
+        # positives are replaced by a negative here, the signal is added to the whole batch at collate time
+        self.injector = SignalInjector(synthetic) if synthetic is not None else None
+        # the time shift can only be fused where the model whitens, and before mixup mixes the samples
+        self.batch_augment = BatchAugment(Config, Config.fuse_time_shift and self.use_raw_wave
+                                          and not Config.use_mixup) if Config.batch_augment else None
+        self.collate_fn = self.collate if synthetic is not None or Config.batch_augment else None
 
         self.Config = Config
         self.cons_funcs = Config.cons_funcs
         self.aggr_funcs = Config.aggr_funcs
         self.aggr_func_names = Config.aggr_func_names
 
-    def __len__(self):
-        return len(self.paths)
-
-    def __getitem__(self, index):
-        target = self.targets[index]
-        path = self.paths[index]
-        if target > 0 and (self.synthetic is not None):
-            path = self.paths[random.choice(self.neg_idxes)]
-        waves = np.load(path)
-
+    def augment(self, waves):
         if self.cons_funcs or self.aggr_funcs:
             if self.cons_funcs:
                 for transform in self.cons_funcs:
@@ -47,44 +113,121 @@ class DataRetriever(Dataset):
                 waves[[0, 1]] = waves[[1, 0]]
             if np.random.random() < 0.5:
                 waves = -waves
+        return waves
 
-        x = torch.FloatTensor(waves * 1e20) if self.Config.use_raw_wave else torch.FloatTensor(waves)
+    def get_item(self, index):
+        target = self.targets[index]
         if target > 0 and (self.synthetic is not None):
-            w = torch.FloatTensor((self.synthetic[random.choice(self.synthetic_keys)]))
-            w = w * max(random.gauss(3.6, 1), 1)
-            shift_place = 512 + 384 - random.randrange(0, 768)
-            w = np.pad(w[:, shift_place:], [(0, 0), (0, shift_place)], mode='constant')
-            x += w
+            index = random.choice(self.neg_idxes)
+        waves = self.load_wave(index)
+        if self.batch_augment is not None:
+            # augmented and scaled with the rest of the batch in collate
+            return torch.FloatTensor(waves), torch.tensor(target, dtype=torch.float)
+        waves = self.augment(waves)
+
+        x = torch.FloatTensor(waves * 1e20) if self.use_raw_wave else torch.FloatTensor(waves)
         target = torch.tensor(target, dtype=torch.float)
         return x, target
 
+    def get_items(self, indices):
+        targets = self.targets[indices]
+        injected = (targets > 0) if self.synthetic is not None else np.zeros(len(indices), dtype=bool)
+        indices = indices.copy()
+        indices[injected] = np.random.choice(self.neg_idxes, injected.sum())
+        waves = self.load_waves(indices)
+        if self.batch_augment is None:
+            for i in range(len(waves)):
+                waves[i] = self.augment(waves[i])
+            if self.use_raw_wave:
+                waves *= 1e20
+        return self.batch_transform(torch.from_numpy(waves), torch.tensor(targets, dtype=torch.float))
 
-class DataRetrieverTest(Dataset):
-    def __init__(self, paths, targets, transforms=None, Config=None):
-        self.paths = paths
-        self.targets = targets
+    def batch_transform(self, x, targets):
+        """
+        batch augmentation (then the scaling it was left out of) and signal injection of a stacked batch,
+        (x, targets) or (x, targets, shifts) when the time shift is left to the model
+        """
+        shifts = None
+        if self.batch_augment is not None:
+            x, shifts = self.batch_augment(x)
+            if self.use_raw_wave:
+                x *= 1e20
+        if self.injector is not None:
+            x = self.injector(x, targets > 0)
+        return (x, targets) if shifts is None else (x, targets, shifts)
+
+    def collate(self, batch):
+        return self.batch_transform(*default_collate(batch))
+
+
+class DataRetrieverTest(WaveDataset):
+    def __init__(self, paths, targets, transforms=None, Config=None, rows=None, cache=None, whitener=None):
+        super().__init__(paths, targets, rows, get_wave_reader(Config), cache, whitener)
+        self.use_raw_wave = Config.use_raw_wave and whitener is None
         self.transforms = transforms
         self.Config = Config
 
-    def __len__(self):
-        return len(self.paths)
-
-    def __getitem__(self, index):
-        path = self.paths[index]
-        waves = np.load(path).astype(np.float32)
+    def get_item(self, index):
+        waves = self.load_wave(index).astype(np.float32)
         target = self.targets[index]
         if self.transforms is not None:
             waves = self.transforms(waves, sample_rate=2048)
-        x = torch.FloatTensor(waves * 1e20) if self.Config.use_raw_wave else torch.FloatTensor(waves)
+        x = torch.FloatTensor(waves * 1e20) if self.use_raw_wave else torch.FloatTensor(waves)
         target = torch.tensor(target, dtype=torch.float)
         return x, target
 
+    def get_items(self, indices):
+        waves = self.load_waves(indices)
+        if self.transforms is not None:
+            for i in range(len(waves)):
+                waves[i] = self.transforms(waves[i], sample_rate=2048)
+        if self.use_raw_wave:
+            waves *= 1e20
+        return torch.from_numpy(waves), torch.tensor(self.targets[indices], dtype=torch.float)
+
+
+def get_sampler(dataset, Config, shuffle=False):
+    if shuffle and Config.loss_sampler:
+        return LossAwareSampler(len(dataset), Config.loss_sampler_warmup, Config.loss_sampler_momentum,
+                                Config.loss_sampler_floor, seed=Config.seed)
+    if shuffle and Config.block_shuffle:
+        # neighbours on disk: rows of the packed store, or files of the same directory
+        keys = dataset.rows if dataset.reader is not None else dataset.paths
+        return BlockShuffleSampler(keys, Config.block_size, Config.block_window, seed=Config.seed)
+    return RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+
+
+def get_loader(dataset, Config, batch_size, shuffle=False, pool=None, sampler=None):
+    if shuffle and Config.balanced_batches:
+        # every training batch gets positives and negatives, see sampler.PosNegBatchSampler
+        batch_sampler = PosNegBatchSampler(dataset.targets, batch_size, Config.batch_pos_fraction, seed=Config.seed)
+    else:
+        if sampler is None:
+            sampler = get_sampler(dataset, Config, shuffle)
+        batch_sampler = BatchSampler(sampler, batch_size, drop_last=False)
+    if pool is not None:
+        # the dataset is handed to the already running workers of the pool, see worker_pool.py
+        return PooledLoader(pool, dataset, batch_sampler, Config.batch_read)
+    if Config.batch_read:
+        # the sampler hands out whole batches and the dataset reads each one in a single call
+        return DataLoader(dataset,
+                          sampler=batch_sampler,
+                          batch_size=None,
+                          num_workers=Config.num_workers, pin_memory=True)
+    return DataLoader(dataset,
+                      batch_sampler=batch_sampler, collate_fn=getattr(dataset, 'collate_fn', None),
+                      num_workers=Config.num_workers, pin_memory=True)
+
 
 def generate_PL(fold, train_df, Config):
     if Config.PL_folder is None:
         return train_df
     pseudo_label_df = pd.read_csv(Config.PL_folder + f"/test_Fold_{fold}.csv")
-    pseudo_label_df['file_path'] = pseudo_label_df['id'].apply(lambda x: id_2_path_wave(x, Config, False))
+    index = load_index(Config.kaggleDataFolder, Config.index_path)
+    positions = index_positions(index, 'test', pseudo_label_df['id'], appended=Config.score_appended)
+    pseudo_label_df['file_path'] = index_paths(index, 'test', Config, positions, appended=Config.score_appended)
+    pseudo_label_df['row'] = len(index['train_id']) + positions
+    pseudo_label_df = pseudo_label_df[~pseudo_label_df['id'].isin(read_bad_samples(Config, 'test'))]
     pseudo_label_df["target"] = pseudo_label_df[f'preds_Fold_{fold}']
     test_df_2 = pseudo_label_df.copy()
     test_df_2['fold'] = -1
@@ -101,34 +244,79 @@ def generate_PL(fold, train_df, Config):
     return PL_train_df
 
 
+def bank_path(sim_data_path):
+    """the .npy bank of `sim_data_path`, which is either that bank or the pickled dict it is converted from"""
+    return os.path.splitext(sim_data_path)[0] + '.npy'
+
+
 def read_synthetic(Config):
+    """
+    Synthetic signals as one (K, 3, L) array. The .npy bank written by convert_synthetic is memory-mapped,
+    forked workers then share its pages instead of each touching (and copying) a dict of K arrays.
+    With Config.sim_data_query, only the rows of a gen_synthetic.py bank whose parameters match are loaded.
+    """
     if not Config.synthetic: return None
     print("Read Synthetic Data")
+    npy_path = bank_path(Config.sim_data_path)
+    if os.path.exists(npy_path):
+        bank = np.load(npy_path, mmap_mode='r')
+        if Config.sim_data_query is None: return bank
+        rows = pd.read_csv(npy_path[:-len('.npy')] + '.params.csv',
+                           index_col='row').query(Config.sim_data_query).index.values
+        print(f"{len(rows)}/{len(bank)} synthetic signals match {Config.sim_data_query}")
+        return np.asarray(bank[np.sort(rows)])
+    if Config.sim_data_path.endswith('.npy') or Config.sim_data_query is not None:
+        raise FileNotFoundError(f"{npy_path} not found, build it with convert_synthetic.py or gen_synthetic.py")
+    print(f"{npy_path} not found, reading {Config.sim_data_path} (run convert_synthetic.py to share one bank)")
     with open(Config.sim_data_path, 'rb') as handle:
         signal_dict = pickle.load(handle)
-    return signal_dict
+    return np.stack(list(signal_dict.values())).astype(np.float32)
+
+
+def convert_synthetic(pkl_path, npy_path):
+    """write the pickled dict of synthetic signals as the (K, 3, L) float32 bank read by read_synthetic"""
+    with open(pkl_path, 'rb') as handle:
+        signal_dict = pickle.load(handle)
+    first = next(iter(signal_dict.values()))
+    bank = np.lib.format.open_memmap(npy_path, mode='w+', dtype=np.float32, shape=(len(signal_dict),) + first.shape)
+    for i, signals in enumerate(signal_dict.values()):
+        bank[i] = signals
+    bank.flush()
+    return bank
 
 
 def read_data(Config):
     print("Read Data")
-    train_df = pd.read_csv(Config.kaggleDataFolder + '/training_labels.csv')
-    test_df = pd.read_csv(Config.kaggleDataFolder + '/sample_submission.csv')
+    index = load_index(Config.kaggleDataFolder, Config.index_path, Config.seed)
+    # rows follow the csv files, see wave_store.PackedWaveReader
+    train_df = index_frame(index, 'train', Config.seed)
+    if Config.score_appended and Config.data_backend != 'packed':
+        raise ValueError("score_appended needs data_backend='packed', the appended segments have no .npy files")
+    test_df = index_frame(index, 'test', appended=Config.score_appended)
+    train_df['file_path'] = index_paths(index, 'train', Config)
+    test_df['file_path'] = index_paths(index, 'test', Config, appended=Config.score_appended)
+    if not has_scan(Config):
+        print(f"WARNING: no bad sample list at {Config.exclude_path}, run scan_waves.py; "
+              f"until then NaN outputs are masked out of the loss")
+    bad_ids = read_bad_samples(Config, 'train')
+    if len(bad_ids):
+        # corrupt or degenerate waves found by scan_waves.py, the training loop only guards against NaN without a scan
+        train_df = train_df[~train_df['id'].isin(bad_ids)].reset_index(drop=True)
+        print(f"Exclude {len(bad_ids)} bad train samples")
 
     if Config.debug:
         Config.epochs = 1
         train_df = train_df.sample(n=50000, random_state=Config.seed).reset_index(drop=True)
         test_df = test_df.sample(n=10000, random_state=Config.seed).reset_index(drop=True)
-    if Config.use_subset:
+    if Config.use_subset and Config.subset_method == 'random':
         train_df = train_df.sample(frac=Config.subset_frac, random_state=Config.seed).reset_index(drop=True)
+    elif Config.use_subset:
+        rows = coreset_rows(train_df, Config)
+        train_df = train_df[train_df['row'].isin(rows)].reset_index(drop=True)
+        print(f"Coreset of {len(train_df)} samples ({Config.subset_method})")
 
-    train_df['file_path'] = train_df['id'].apply(lambda x: id_2_path_wave(x, Config, True))
-    test_df['file_path'] = test_df['id'].apply(lambda x: id_2_path_wave(x, Config, False))
-
-    print("StratifiedKFold")
-    skf = StratifiedKFold(n_splits=5, shuffle=True, random_state=Config.seed)
-    splits = skf.split(train_df, train_df["target"])
-    train_df['fold'] = -1
-    for fold, (train_index, valid_index) in enumerate(splits):
-        train_df.loc[valid_index, "fold"] = fold
-    train_df.groupby('fold')['target'].apply(lambda s: s.value_counts(normalize=True))
+    if Config.debug or Config.use_subset:
+        # the cached folds are for the full train set, a sample is split on its own
+        print("StratifiedKFold")
+        train_df['fold'] = assign_folds(train_df['target'].values, Config.seed)
     return train_df, test_df
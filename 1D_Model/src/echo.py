@@ -0,0 +1,54 @@
+import math
+import torch
+from .batch_augment import BatchAugment
+
+
+class EchoLoader:
+    """
+    Data echoing for input-bound training: every batch of `loader` is used `factor` times, each copy with its own
+    draw of `augment` (a BatchAugment), on `device`. The copies go through a shuffle buffer of `buffer_size`
+    samples and the batches handed out are random picks from it, so the repeats of a sample end up in different
+    batches and are mixed with the samples of the next loaded batches.
+    """
+
+    def __init__(self, loader, factor, augment, batch_size, buffer_size, device):
+        self.loader = loader
+        self.factor = factor
+        self.augment = augment
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.device = device
+
+    def __len__(self):
+        return math.ceil(len(self.loader.dataset) * self.factor / self.batch_size)
+
+    def echo(self, batch):
+        x, shifts = self.augment(batch[0].clone())
+        if len(batch) > 2:
+            shifts = batch[2] if shifts is None else batch[2] + shifts
+        return (x, batch[1]) if shifts is None else (x, batch[1], shifts)
+
+    def take(self, buffer, n):
+        order = torch.randperm(len(buffer[0]), device=self.device)
+        return [t[order[:n]] for t in buffer], [t[order[n:]] for t in buffer]
+
+    def __iter__(self):
+        buffer = None
+        for batch in self.loader:
+            batch = [t.to(self.device, non_blocking=True) for t in batch]
+            copies = [torch.cat(parts) for parts in zip(*[self.echo(batch) for _ in range(self.factor)])]
+            buffer = copies if buffer is None else [torch.cat(parts) for parts in zip(buffer, copies)]
+            while len(buffer[0]) >= self.buffer_size + self.batch_size:
+                batch, buffer = self.take(buffer, self.batch_size)
+                yield batch
+        while buffer is not None and len(buffer[0]):
+            batch, buffer = self.take(buffer, self.batch_size)
+            yield batch
+
+
+def get_echo_loader(loader, Config):
+    if Config.echo_factor <= 1:
+        return loader
+    fuse = Config.fuse_time_shift and loader.dataset.use_raw_wave and not Config.use_mixup
+    augment = BatchAugment(Config, fuse, cons=Config.echo_augment.items())
+    return EchoLoader(loader, Config.echo_factor, augment, Config.batch_size, Config.echo_buffer, Config.device)
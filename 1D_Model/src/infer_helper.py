@@ -1,11 +1,12 @@
 from itertools import chain, combinations
 from collections import defaultdict
 from tqdm import tqdm
-from torch.utils.data import DataLoader
 from .util import *
 from .dataset import *
 from .TTA import *
 from .models import getModel
+from .wave_store import get_wave_reader
+from .worker_pool import get_worker_pool
 from torch import nn
 
 
@@ -23,12 +24,10 @@ def get_pred(loader, model, device, use_MC=False, MC_folds=64):
     return predictions
 
 
-def get_tta_pred(df, model, Config, **transforms):
-    data_retriever = TTA(df['file_path'].values, df['target'].values, Config.use_raw_wave, **transforms)
-    loader = DataLoader(data_retriever,
-                        batch_size=Config.batch_size * 2,
-                        shuffle=False,
-                        num_workers=Config.num_workers, pin_memory=True, drop_last=False)
+def get_tta_pred(df, model, Config, pool=None, **transforms):
+    data_retriever = TTA(df['file_path'].values, df['target'].values, Config.use_raw_wave,
+                         rows=df['row'].values, reader=get_wave_reader(Config), **transforms)
+    loader = get_loader(data_retriever, Config, Config.batch_size * 2, shuffle=False, pool=pool)
     return get_pred(loader, model, Config.device, Config.use_MC, Config.MC_folds)
 
 
@@ -38,53 +37,62 @@ def powerset(iterable):
     return chain.from_iterable(combinations(s, r) for r in range(len(s)+1))
 
 
-def get_tta_df(df, model, Config):
+def get_tta_df(df, model, Config, pool=None):
     if Config.cons_func_names or Config.aggr_func_names:
         conserv_transform_powerset = list(powerset(Config.cons_func_names))
         for transformations in conserv_transform_powerset:
             if transformations:  # to avoid double count original
                 print("tta_" + ('_').join(transformations))
-                df["tta_" + ('_').join(transformations)] = get_tta_pred(df, model,
+                df["tta_" + ('_').join(transformations)] = get_tta_pred(df, model, Config, pool,
                                                                          **{transformation: True for transformation
                                                                             in transformations})
             for aggr_transformation in Config.aggr_func_names:
                 print("tta_" + ('_').join(transformations) + '_' + aggr_transformation)
-                df["tta_" + ('_').join(transformations) + '_' + aggr_transformation] = get_tta_pred(df, model, **{
+                df["tta_" + ('_').join(transformations) + '_' + aggr_transformation] = get_tta_pred(df, model, Config, pool, **{
                     transformation: True for transformation in transformations}, **{aggr_transformation: True})
     else:
         if Config.vflip:
-            df["tta_vflip"] = get_tta_pred(df, model, Config, vflip=True)
+            df["tta_vflip"] = get_tta_pred(df, model, Config, pool, vflip=True)
         if Config.shuffle01:
-            df["tta_shuffle01"] = get_tta_pred(df, model, Config, shuffle01=True)
+            df["tta_shuffle01"] = get_tta_pred(df, model, Config, pool, shuffle01=True)
         if Config.vflip and Config.shuffle01:
-            df["tta_vflip_shuffle01"] = get_tta_pred(df, model, Config, vflip=True, shuffle01=True)
+            df["tta_vflip_shuffle01"] = get_tta_pred(df, model, Config, pool, vflip=True, shuffle01=True)
     return df
 
 
-def get_oof_final(train_df, Config):
+def checkpoint_path(fold, Config):
+    if Config.use_swa:
+        return f'{Config.model_output_folder}/Fold_{fold}_swa_model.pth'
+    return f'{Config.model_output_folder}/Fold_{fold}_best_model.pth'
+
+
+def load_fold_model(fold, Config):
+    if Config.model_module == "M3D":
+        Config.fold = fold
+    model = getModel(Config)
+    checkpoint = torch.load(checkpoint_path(fold, Config))
+    if Config.use_swa:
+        swa_model = AveragedModel(model)
+        model = swa_model
+        model.load_state_dict(removeDPModule(checkpoint['model_swa_state_dict']))
+    else:
+        model.load_state_dict(removeDPModule(checkpoint['model_state_dict']))
+    model.to(device=Config.device)
+    if Config.use_dp and torch.cuda.device_count() > 1:
+        model = nn.DataParallel(model)
+    model.eval()
+    return model
+
+
+def get_oof_final(train_df, Config, pool=None):
     oof_all = pd.DataFrame()
     for fold in tqdm(Config.train_folds):
-        if Config.model_module == "M3D":
-            Config.fold = fold
-        model = getModel(Config)
+        model = load_fold_model(fold, Config)
         oof = train_df.query(f"fold=={fold}").copy()
         #oof['preds'] = torch.load(f'{Config.model_output_folder}/Fold_{fold}_best_model.pth')['valid_preds']
         oof['preds'] = 0.5
-        if Config.use_swa:
-            swa_model = AveragedModel(model)
-            checkpoint = torch.load(f'{Config.model_output_folder}/Fold_{fold}_swa_model.pth')
-            model = swa_model
-            model.load_state_dict(removeDPModule(checkpoint['model_swa_state_dict']))
-        else:
-            checkpoint = torch.load(f'{Config.model_output_folder}/Fold_{fold}_best_model.pth')
-            model.load_state_dict(removeDPModule(checkpoint['model_state_dict']))
-
-        model.to(device=Config.device)
-        if Config.use_dp and torch.cuda.device_count() > 1:
-            model = nn.DataParallel(model)
-        model.eval()
-        oof['preds'] = get_tta_pred(oof, model, Config, vflip=False, shuffle01=False)
-        oof = get_tta_df(oof, model, Config)
+        oof['preds'] = get_tta_pred(oof, model, Config, pool, vflip=False, shuffle01=False)
+        oof = get_tta_df(oof, model, Config, pool)
         oof.to_csv(Config.model_output_folder + f"/oof_Fold_{fold}.csv", index=False)
         oof_all = pd.concat([oof_all, oof])
     print("Original:", fast_auc(oof_all['target'], oof_all['preds']))
@@ -156,30 +164,23 @@ def removeDPModule(state_dict):
     return {key.replace("module.", ""): value for key, value in state_dict.items()}
 
 
-def get_test_avg(CV_SCORE, test_df, Config):
+def unwrap_model(model):
+    """the bare network inside the DataParallel and AveragedModel wrappers of load_fold_model"""
+    while isinstance(model, (nn.DataParallel, AveragedModel)):
+        model = model.module
+    return model
+
+
+def get_test_avg(CV_SCORE, test_df, Config, pool=None):
     test_df['target'] = 0
     test_avg = test_df[['id', 'target']].copy()
     test_weight = gen_oof_weight(Config)
     total_weight = 0
     for fold in tqdm(Config.train_folds):
-        if Config.model_module == "M3D":
-            Config.fold = fold
-        model = getModel(Config)
+        model = load_fold_model(fold, Config)
         test_df2 = test_df.copy()
-        if Config.use_swa:
-            swa_model = AveragedModel(model)
-            checkpoint = torch.load(f'{Config.model_output_folder}/Fold_{fold}_swa_model.pth')
-            model = swa_model
-            model.load_state_dict(removeDPModule(checkpoint['model_swa_state_dict']))
-        else:
-            checkpoint = torch.load(f'{Config.model_output_folder}/Fold_{fold}_best_model.pth')
-            model.load_state_dict(removeDPModule(checkpoint['model_state_dict']))
-        model.to(device=Config.device)
-        if Config.use_dp and torch.cuda.device_count() > 1:
-            model = nn.DataParallel(model)
-        model.eval()
-        test_df2['preds' + f'_Fold_{fold}'] = get_tta_pred(test_df2, model, Config, vflip=False, shuffle01=False)
-        test_df2 = get_tta_df(test_df2, model, Config)
+        test_df2['preds' + f'_Fold_{fold}'] = get_tta_pred(test_df2, model, Config, pool, vflip=False, shuffle01=False)
+        test_df2 = get_tta_df(test_df2, model, Config, pool)
         test_df2.to_csv(Config.model_output_folder + f"/test_Fold_{fold}.csv", index=False)
         for col in test_df2.columns:
             if "tta" in col or 'preds' in col:
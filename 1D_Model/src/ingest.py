@@ -0,0 +1,41 @@
+import os
+import numpy as np
+import torch
+from .data_index import load_index, append_index, index_frame
+from .wave_store import PackedWaveStore, append_to_store
+from .whiten import whiten_batch, get_window, avr_w0_hash
+
+
+def check_store(folder, n_expected):
+    if not os.path.exists(os.path.join(folder, 'meta.json')):
+        raise ValueError(f"{folder} does not exist, build it with pack_waves.py/whiten_waves.py first")
+    n = len(PackedWaveStore(folder))
+    if n != n_expected:
+        raise ValueError(f"{folder} has {n} rows but the dataset index has {n_expected} test rows")
+
+
+def append_segments(ids, waves, Config, whiten=True, avr_w0=None):
+    """
+    Add a batch of new raw (B, 3, 4096) strain segments for scoring, after the existing test rows:
+    the raw packed test store gets them as they are, the whitened one (when `whiten`) gets them whitened with
+    avr_w0 and the window it was built with, and the dataset index is published last.
+    Returns the global rows of the new segments.
+    """
+    waves = np.asarray(waves, dtype=np.float32)
+    index = load_index(Config.kaggleDataFolder, Config.index_path)
+    n_test = len(index_frame(index, 'test', appended=True))
+    check_store(Config.packed_test_folder, n_test)
+    if whiten:
+        check_store(Config.packed_whiten_test_folder, n_test)
+        params = PackedWaveStore(Config.packed_whiten_test_folder).meta
+        if avr_w0 is None:
+            avr_w0 = torch.load(Config.avr_w0_path).float()
+        if params.get('avr_w0_sha1', avr_w0_hash(avr_w0)) != avr_w0_hash(avr_w0):
+            raise ValueError(f"{Config.packed_whiten_test_folder} was whitened with another avr_w0")
+        window = get_window(params.get('window', 'tukey'), params.get('alpha', 0.5))
+
+    append_to_store(Config.packed_test_folder, ids, waves)
+    if whiten:
+        white = whiten_batch(torch.from_numpy(waves), window, avr_w0).numpy()
+        append_to_store(Config.packed_whiten_test_folder, ids, white)
+    return append_index(Config.kaggleDataFolder, Config.index_path, ids)
@@ -0,0 +1,41 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+def shift_left(signals, shifts):
+    """
+    (B, C, L) signals shifted left by the (B, C) `shifts` (or (B, 1) for one shift per sample) and zero-filled
+    at the end, i.e. np.pad(w[:, s:], [(0, 0), (0, s)]) for every sample and channel in one gather
+    """
+    length = signals.shape[-1]
+    index = (torch.arange(length) + shifts[..., None]).clamp(max=length)
+    return torch.gather(F.pad(signals, (0, 1)), -1, index.expand(signals.shape))
+
+
+class SignalInjector:
+    """
+    Batched synthetic signal injection. The rows `mask` of a (B, 3, L) batch get random rows of the bank,
+    scaled by max(N(amp_mean, amp_std), amp_min) and shifted left by max_shift - U{0, shift_range - 1} samples,
+    the same distribution DataRetriever drew from sample by sample. Random numbers come from torch, which the
+    DataLoader seeds differently in every worker.
+    """
+
+    def __init__(self, bank, amp_mean=3.6, amp_std=1, amp_min=1, max_shift=896, shift_range=768):
+        self.bank = bank
+        self.amp_mean = amp_mean
+        self.amp_std = amp_std
+        self.amp_min = amp_min
+        self.max_shift = max_shift
+        self.shift_range = shift_range
+
+    def __call__(self, x, mask):
+        rows = torch.nonzero(torch.as_tensor(mask), as_tuple=True)[0]
+        if len(rows) == 0:
+            return x
+        picks = torch.randint(len(self.bank), (len(rows),)).numpy()
+        signals = torch.from_numpy(np.asarray(self.bank[picks], dtype=np.float32))
+        amp = torch.normal(self.amp_mean, self.amp_std, (len(rows), 1, 1)).clamp(min=self.amp_min)
+        shifts = self.max_shift - torch.randint(self.shift_range, (len(rows), 1))
+        x.index_add_(0, rows, shift_left(signals, shifts) * amp)
+        return x
@@ -0,0 +1,95 @@
+import os
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from .wave_store import PackedWaveStore, WAVE_SHAPE
+
+NAN_INF = 1
+ZERO_CHANNEL = 2
+EXTREME_AMPLITUDE = 4
+UNREADABLE = 8
+FLAG_NAMES = {NAN_INF: 'nan_inf', ZERO_CHANNEL: 'zero_channel', EXTREME_AMPLITUDE: 'extreme_amplitude',
+              UNREADABLE: 'unreadable'}
+
+
+def wave_flags(waves, max_amplitude):
+    """bit flags of every (3, 4096) wave of the (B, 3, 4096) batch `waves`"""
+    finite = np.isfinite(waves)
+    flags = np.where(finite.all((1, 2)), 0, NAN_INF)
+    amplitude = np.where(finite, np.abs(waves), 0).max(-1)
+    flags |= np.where((amplitude == 0).any(-1), ZERO_CHANNEL, 0)
+    flags |= np.where(amplitude.max(-1) > max_amplitude, EXTREME_AMPLITUDE, 0)
+    return flags.astype(np.uint8)
+
+
+def flag_names(flags):
+    return '|'.join(name for flag, name in FLAG_NAMES.items() if flags & flag)
+
+
+_worker = {}
+
+
+def _init_worker(source, max_amplitude):
+    _worker.update(source=source, max_amplitude=max_amplitude)
+
+
+def _read(source, positions):
+    if isinstance(source, PackedWaveStore):
+        return source.read_batch(positions)
+    return np.stack([np.load(path) for path in source[positions]])
+
+
+def _scan_chunk(positions):
+    source = _worker['source']
+    try:
+        waves = _read(source, positions)
+        if waves.shape[1:] != WAVE_SHAPE:
+            raise ValueError(f"waves of shape {waves.shape[1:]}")
+        return positions, wave_flags(waves, _worker['max_amplitude'])
+    except Exception:
+        # find out which of them cannot be read
+        flags = np.zeros(len(positions), dtype=np.uint8)
+        for i, position in enumerate(positions):
+            try:
+                wave = _read(source, positions[i:i + 1])
+                flags[i] = UNREADABLE if wave.shape[1:] != WAVE_SHAPE else wave_flags(wave, _worker['max_amplitude'])[0]
+            except Exception:
+                flags[i] = UNREADABLE
+        return positions, flags
+
+
+def scan_waves(source, n, max_amplitude, chunk_size=4096, num_workers=8):
+    """
+    Flags of the n waves of `source` (an array of .npy paths or a PackedWaveStore), checked over a process pool:
+    NaN/Inf values, an all-zero channel, a max |amplitude| above `max_amplitude` or a file that cannot be read
+    """
+    flags = np.zeros(n, dtype=np.uint8)
+    chunks = [np.arange(start, min(n, start + chunk_size)) for start in range(0, n, chunk_size)]
+    with Pool(num_workers, initializer=_init_worker, initargs=(source, max_amplitude)) as pool:
+        for positions, chunk_flags in tqdm(pool.imap_unordered(_scan_chunk, chunks), total=len(chunks)):
+            flags[positions] = chunk_flags
+    return flags
+
+
+def bad_sample_frame(split, ids, rows, flags):
+    bad = np.flatnonzero(flags)
+    return pd.DataFrame({'split': split, 'id': np.asarray(ids)[bad], 'row': np.asarray(rows)[bad],
+                         'flags': flags[bad], 'reason': [flag_names(f) for f in flags[bad]]})
+
+
+def save_bad_samples(bad_df, path):
+    bad_df.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+
+def has_scan(Config):
+    return Config.exclude_path is not None and os.path.exists(Config.exclude_path)
+
+
+def read_bad_samples(Config, split):
+    """ids of `split` listed in Config.exclude_path by scan_waves.py, empty when there is no scan"""
+    if not has_scan(Config):
+        return np.array([], dtype=object)
+    bad_df = pd.read_csv(Config.exclude_path)
+    return bad_df.loc[bad_df['split'] == split, 'id'].values
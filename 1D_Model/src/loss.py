@@ -2,12 +2,75 @@ import torch
 import torch.nn.functional as F
 
 
-def rank_loss(input, target):
+class PairSoftplus(torch.autograd.Function):
+    """
+    sum over all pairs i, j of relu(t_i - t_j) * w_i * w_j * softplus(m - s * (x_i - x_j)) without a B x B matrix:
+    the pairs are summed over blocks of `chunk` rows and the backward pass computes the blocks again instead of
+    keeping them, so memory stays at chunk x B. Sorted by target, row i only pairs with the prefix of smaller
+    targets (a positive with the negatives).
+    """
+
+    @staticmethod
+    def blocks(x, t, chunk):
+        ends = torch.searchsorted(t, t)  # columns with a smaller target, for every row
+        for start in range(0, len(x), chunk):
+            stop = min(start + chunk, len(x))
+            end = int(ends[stop - 1])
+            if end > 0:
+                yield start, stop, end
+
+    @staticmethod
+    def forward(ctx, x, t, w, s, m, chunk):
+        t, order = torch.sort(t)
+        x, w = x[order], w[order]
+        total = x.new_zeros(())
+        for start, stop, end in PairSoftplus.blocks(x, t, chunk):
+            a = torch.relu(t[start:stop, None] - t[None, :end]) * w[start:stop, None] * w[None, :end]
+            total += (a * F.softplus(m - s * (x[start:stop, None] - x[None, :end]))).sum()
+        ctx.save_for_backward(x, t, w, order)
+        ctx.s, ctx.m, ctx.chunk = s, m, chunk
+        return total
+
+    @staticmethod
+    def backward(ctx, grad):
+        x, t, w, order = ctx.saved_tensors
+        s, m = ctx.s, ctx.m
+        grad_sorted = torch.zeros_like(x)
+        for start, stop, end in PairSoftplus.blocks(x, t, ctx.chunk):
+            a = torch.relu(t[start:stop, None] - t[None, :end]) * w[start:stop, None] * w[None, :end]
+            d = a * torch.sigmoid(m - s * (x[start:stop, None] - x[None, :end]))
+            grad_sorted[start:stop] -= s * d.sum(1)
+            grad_sorted[:end] += s * d.sum(0)
+        grad_x = torch.empty_like(grad_sorted)
+        grad_x[order] = grad_sorted
+        return grad_x * grad, None, None, None, None, None
+
+
+def rank_loss(input, target, weight=None, chunk=1024):
+    """
+    mean over the (positive, negative) pairs of -logsigmoid(p - n), weighted by the product of the sample weights
+    if given, computed by PairSoftplus in chunk x B memory
+    """
     input = input.view(-1).float()
     target = target.view(-1)
-    p = input[target == 1]
-    n = input[target == 0]
-    if len(p) == 0: p = torch.Tensor([1]).to(input.device)
-    if len(n) == 0: n = torch.Tensor([-1]).to(input.device)
-    x = p[:, None] - n[None, :]
-    return -F.logsigmoid(x).mean() + 1e-4 * (input ** 2).mean()
+    weight = torch.ones_like(input) if weight is None else weight.view(-1).float()
+    p, wp = input[target == 1], weight[target == 1]
+    n, wn = input[target == 0], weight[target == 0]
+    if len(p) == 0: p, wp = input.new_ones(1), input.new_ones(1)
+    if len(n) == 0: n, wn = -input.new_ones(1), input.new_ones(1)
+    x = torch.cat([p, n])
+    t = torch.cat([torch.ones_like(p), torch.zeros_like(n)])
+    pairs = PairSoftplus.apply(x, t, torch.cat([wp, wn]), 1.0, 0.0, chunk)
+    return pairs / (len(p) * len(n)) + 1e-4 * (input ** 2).mean()
+
+
+def sample_losses(input, target):
+    """
+    per-sample BCE minus the entropy of the target, i.e. the KL divergence: 0 for a perfect prediction, also for
+    the soft targets of pseudo labels
+    """
+    input = input.view(-1).float()
+    target = target.view(-1).float()
+    # xlogy instead of F.binary_cross_entropy, which CUDA autocast refuses
+    entropy = -(torch.xlogy(target, target) + torch.xlogy(1 - target, 1 - target))
+    return (F.binary_cross_entropy_with_logits(input, target, reduction='none') - entropy).clamp(min=0)
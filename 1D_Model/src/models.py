@@ -31,7 +31,11 @@ def M2D(config):
     if config.model_module == 'resnet34':
         model = Model_2D(encoder=config.encoder,
                          use_raw_wave=config.use_raw_wave,
-                         avrSpecDir=config.inputDataFolder)
+                         avrSpecDir=config.inputDataFolder,
+                         fast_cqt=config.fast_cqt,
+                         native_cqt=config.native_cqt,
+                         image_size=config.cqt_image_size,
+                         drop_bands=config.cqt_drop_bands)
     return model
 
 
@@ -62,7 +66,11 @@ def M3D(config):
                              emb_2d=config.model_2D_emb,
                              first=config.first,
                              ps=config.ps,
-                             avrSpecDir=config.inputDataFolder)
+                             avrSpecDir=config.inputDataFolder,
+                             fast_cqt=config.fast_cqt,
+                             native_cqt=config.native_cqt,
+                             image_size=config.cqt_image_size,
+                             drop_bands=config.cqt_drop_bands)
         model.freeze_conv(req_grad=False)
         config.model_module = "M3D"
     return model
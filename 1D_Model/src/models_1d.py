@@ -1,7 +1,7 @@
 import torch
 from torch import nn
-from scipy import signal
 import torch.nn.functional as F
+from .whiten import WhitenFrontend, legacy_whiten_keys
 
 
 class GeM(nn.Module):
@@ -128,11 +128,10 @@ class V2StochasticDepth(nn.Module):  # stocnot on ex
     def __init__(self, n=8, nh=256, act=nn.SiLU(inplace=False), ps=0.5, proba_final_layer=0.5, use_raw_wave=True,
                  sdrop=0, avr_w0_path="avr_w0.pth", **kwarg):
         super().__init__()
-        self.window = nn.Parameter(torch.FloatTensor(signal.windows.tukey(4096 + 2 * 2048, 0.5)), requires_grad=False)
-        self.avr_spec = nn.Parameter(torch.load(avr_w0_path), requires_grad=False)
+        self.whiten = WhitenFrontend(avr_w0_path, sdrop)
+        self._register_load_state_dict_pre_hook(legacy_whiten_keys('whiten'))
         self.use_raw_wave = use_raw_wave
 
-        self.sdrop = nn.Dropout(sdrop)
         self.ex = nn.ModuleList([
             nn.Sequential(Extractor(1, n, 127, maxpool=2, act=act),
                           StochasticDepthResBlockGeM(n, n, kernel_size=31, downsample=4, act=act, p=1),
@@ -173,18 +172,9 @@ class V2StochasticDepth(nn.Module):  # stocnot on ex
                                   nn.Linear(nh, 1),
                                   )
 
-    def forward(self, x, use_MC=False, MC_folds=64):
+    def forward(self, x, use_MC=False, MC_folds=64, shifts=None):
         if self.use_raw_wave:
-            with torch.no_grad():
-                with torch.cuda.amp.autocast(enabled=False):
-                    shape = x.shape
-                    c = x.view(shape[0] * shape[1], -1)
-                    c = torch.cat([-c.flip(-1)[:, 4096 - 2049:-1] + 2 * c[:, 0].unsqueeze(-1), c,
-                                   -c.flip(-1)[:, 1:2049] + 2 * c[:, -1].unsqueeze(-1)], 1)
-                    avr_spec = self.avr_spec.repeat(shape[0], 1).view(-1, self.avr_spec.shape[-1])
-                    x = torch.fft.ifft(torch.fft.fft(c * self.window) * self.sdrop(1.0 / avr_spec)).real
-                    x = x.view(shape[0], shape[1], x.shape[-1])
-                    x = x[:, :, 2048:-2048]
+            x = self.whiten(x, shifts)[:, :, 2048:-2048]
         x0 = [self.ex[0](x[:, 0].unsqueeze(1)), self.ex[0](x[:, 1].unsqueeze(1)),
               self.ex[1](x[:, 2].unsqueeze(1))]
         x1 = [self.conv1[0](x0[0]), self.conv1[0](x0[1]), self.conv1[1](x0[2]),
@@ -333,11 +323,10 @@ class ModelIafossV2S(nn.Module):
     def __init__(self, n=8, nh=256, act=nn.SiLU(inplace=False), ps=0.5, proba_final_layer=0.5,
                  use_raw_wave=True, sdrop=0, avr_w0_path="avr_w0.pth", **kwarg):
         super().__init__()
-        self.window = nn.Parameter(torch.FloatTensor(signal.windows.tukey(4096 + 2 * 2048, 0.5)), requires_grad=False)
-        self.avr_spec = nn.Parameter(torch.load(avr_w0_path), requires_grad=False)
+        self.whiten = WhitenFrontend(avr_w0_path, sdrop)
+        self._register_load_state_dict_pre_hook(legacy_whiten_keys('whiten'))
         self.use_raw_wave = use_raw_wave
 
-        self.sdrop = nn.Dropout(sdrop)
         self.ex = nn.ModuleList([
             nn.Sequential(Extractor(1, n, 127, maxpool=2, act=act),
                           ResBlockSGeM(n, n, kernel_size=31, downsample=4, act=act),
@@ -369,18 +358,9 @@ class ModelIafossV2S(nn.Module):
                                   nn.Linear(nh, 1),
                                   )
 
-    def forward(self, x, use_MC=False, MC_folds=64):
+    def forward(self, x, use_MC=False, MC_folds=64, shifts=None):
         if self.use_raw_wave:
-            with torch.no_grad():
-                with torch.cuda.amp.autocast(enabled=False):
-                    shape = x.shape
-                    c = x.view(shape[0] * shape[1], -1)
-                    c = torch.cat([-c.flip(-1)[:, 4096 - 2049:-1] + 2 * c[:, 0].unsqueeze(-1), c,
-                                   -c.flip(-1)[:, 1:2049] + 2 * c[:, -1].unsqueeze(-1)], 1)
-                    avr_spec = self.avr_spec.repeat(shape[0], 1).view(-1, self.avr_spec.shape[-1])
-                    x = torch.fft.ifft(torch.fft.fft(c * self.window) * self.sdrop(1.0 / avr_spec)).real
-                    x = x.view(shape[0], shape[1], x.shape[-1])
-                    x = x[:, :, 2048:-2048]
+            x = self.whiten(x, shifts)[:, :, 2048:-2048]
         x0 = [self.ex[0](x[:, 0].unsqueeze(1)), self.ex[0](x[:, 1].unsqueeze(1)),
               self.ex[1](x[:, 2].unsqueeze(1))]
         x1 = [self.conv1[0](x0[0]), self.conv1[0](x0[1]), self.conv1[1](x0[2]),
@@ -1,15 +1,20 @@
 import timm
 import torch
 import torch.nn as nn
-from nnAudio import Spectrogram
-from scipy import signal
+from .cqt import get_cqt, CQTImage
 import torch.nn.functional as F
+from .whiten import WhitenFrontend, legacy_whiten_keys
 from bisect import bisect
 import numpy as np
 
+# whitened samples [3840, 5888) of the 8192, the time columns 120:184 the 64-bin CQT keeps
+CROP_START = (64 + 64 - 8) * 32
+CROP_STOP = (192 - 8) * 32
+
 
 class Model_2D(nn.Module):
-    def __init__(self, encoder='resnet', use_raw_wave=False, avrSpecDir="/home/data/", fmin=15, cut_612=False):
+    def __init__(self, encoder='resnet', use_raw_wave=False, avrSpecDir="/home/data/", fmin=15, cut_612=False,
+                 fast_cqt=False, native_cqt=False, image_size=(256, 256), drop_bands=()):
         super().__init__()
         self.encoder = timm.create_model(
             encoder,
@@ -17,17 +22,26 @@ class Model_2D(nn.Module):
             num_classes=1,  # 0 = feature extraction
             in_chans=4,
         )
-        self.window = nn.Parameter(torch.FloatTensor(signal.windows.tukey(4096 + 2 * 2048, 0.5)), requires_grad=False)
-        self.avr_spec = nn.Parameter(torch.load(avrSpecDir+"avr_w0.pth"), requires_grad=False)
-        self.spec_transform = Spectrogram.CQT1992v2(sr=2048, fmin=fmin, n_bins=64, hop_length=32,
-                                                    output_format='Magnitude', norm=1, bins_per_octave=12,
-                                                    window='nuttall')
+        self.whiten = WhitenFrontend(avrSpecDir + "avr_w0.pth")
+        self._register_load_state_dict_pre_hook(legacy_whiten_keys('whiten'))
         self.cut_612 = cut_612
         self.cut_place = None
         if self.cut_612:
             print("Cut 612 frequency range")
             freqs = 22 * 2.0 ** (np.r_[0:64] / np.float(12))
             self.cut_place = bisect(freqs, 612)
+        self.native_cqt = native_cqt
+        if native_cqt:
+            if self.cut_612:
+                # the frequencies of the row cut out of the 64-bin CQT
+                cut = fmin * 2 ** (self.cut_place / 12)
+                drop_bands = list(drop_bands) + [(cut / 2 ** (1 / 24), cut * 2 ** (1 / 24))]
+            # the crop and band of the 64-bin CQT below, at image_size
+            self.spec_transform = CQTImage(image_size, start=CROP_START, stop=CROP_STOP, fmin=fmin,
+                                           fmax=fmin * 2 ** (63 / 12), drop_bands=drop_bands, fast_cqt=fast_cqt)
+        else:
+            self.spec_transform = get_cqt(fast_cqt, sr=2048, fmin=fmin, n_bins=64, hop_length=32,
+                                          output_format='Magnitude', norm=1, bins_per_octave=12, window='nuttall')
 
         self.use_raw_wave = use_raw_wave
         self.n_features = self.encoder.fc.in_features
@@ -41,23 +55,22 @@ class Model_2D(nn.Module):
         freq_encoding = torch.stack([freq_encoding] * bs)
         return torch.cat([x, freq_encoding], 1)
 
-    def forward(self, x):
+    def forward(self, x, shifts=None):
         if self.use_raw_wave:
             with torch.no_grad():
                 with torch.cuda.amp.autocast(enabled=False):
                     shape = x.shape
-                    c = x.view(shape[0] * shape[1], -1)
-                    c = torch.cat([-c.flip(-1)[:, 4096 - 2049:-1] + 2 * c[:, 0].unsqueeze(-1), c,
-                                   -c.flip(-1)[:, 1:2049] + 2 * c[:, -1].unsqueeze(-1)], 1)
-                    avr_spec = self.avr_spec.repeat(shape[0], 1).view(-1, self.avr_spec.shape[-1])
-                    x = torch.fft.ifft(torch.fft.fft(c * self.window) / avr_spec).real
+                    x = self.whiten(x, shifts).view(shape[0] * shape[1], -1)
                     x = self.spec_transform(x)
                     x = x.reshape(shape[0], shape[1], x.shape[1], x.shape[2])
-                    x = x[:, :, :, 64 + 64 - 8:192 - 8]
-                    if self.cut_612:
-                        x = torch.cat([x[:, :, :self.cut_place, :], x[:, :, self.cut_place + 1:, :]], 2)
-                    x = (8.0 * x + 1.0).log()
-                    x = F.interpolate(x, size=(256, 256), mode='bilinear', align_corners=True)
+                    if self.native_cqt:
+                        x = (8.0 * x + 1.0).log()
+                    else:
+                        x = x[:, :, :, 64 + 64 - 8:192 - 8]
+                        if self.cut_612:
+                            x = torch.cat([x[:, :, :self.cut_place, :], x[:, :, self.cut_place + 1:, :]], 2)
+                        x = (8.0 * x + 1.0).log()
+                        x = F.interpolate(x, size=(256, 256), mode='bilinear', align_corners=True)
                     # spec = standard_scaler(spec)
                     x = self.frequency_encoding(x)
 
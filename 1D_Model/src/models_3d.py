@@ -1,20 +1,26 @@
 import torch
 import torch.nn as nn
-from nnAudio import Spectrogram
-from scipy import signal
+from .cqt import get_cqt, CQTImage
+from .models_2d import CROP_START, CROP_STOP
 import torch.nn.functional as F
+from .whiten import WhitenFrontend, legacy_whiten_keys
 
 class Combined1D2D(nn.Module):
-    def __init__(self, model_1d, model_2d, emb_1d=128, emb_2d=128, first=512, ps=0.5, avrSpecDir="/home/data/"):
+    def __init__(self, model_1d, model_2d, emb_1d=128, emb_2d=128, first=512, ps=0.5, avrSpecDir="/home/data/",
+                 fast_cqt=False, native_cqt=False, image_size=(256, 256), drop_bands=()):
         super().__init__()
         self.model_1d = model_1d
         self.model_2d = model_2d
 
-        self.window = nn.Parameter(torch.FloatTensor(signal.windows.tukey(4096 + 2 * 2048, 0.5)), requires_grad=False)
-        self.avr_spec = nn.Parameter(torch.load(avrSpecDir+"avr_w0.pth"), requires_grad=False)
-        self.spec_transform = Spectrogram.CQT1992v2(sr=2048, fmin=15, n_bins=64, hop_length=32,
-                                                    output_format='Magnitude', norm=1, bins_per_octave=12,
-                                                    window='nuttall')
+        self.whiten = WhitenFrontend(avrSpecDir + "avr_w0.pth")
+        self._register_load_state_dict_pre_hook(legacy_whiten_keys('whiten'))
+        self.native_cqt = native_cqt
+        if native_cqt:
+            self.spec_transform = CQTImage(image_size, start=CROP_START, stop=CROP_STOP, fmin=15,
+                                           fmax=15 * 2 ** (63 / 12), drop_bands=drop_bands, fast_cqt=fast_cqt)
+        else:
+            self.spec_transform = get_cqt(fast_cqt, sr=2048, fmin=15, n_bins=64, hop_length=32,
+                                          output_format='Magnitude', norm=1, bins_per_octave=12, window='nuttall')
 
         # Replace last linear layer to return a embedding of size emb_1d
         head = list(self.model_1d.head.children())
@@ -51,22 +57,21 @@ class Combined1D2D(nn.Module):
         freq_encoding = torch.stack([freq_encoding] * bs)
         return torch.cat([x, freq_encoding], 1)
 
-    def forward(self, x):
+    def forward(self, x, shifts=None):
         with torch.no_grad():
             with torch.cuda.amp.autocast(enabled=False):
                 shape = x.shape
-                c = x.view(shape[0] * shape[1], -1)
-                c = torch.cat([-c.flip(-1)[:, 4096 - 2049:-1] + 2 * c[:, 0].unsqueeze(-1), c,
-                               -c.flip(-1)[:, 1:2049] + 2 * c[:, -1].unsqueeze(-1)], 1)
-                avr_spec = self.avr_spec.repeat(shape[0], 1).view(-1, self.avr_spec.shape[-1])
-                x = torch.fft.ifft(torch.fft.fft(c * self.window) / avr_spec).real
+                x = self.whiten(x, shifts).view(shape[0] * shape[1], -1)
                 x_1d = x.view(shape[0], shape[1], x.shape[-1])[:, :, 2048:-2048]
 
                 x_2d = self.spec_transform(x)
                 x_2d = x_2d.reshape(shape[0], shape[1], x_2d.shape[1], x_2d.shape[2])
-                x_2d = x_2d[:, :, :, 64 + 64 - 8:192 - 8]
-                x_2d = (8.0 * x_2d + 1.0).log()
-                x_2d = F.interpolate(x_2d, size=(256, 256), mode='bilinear', align_corners=True)
+                if self.native_cqt:
+                    x_2d = (8.0 * x_2d + 1.0).log()
+                else:
+                    x_2d = x_2d[:, :, :, 64 + 64 - 8:192 - 8]
+                    x_2d = (8.0 * x_2d + 1.0).log()
+                    x_2d = F.interpolate(x_2d, size=(256, 256), mode='bilinear', align_corners=True)
                 # spec = standard_scaler(spec)
                 x_2d = self.frequency_encoding(x_2d)
 
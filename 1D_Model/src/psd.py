@@ -0,0 +1,107 @@
+import os
+from multiprocessing import Pool
+import numpy as np
+import torch
+from scipy import signal
+from tqdm import tqdm
+from .wave_store import PackedWaveStore
+from .whiten import extend_wave, get_window
+
+SR = 2048
+
+
+def design_curves_name(window):
+    """file name used by datasaurus/src/preprocessing.get_design_curves"""
+    if type(window) == tuple:
+        return "design_curves_" + "_".join(str(x) for x in window)
+    return "design_curves_" + window
+
+
+_worker = {}
+
+
+def _init_worker(source, w0_window, dc_windows):
+    torch.set_num_threads(1)
+    _worker.update(source=source, w0_window=w0_window.double(),
+                   dc_windows={name: torch.from_numpy(signal.get_window(window, 4096))
+                               for name, window in dc_windows.items()})
+
+
+def _psd_chunk(positions):
+    source = _worker['source']
+    if isinstance(source, PackedWaveStore):
+        waves = source.read_batch(positions)
+    else:
+        waves = np.stack([np.load(path) for path in source[positions]])
+    x = torch.from_numpy(np.asarray(waves, dtype=np.float64))
+    specs = {}
+    # avr_w0: |fft| of the reflected, windowed waves * 1e20 as in get_avg_w0.ipynb, the rfft half of it
+    c = extend_wave(x.reshape(-1, x.shape[-1]) * 1e20).view(len(x), x.shape[1], -1)
+    specs['avr_w0'] = torch.fft.rfft(c * _worker['w0_window']).abs()
+    # design curves: scipy.signal.periodogram(wave, fs=2048, window=window) of every channel
+    x = x - x.mean(-1, keepdim=True)
+    for name, window in _worker['dc_windows'].items():
+        spec = torch.fft.rfft(x * window).abs() ** 2 / (SR * (window ** 2).sum())
+        spec[..., 1:-1] *= 2
+        specs[name] = spec
+    return len(x), {name: (spec.sum(0).numpy(), (spec ** 2).sum(0).numpy()) for name, spec in specs.items()}
+
+
+def relative_error(total, total_sq, n, quantile=0.99):
+    """`quantile` over the frequency bins of the standard error of the mean relative to the mean"""
+    mean = total / n
+    var = np.maximum(total_sq / n - mean ** 2, 0) * n / max(n - 1, 1)
+    return np.quantile(np.sqrt(var / n) / np.maximum(mean, np.finfo(mean.dtype).tiny), quantile)
+
+
+def estimate_psd(source, positions, w0_window='tukey', w0_alpha=0.5, dc_windows=(('tukey', 0.2),),
+                 chunk_size=1024, num_workers=8, tol=None, min_samples=20000, seed=0):
+    """
+    Stream the waves `positions` of `source` (an array of .npy paths or a raw PackedWaveStore) through a process
+    pool in chunks and accumulate, in one pass, the mean and variance of
+      - avr_w0: the (3, 8192) mean |fft| of the whitening input, see whiten.whiten_batch
+      - the datasaurus design curves: the (3, 2048) sqrt of the mean periodogram for every window of `dc_windows`
+    Chunks are read in random order, with `tol` the pass stops once at least `min_samples` waves are in and the
+    relative standard error of every estimate (99% of the bins) is below `tol`.
+    Returns avr_w0, {design_curves_name: design curves} and the number of waves used.
+    """
+    positions = np.sort(positions)
+    chunks = [positions[i:i + chunk_size] for i in range(0, len(positions), chunk_size)]
+    chunks = [chunks[i] for i in np.random.RandomState(seed).permutation(len(chunks))]
+    dc_windows = {design_curves_name(window): window for window in dc_windows}
+    n, stats = 0, {}
+
+    with Pool(num_workers, initializer=_init_worker,
+              initargs=(source, get_window(w0_window, w0_alpha), dc_windows)) as pool:
+        progress = tqdm(pool.imap_unordered(_psd_chunk, chunks), total=len(chunks))
+        for count, chunk_stats in progress:
+            n += count
+            for name, (total, total_sq) in chunk_stats.items():
+                if name in stats:
+                    stats[name][0] += total
+                    stats[name][1] += total_sq
+                else:
+                    stats[name] = [total, total_sq]
+            if tol is not None and n >= min_samples:
+                error = max(relative_error(total, total_sq, n) for total, total_sq in stats.values())
+                progress.set_postfix(rel_error=f'{error:.2e}')
+                if error < tol:
+                    print(f"Converged after {n} waves, relative error {error:.2e}")
+                    break
+
+    half = stats.pop('avr_w0')[0] / n
+    avr_w0 = torch.from_numpy(np.concatenate([half, half[..., -2:0:-1]], -1)).float()
+    design_curves = {name: (total[:, :-1] / n) ** 0.5 for name, (total, _) in stats.items()}
+    return avr_w0, design_curves, n
+
+
+def save_psd(avr_w0, design_curves, avr_w0_path, design_curves_folder):
+    tmp_path = avr_w0_path + '.tmp'
+    torch.save(avr_w0, tmp_path)
+    os.replace(tmp_path, avr_w0_path)
+    print(f"avr_w0 {tuple(avr_w0.shape)}: {avr_w0_path}")
+    for name, curves in design_curves.items():
+        path = os.path.join(design_curves_folder, name + '.npy')
+        np.save(path + '.tmp.npy', curves)
+        os.replace(path + '.tmp.npy', path)
+        print(f"{name} {curves.shape}: {path}")
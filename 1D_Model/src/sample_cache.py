@@ -0,0 +1,125 @@
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import pandas as pd
+from .data_index import load_index, index_frame
+from .wave_store import WAVE_SHAPE
+from .worker_pool import current_worker_id
+
+WAVE_BYTES = int(np.prod(WAVE_SHAPE)) * 4
+MAX_WORKERS = 64  # counter slots, the main process uses the last one
+
+
+def _layout(n_rows, capacity):
+    """offsets of slot_of_row (int32), filled (uint8), counters (int64) and waves (float32) in the segment"""
+    sizes = [n_rows * 4, capacity, (MAX_WORKERS + 1) * 2 * 8, capacity * WAVE_BYTES]
+    offsets = np.concatenate([[0], np.cumsum([(size + 63) // 64 * 64 for size in sizes])])
+    return offsets[:-1].tolist(), int(offsets[-1])
+
+
+class SharedWaveCache:
+    """
+    Waves kept as float32 in one shared memory segment, across the epochs and folds of training_loop.
+    The first `budget_bytes` worth of `rows` get a slot, which is filled by whichever process reads the row first;
+    rows without a slot keep being read from disk. Create it in the main process before the DataLoader workers
+    are started, forked workers then read and fill the segment in place.
+    """
+
+    def __init__(self, rows, budget_bytes):
+        rows = pd.unique(np.asarray(rows))
+        self.n_rows = int(rows.max()) + 1
+        self.capacity = int(min(len(rows), budget_bytes // WAVE_BYTES))
+        self.shm = shared_memory.SharedMemory(create=True, size=_layout(self.n_rows, self.capacity)[1])
+        self.owner = True
+        self._attach()
+        self.slot_of_row[:] = -1
+        self.slot_of_row[rows[:self.capacity]] = np.arange(self.capacity)
+        self.filled[:] = 0
+        self.counters[:] = 0
+        print(f"Shared memory cache: {self.capacity}/{len(rows)} waves, {self.capacity * WAVE_BYTES / 2**30:.1f} GB")
+
+    def _attach(self):
+        offsets, _ = _layout(self.n_rows, self.capacity)
+        buf = self.shm.buf
+        self.slot_of_row = np.ndarray((self.n_rows,), dtype=np.int32, buffer=buf, offset=offsets[0])
+        self.filled = np.ndarray((self.capacity,), dtype=np.uint8, buffer=buf, offset=offsets[1])
+        self.counters = np.ndarray((MAX_WORKERS + 1, 2), dtype=np.int64, buffer=buf, offset=offsets[2])
+        self.waves = np.ndarray((self.capacity,) + WAVE_SHAPE, dtype=np.float32, buffer=buf, offset=offsets[3])
+
+    def __getstate__(self):
+        # spawned workers re-attach to the segment by name
+        return {'name': self.shm.name, 'n_rows': self.n_rows, 'capacity': self.capacity}
+
+    def __setstate__(self, state):
+        self.n_rows, self.capacity = state['n_rows'], state['capacity']
+        self.shm = shared_memory.SharedMemory(name=state['name'])
+        # attaching registers the segment with the resource tracker as if this process had created it
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.owner = False
+        self._attach()
+
+    def _count(self, hits, misses):
+        # every process only writes its own counter row, no lock needed
+        worker_id = current_worker_id()
+        counter = self.counters[MAX_WORKERS if worker_id is None else min(worker_id, MAX_WORKERS - 1)]
+        counter[0] += hits
+        counter[1] += misses
+
+    def _slots(self, rows):
+        rows = np.asarray(rows)
+        slots = np.full(rows.shape, -1, dtype=np.int32)
+        known = rows < self.n_rows
+        slots[known] = self.slot_of_row[rows[known]]
+        return slots
+
+    def read(self, row):
+        """copy of the cached wave of `row`, None if it is not cached (yet)"""
+        slot = self._slots([row])[0]
+        if slot >= 0 and self.filled[slot]:
+            self._count(1, 0)
+            return self.waves[slot].copy()
+        self._count(0, 1)
+        return None
+
+    def read_batch(self, rows):
+        """(B, 3, 4096) float32 waves with the cached rows filled in, and the mask of those rows"""
+        slots = self._slots(rows)
+        hit = slots >= 0
+        hit[hit] = self.filled[slots[hit]].astype(bool)
+        waves = np.empty((len(rows),) + WAVE_SHAPE, dtype=np.float32)
+        waves[hit] = self.waves[slots[hit]]
+        self._count(int(hit.sum()), int((~hit).sum()))
+        return waves, hit
+
+    def write(self, row, wave):
+        self.write_batch(np.asarray([row]), wave[None])
+
+    def write_batch(self, rows, waves):
+        slots = self._slots(rows)
+        has_slot = slots >= 0
+        self.waves[slots[has_slot]] = waves[has_slot]
+        # the flag goes up only once the data is in place
+        self.filled[slots[has_slot]] = 1
+
+    def stats(self, reset=True):
+        hits, misses = self.counters.sum(0)
+        if reset:
+            self.counters[:] = 0
+        return {'hits': int(hits), 'misses': int(misses), 'filled': int(self.filled.sum()), 'capacity': self.capacity}
+
+    def close(self):
+        # the array views hold the buffer, drop them before closing
+        self.slot_of_row = self.filled = self.counters = self.waves = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def get_wave_cache(train_df, Config):
+    if not Config.shm_cache:
+        return None
+    rows = train_df['row'].values
+    if Config.PL_folder is not None:
+        # pseudo labelled test rows get the slots left after the train rows
+        index = load_index(Config.kaggleDataFolder, Config.index_path)
+        rows = np.concatenate([rows, index_frame(index, 'test', appended=Config.score_appended)['row'].values])
+    return SharedWaveCache(rows, Config.shm_cache_bytes)
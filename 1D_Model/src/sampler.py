@@ -0,0 +1,142 @@
+import numpy as np
+from torch.utils.data import Sampler
+
+
+class BlockShuffleSampler(Sampler):
+    """
+    Shuffle that keeps reads local: samples are sorted by `keys` (row in a packed store or file path), cut into
+    blocks of `block_size` neighbours on disk, the blocks are shuffled and the samples of every `window`
+    consecutive blocks are shuffled together. A batch then comes from at most `window` contiguous regions.
+    The order depends on seed + epoch only, so that replicas of a distributed run agree on the blocks they split.
+    """
+
+    def __init__(self, keys, block_size=256, window=4, seed=0, num_replicas=1, rank=0):
+        order = np.argsort(np.asarray(keys), kind='stable')
+        if num_replicas > 1:
+            # every replica gets the same number of whole blocks, padded like DistributedSampler
+            total = -(-len(order) // (block_size * num_replicas)) * block_size * num_replicas
+            order = np.resize(order, total)
+        self.blocks = [order[i:i + block_size] for i in range(0, len(order), block_size)]
+        self.window = window
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+
+    def __len__(self):
+        return sum(len(block) for block in self.blocks[self.rank::self.num_replicas])
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        self.epoch += 1
+        perm = rng.permutation(len(self.blocks))[self.rank::self.num_replicas]
+        blocks = [self.blocks[i] for i in perm]
+        indices = [rng.permutation(np.concatenate(blocks[i:i + self.window]))
+                   for i in range(0, len(blocks), self.window)]
+        return iter(np.concatenate(indices).tolist())
+
+
+class LossAwareSampler(Sampler):
+    """
+    Importance sampling by loss: every sample keeps an EMA of its training loss, written back by the Trainer with
+    `update`. After `warmup` epochs of plain shuffling, an epoch draws len(dataset) samples with replacement,
+    sample i with probability p_i = floor / n + (1 - floor) * ema_i / sum(ema), samples not seen yet counting
+    with the mean EMA. The loss of sample i is then multiplied by `weights` 1 / (n p_i), which keeps the gradient
+    an unbiased estimate of the uniform one; the floor bounds the weights by 1 / floor.
+    The indices of the current epoch are in `order`, in the order the loader hands them out.
+    """
+
+    def __init__(self, n, warmup=1, momentum=0.9, floor=0.2, seed=0):
+        self.n = n
+        self.warmup = warmup
+        self.momentum = momentum
+        self.floor = floor
+        self.seed = seed
+        self.epoch = 0
+        self.ema = np.full(n, np.nan)
+        self.probas = np.full(n, 1.0 / n)
+        self.order = None
+
+    def __len__(self):
+        return self.n
+
+    def update(self, indices, losses):
+        indices = np.asarray(indices)
+        seen = ~np.isnan(self.ema[indices])
+        ema = np.where(seen, self.momentum * self.ema[indices] + (1 - self.momentum) * losses, losses)
+        self.ema[indices] = ema
+
+    def weights(self, indices):
+        return (1.0 / (self.n * self.probas[np.asarray(indices)])).astype(np.float32)
+
+    def stats(self):
+        return {'ess': float(1.0 / (self.n * (self.probas ** 2).sum())),
+                'max_weight': float(1.0 / (self.n * self.probas.min())),
+                'seen': int((~np.isnan(self.ema)).sum())}
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        self.epoch += 1
+        if self.epoch <= self.warmup or np.isnan(self.ema).all():
+            self.probas = np.full(self.n, 1.0 / self.n)
+            self.order = rng.permutation(self.n)
+        else:
+            ema = np.nan_to_num(self.ema, nan=np.nanmean(self.ema))
+            share = ema / ema.sum() if ema.sum() > 0 else np.full(self.n, 1.0 / self.n)
+            self.probas = self.floor / self.n + (1 - self.floor) * share
+            self.order = rng.choice(self.n, self.n, p=self.probas / self.probas.sum())
+        return iter(self.order.tolist())
+
+
+class PosNegBatchSampler(Sampler):
+    """
+    Batches with a fixed mix of positives (target 1) and negatives (target 0), so that every batch of the rank loss
+    has pairs: `pos_fraction` of the hard-labelled samples of a batch are positives (the share in the data if None),
+    at least one of each. Soft targets (pseudo labels) keep their share of every batch. Each group is drawn from
+    its own shuffled order, started again when used up, and an epoch is len(targets) // batch_size batches.
+    Like BlockShuffleSampler, the order depends on seed + epoch only and replicas take every num_replicas-th batch.
+    """
+
+    def __init__(self, targets, batch_size, pos_fraction=None, seed=0, num_replicas=1, rank=0):
+        targets = np.asarray(targets, dtype=float)
+        self.groups = [np.flatnonzero(targets == 1), np.flatnonzero(targets == 0),
+                       np.flatnonzero((targets != 0) & (targets != 1))]
+        n_pos, n_neg, n_soft = [len(group) for group in self.groups]
+        n_soft = int(round(batch_size * n_soft / len(targets)))
+        hard = batch_size - n_soft
+        if pos_fraction is None:
+            pos_fraction = n_pos / max(n_pos + n_neg, 1)
+        n_pos = int(np.clip(round(hard * pos_fraction), min(1, n_pos), hard - min(1, n_neg)))
+        self.counts = [n_pos, hard - n_pos, n_soft]
+        for name, group, count in zip(['positives', 'negatives'], self.groups, self.counts):
+            if count and not len(group):
+                raise ValueError(f"pos_fraction={pos_fraction} needs {count} {name} per batch, targets has none")
+        self.n_batches = len(targets) // batch_size
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+
+    def __len__(self):
+        return len(range(self.rank, self.n_batches, self.num_replicas))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def draw(self, rng, group, count):
+        """`count` indices for every batch of the epoch from `group`, reshuffled each time it runs out"""
+        if count == 0:
+            return np.empty((self.n_batches, 0), dtype=int)
+        total = self.n_batches * count
+        perms = [rng.permutation(group) for _ in range(-(-total // len(group)))]
+        return np.concatenate(perms)[:total].reshape(self.n_batches, count)
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        self.epoch += 1
+        batches = np.concatenate([self.draw(rng, group, count) for group, count in zip(self.groups, self.counts)], 1)
+        for batch in batches[self.rank::self.num_replicas]:
+            yield rng.permutation(batch).tolist()
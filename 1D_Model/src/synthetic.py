@@ -0,0 +1,206 @@
+import os
+import json
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+SR = 2048
+SIGNAL_SHAPE = (3, 4096)
+DETECTORS = ('H1', 'L1', 'V1')
+
+# parameter space of notebooks/SyntheticSignal.ipynb, every parameter is [distribution, *arguments]:
+# 'uniform' a b, 'loguniform' a b, 'cos' (arccos of a uniform cosine, isotropic inclination),
+# 'sin' (arcsin of a uniform sine, isotropic declination) or 'fixed' value
+GW_SIM_SPEC = {
+    'approximant': 'SEOBNRv4_opt',
+    'order_masses': True,  # swap so that m1 >= m2
+    'params': {
+        'm1': ['uniform', 10, 50],
+        'm2': ['uniform', 10, 50],
+        's1': ['uniform', 0, 0.998],
+        's2': ['uniform', 0, 0.998],
+        'cp': ['uniform', 0, 2 * np.pi],
+        'dis': ['uniform', 100, 1000],
+        'inc': ['cos'],
+        'fl': ['uniform', 15, 25],
+        'ra': ['uniform', -np.pi, np.pi],
+        'dec': ['sin'],
+        'pol': ['uniform', 0, np.pi],
+    },
+}
+
+
+def sample_params(spec, rng):
+    params = {}
+    for name, (dist, *args) in spec['params'].items():
+        u = rng.random_sample()
+        if dist == 'uniform':
+            params[name] = args[0] + (args[1] - args[0]) * u
+        elif dist == 'loguniform':
+            params[name] = np.exp(np.log(args[0]) + (np.log(args[1]) - np.log(args[0])) * u)
+        elif dist == 'cos':
+            params[name] = np.arccos(1 - 2 * u)
+        elif dist == 'sin':
+            params[name] = np.arcsin(2 * u - 1)
+        elif dist == 'fixed':
+            params[name] = args[0]
+        else:
+            raise ValueError(f"unknown distribution {dist} for {name}")
+    if spec.get('order_masses', True) and params['m1'] < params['m2']:
+        params['m1'], params['m2'] = params['m2'], params['m1']
+    return params
+
+
+def estimate_psds(paths):
+    """average Welch PSD (1 s segments, 50% overlap, delta_f 0.5) of each detector over the raw waves in `paths`"""
+    from pycbc.types import TimeSeries
+    from pycbc.psd import welch, interpolate
+    total = 0
+    for path in tqdm(paths):
+        waves = np.load(path)
+        total = total + np.stack([interpolate(welch(TimeSeries(wave, delta_t=1.0 / SR), seg_len=SR,
+                                                    seg_stride=SR // 2), .5).data for wave in waves])
+    return total / len(paths)
+
+
+def generate_signal(params, approximant, psds):
+    """
+    (3, 4096) signal of `params` projected on H1, L1 and V1, last 4096 samples, scaled to SNR 1 against `psds`
+    and stored as float16 of signal * 1e20 as in the notebook
+    """
+    from pycbc.waveform import get_td_waveform
+    from pycbc.filter import sigma
+    from pycbc.types import TimeSeries
+    kwargs = dict(delta_t=1.0 / SR, mass1=params['m1'], mass2=params['m2'], spin1z=params['s1'],
+                  spin2z=params['s2'], coa_phase=params['cp'], inclination=params['inc'],
+                  distance=params['dis'], f_lower=params['fl'])
+    try:
+        hp, hc = get_td_waveform(approximant=approximant, **kwargs)
+    except Exception:
+        hp, hc = get_td_waveform(approximant='IMRPhenomPv2', **kwargs)
+    signals = np.zeros(SIGNAL_SHAPE)
+    for i, detector in enumerate(psds['detectors']):
+        signal = detector.project_wave(hp, hc, params['ra'], params['dec'], params['pol']).data[-SIGNAL_SHAPE[1]:]
+        signal = TimeSeries(np.pad(signal, (SIGNAL_SHAPE[1] - len(signal), 0)), delta_t=1.0 / SR)
+        signals[i] = (signal / sigma(signal, psd=psds['psds'][i])).data
+    return (signals * 1e20).astype(np.float16)
+
+
+def bank_files(bank_path):
+    stem = bank_path[:-len('.npy')] if bank_path.endswith('.npy') else bank_path
+    return {'bank': stem + '.npy', 'meta': stem + '.json', 'params': stem + '.params.npy',
+            'table': stem + '.params.csv', 'psd': stem + '.psd.npy', 'progress': stem + '.progress'}
+
+
+def _create_once(path, create):
+    """create `path` with create(tmp_path) unless it exists, concurrent shards end up with the same single file"""
+    if os.path.exists(path):
+        return
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    create(tmp_path)
+    try:
+        os.link(tmp_path, path)
+    except FileExistsError:
+        pass
+    os.remove(tmp_path)
+
+
+def _save_json(obj):
+    def create(path):
+        with open(path, 'w') as f:
+            json.dump(obj, f)
+    return create
+
+
+def _save_npy(compute):
+    def create(path):
+        with open(path, 'wb') as f:
+            np.save(f, compute())
+    return create
+
+
+_worker = {}
+
+
+def _init_worker(files, spec, seed, columns, psds):
+    from pycbc.detector import Detector
+    from pycbc.types import FrequencySeries
+    _worker.update(spec=spec, seed=seed, columns=columns,
+                   bank=np.load(files['bank'], mmap_mode='r+'), params=np.load(files['params'], mmap_mode='r+'),
+                   psds={'detectors': [Detector(name) for name in DETECTORS],
+                         'psds': [FrequencySeries(psd, delta_f=.5, epoch=0) for psd in psds]})
+
+
+def _generate_chunk(args, max_attempts=10):
+    chunk, start, stop = args
+    for row in range(start, stop):
+        # the parameters of a row only depend on (seed, row), failed draws are retried with the next attempt
+        for attempt in range(max_attempts):
+            params = sample_params(_worker['spec'], np.random.RandomState([_worker['seed'], row, attempt]))
+            try:
+                _worker['bank'][row] = generate_signal(params, _worker['spec']['approximant'], _worker['psds'])
+                break
+            except RuntimeError:
+                continue
+        else:
+            raise RuntimeError(f"cannot generate row {row} in {max_attempts} attempts")
+        _worker['params'][row] = [params[name] for name in _worker['columns'][:-1]] + [attempt]
+    _worker['bank'].flush()
+    _worker['params'].flush()
+    return chunk
+
+
+def generate_bank(bank_path, n, psd_paths, spec=GW_SIM_SPEC, seed=0, shard=0, num_shards=1,
+                  chunk_size=256, num_workers=8):
+    """
+    Generate rows [shard * n / num_shards, (shard + 1) * n / num_shards) of the (n, 3, 4096) bank `bank_path`.
+    Shards may run at the same time (on machines sharing the folder) and any of them can be stopped and resumed,
+    the finished chunks of every shard are recorded in the .progress folder. The parameters of every row are kept
+    in .params.npy, exported to the .params.csv table once all shards are done.
+    """
+    files = bank_files(bank_path)
+    columns = list(spec['params']) + ['attempt']
+    meta = {'n': n, 'shape': list(SIGNAL_SHAPE), 'dtype': 'float32', 'seed': seed, 'spec': spec, 'columns': columns}
+    _create_once(files['meta'], _save_json(meta))
+    with open(files['meta'], 'r') as f:
+        previous = json.load(f)
+    if previous != json.loads(json.dumps(meta)):
+        raise ValueError(f"{files['bank']} was started with {previous}, remove it to generate with {meta}")
+    _create_once(files['psd'], _save_npy(lambda: estimate_psds(psd_paths)))
+    _create_once(files['bank'], lambda path: np.lib.format.open_memmap(
+        path, mode='w+', dtype=np.float32, shape=(n,) + SIGNAL_SHAPE).flush())
+    _create_once(files['params'], lambda path: np.lib.format.open_memmap(
+        path, mode='w+', dtype=np.float64, shape=(n, len(columns))).flush())
+
+    per_shard = -(-n // num_shards)
+    first, last = shard * per_shard, min(n, (shard + 1) * per_shard)
+    chunks = [(start, min(last, start + chunk_size)) for start in range(first, last, chunk_size)]
+    os.makedirs(files['progress'], exist_ok=True)
+    done_path = os.path.join(files['progress'], f'shard_{shard}_of_{num_shards}.npy')
+    done = np.load(done_path) if os.path.exists(done_path) else np.zeros(len(chunks), dtype=bool)
+    todo = [(chunk, start, stop) for chunk, (start, stop) in enumerate(chunks) if not done[chunk]]
+    print(f"Shard {shard}/{num_shards}: rows {first}-{last}, {done.sum()}/{len(chunks)} chunks already generated")
+
+    with Pool(num_workers, initializer=_init_worker,
+              initargs=(files, spec, seed, columns, np.load(files['psd']))) as pool:
+        for chunk in tqdm(pool.imap_unordered(_generate_chunk, todo), total=len(todo)):
+            done[chunk] = True
+            np.save(done_path + '.tmp.npy', done)
+            os.replace(done_path + '.tmp.npy', done_path)
+
+    shards_done = [os.path.join(files['progress'], f'shard_{i}_of_{num_shards}.npy') for i in range(num_shards)]
+    if all(os.path.exists(path) and np.load(path).all() for path in shards_done):
+        export_params_table(bank_path)
+
+
+def export_params_table(bank_path):
+    """one row of parameters per bank row, e.g. pd.read_csv(table).query('m1 > 30').index selects bank rows"""
+    files = bank_files(bank_path)
+    with open(files['meta'], 'r') as f:
+        columns = json.load(f)['columns']
+    table = pd.DataFrame(np.load(files['params']), columns=columns)
+    table['attempt'] = table['attempt'].astype(int)
+    table.to_csv(files['table'] + '.tmp', index_label='row')
+    os.replace(files['table'] + '.tmp', files['table'])
+    print(f"Parameter table: {files['table']}")
@@ -4,7 +4,6 @@ import wandb
 from torch.optim import AdamW
 import torch.nn.functional as F
 from torch.optim.lr_scheduler import ReduceLROnPlateau
-from torch.utils.data import DataLoader
 from torch import nn
 from torch.optim.swa_utils import update_bn
 
@@ -12,8 +11,13 @@ from .util import *
 from .dataset import *
 from .models import getModel
 from .optim import RangerLars
-from .loss import rank_loss
+from .loss import rank_loss, sample_losses
+from .integrity import has_scan
 from .augmentation import get_tranform_list
+from .sample_cache import get_wave_cache
+from .worker_pool import get_worker_pool
+from .echo import get_echo_loader
+from .whiten import get_whitener
 
 
 def training_loop(train_df, Config, synthetic=None):
@@ -24,16 +28,26 @@ def training_loop(train_df, Config, synthetic=None):
         wandb.init(project=Config.wandb_project, name=Config.model_version + Config.wandb_post,
                    config=class2dict(Config), group=Config.model_module, job_type=Config.model_version)
 
+    cache = get_wave_cache(train_df, Config)
+    pool = get_worker_pool(Config)
     folds_val_score = []
-    for fold in range(5):
-        if Config.model_module == "M3D":
-            Config.fold = fold
-        print('Fold: ', fold)
-        if fold not in Config.train_folds:
-            print("skip")
-            continue
-        best_valid_score = run_fold(fold, train_df.copy(), Config, synthetic=synthetic)
-        folds_val_score.append(best_valid_score)
+    try:
+        for fold in range(5):
+            if Config.model_module == "M3D":
+                Config.fold = fold
+            print('Fold: ', fold)
+            if fold not in Config.train_folds:
+                print("skip")
+                continue
+            best_valid_score = run_fold(fold, train_df.copy(), Config, synthetic=synthetic, cache=cache, pool=pool)
+            folds_val_score.append(best_valid_score)
+            if pool is not None:
+                pool.report()
+    finally:
+        if pool is not None:
+            pool.close()
+        if cache is not None:
+            cache.close()
     print('folds score:', folds_val_score)
     print("Avg: {:.5f}".format(np.mean(folds_val_score)))
     print("Std: {:.5f}".format(np.std(folds_val_score)))
@@ -42,7 +56,7 @@ def training_loop(train_df, Config, synthetic=None):
 
 
 def run_fold(fold, original_train_df, Config,
-             swa_start_step=None, swa_start_epoch=None, synthetic=None,
+             swa_start_step=None, swa_start_epoch=None, synthetic=None, cache=None, pool=None,
              **kwargs):
     train_df = generate_PL(fold, original_train_df.copy(), Config)
     train_index, valid_index = train_df.query(f"fold!={fold}").index, train_df.query(
@@ -57,20 +71,27 @@ def run_fold(fold, original_train_df, Config,
     oof.to_csv(f'{Config.model_output_folder}/Fold_{fold}_oof_pred.csv')
 
     print('training data samples, val data samples: ', len(train_X), len(valid_X))
+    whitener = get_whitener(Config)
     train_data_retriever = DataRetriever(train_X["file_path"].values, train_X["target"].values,
-                                         synthetic=synthetic, Config=Config)
-    valid_data_retriever = DataRetrieverTest(valid_X["file_path"].values, valid_X["target"].values, Config=Config)
-
-    train_loader = DataLoader(train_data_retriever,
-                              batch_size=Config.batch_size,
-                              shuffle=True,
-                              num_workers=Config.num_workers, pin_memory=True, drop_last=False)
-    valid_loader = DataLoader(valid_data_retriever,
-                              batch_size=Config.batch_size * 2,
-                              shuffle=False,
-                              num_workers=Config.num_workers, pin_memory=True, drop_last=False)
+                                         synthetic=synthetic, Config=Config, rows=train_X["row"].values, cache=cache,
+                                         whitener=whitener)
+    valid_data_retriever = DataRetrieverTest(valid_X["file_path"].values, valid_X["target"].values, Config=Config,
+                                             rows=valid_X["row"].values, cache=cache, whitener=whitener)
+
+    train_sampler = get_sampler(train_data_retriever, Config, shuffle=True)
+    # the loss of every sample goes back to the sampler by position in the epoch, which echoing would mix up
+    loss_sampler = train_sampler if isinstance(train_sampler, LossAwareSampler) else None
+    if loss_sampler is not None and (Config.echo_factor > 1 or Config.use_mixup):
+        raise ValueError("loss_sampler does not work with echo_factor > 1 or use_mixup")
+    if loss_sampler is not None and Config.balanced_batches:
+        raise ValueError("loss_sampler does not work with balanced_batches")
+    train_loader = get_echo_loader(get_loader(train_data_retriever, Config, Config.batch_size, shuffle=True,
+                                              pool=pool, sampler=train_sampler), Config)
+    valid_loader = get_loader(valid_data_retriever, Config, Config.batch_size * 2, shuffle=False, pool=pool)
 
     model = getModel(Config)
+    if whitener is not None:
+        model.use_raw_wave = False  # the loaders hand out whitened waves, the checkpoints still take raw ones
     model.to(Config.device)
     if Config.use_dp and torch.cuda.device_count() > 1:
         model = nn.DataParallel(model)
@@ -79,7 +100,8 @@ def run_fold(fold, original_train_df, Config,
     else:
         optimizer = AdamW(model.parameters(), lr=Config.lr, eps=1e-08, weight_decay=Config.weight_decay,
                           amsgrad=False)
-    scheduler = get_scheduler(optimizer, len(train_X), Config)
+    # one optimizer update per echoed batch
+    scheduler = get_scheduler(optimizer, len(train_X) * Config.echo_factor, Config)
     swa_model, swa_scheduler = None, None
     best_valid_score = -np.inf
     if Config.checkpoint_folder is not None:
@@ -91,14 +113,14 @@ def run_fold(fold, original_train_df, Config,
     if Config.use_swa:
         print("Use SWA")
         swa_model, swa_scheduler = get_swa(model, optimizer, Config.epochs, Config.swa_start_step_epoch, Config.swa_lr,
-                                           len(train_X), Config.batch_size)
+                                           len(train_X) * Config.echo_factor, Config.batch_size)
 
     criterion = rank_loss if Config.crit == 'rank' else F.binary_cross_entropy_with_logits
 
     trainer = Trainer(model, optimizer, criterion, scheduler, valid_labels,
                       best_valid_score, fold, Config,
                       swa_model=swa_model, swa_scheduler=swa_scheduler, swa_start_step=swa_start_step,
-                      swa_start_epoch=swa_start_epoch)
+                      swa_start_epoch=swa_start_epoch, cache=cache, loss_sampler=loss_sampler)
 
     trainer.fit(
         epochs=Config.epochs,
@@ -113,7 +135,7 @@ class Trainer:
     def __init__(self, model, optimizer, criterion, scheduler, valid_labels,
                  best_valid_score, fold, Config, mixed_criterion=None,
                  swa_model=None, swa_scheduler=None, swa_start_step=None,
-                 swa_start_epoch=None, **kwargs):
+                 swa_start_epoch=None, cache=None, loss_sampler=None, **kwargs):
         self.model = model
         self.device = Config.device
         self.optimizer = optimizer
@@ -141,10 +163,22 @@ class Trainer:
         # log
         self.print_num_steps = Config.print_num_steps
         self.use_wandb = Config.use_wandb
+        self.cache = cache
+        self.target_auc = Config.target_auc
+        self.loss_sampler = loss_sampler
+        # without a scan_waves.py exclusion list, bad waves can still reach the model
+        self.mask_nan = not has_scan(Config)
+
+    def drop_nan(self, outputs, targets):
+        if not self.mask_nan:
+            return outputs, targets
+        keep = outputs == outputs
+        return outputs[keep], targets[keep]
 
     def fit(self, epochs, train_loader, valid_loader, save_path):
         train_losses = []
         valid_losses = []
+        fit_start, target_reached = time.time(), False
         for n_epoch in range(epochs):
             start_time = time.time()
             print('Epoch: ', n_epoch)
@@ -172,11 +206,25 @@ class Trainer:
             print('valid_score: ', valid_score)
             print('best_valid_score: ', self.best_valid_score)
             print('time used: ', time.time() - start_time)
+            if self.target_auc is not None and not target_reached and valid_score >= self.target_auc:
+                target_reached = True
+                print(f'valid_score {self.target_auc} reached after {time.time() - fit_start:.0f}s, '
+                      f'epoch {n_epoch + 1}, {self.step} steps')
+                if self.use_wandb:
+                    wandb.log({f"[fold{self.fold}] time_to_target_auc": time.time() - fit_start})
+            if self.cache is not None:
+                cache_stats = self.cache.stats()
+                print('cache: ', cache_stats)
+            if self.loss_sampler is not None:
+                print('loss sampler: ', self.loss_sampler.stats())
             if self.use_wandb:
                 wandb.log({f"[fold{self.fold}] epoch": n_epoch + 1,
                            f"[fold{self.fold}] avg_train_loss": train_loss,
                            f"[fold{self.fold}] avg_val_loss": valid_loss,
                            f"[fold{self.fold}] val_score": valid_score})
+                if self.cache is not None:
+                    wandb.log({f"[fold{self.fold}] cache_hits": cache_stats['hits'],
+                               f"[fold{self.fold}] cache_misses": cache_stats['misses']})
                 # save swa
         if self.swa_model is not None:
             update_bn(train_loader, self.swa_model, device=self.device)
@@ -202,11 +250,14 @@ class Trainer:
         self.model.train()
         losses = []
         train_loss = 0
+        seen = 0
         for step, batch in enumerate(train_loader, 1):
             self.step += 1
             self.optimizer.zero_grad()
             X = batch[0].to(self.device)
             targets = batch[1].to(self.device)
+            # time shifts left to the whitening of the model, see BatchAugment
+            shift_kwargs = {'shifts': batch[2].to(self.device)} if len(batch) > 2 else {}
 
             if self.use_mixup:
                 (X_mix, targets_a, targets_b, lam) = mixup_data(X, targets, self.mixup_alpha)
@@ -215,8 +266,15 @@ class Trainer:
                     loss = self.mixed_criterion(self.criterion, outputs, targets_a, targets_b, lam)
             else:
                 with autocast(enabled=self.use_autocast):
-                    outputs = self.model(X).squeeze()
-                    loss = self.criterion(outputs[outputs == outputs], targets[outputs == outputs])
+                    outputs = self.model(X, **shift_kwargs).squeeze()
+                    if self.loss_sampler is None:
+                        loss = self.criterion(*self.drop_nan(outputs, targets))
+                    else:
+                        indices = self.loss_sampler.order[seen:seen + len(targets)]
+                        seen += len(targets)
+                        weight = torch.from_numpy(self.loss_sampler.weights(indices)).to(self.device)
+                        loss = self.criterion(outputs, targets, weight=weight)
+                        self.loss_sampler.update(indices, sample_losses(outputs.detach(), targets).cpu().numpy())
 
             if self.gradient_accumulation_steps > 1:
                 loss = loss / self.gradient_accumulation_steps
@@ -258,7 +316,7 @@ class Trainer:
                 X = batch[0].to(self.device)
                 targets = batch[1].to(self.device)
                 outputs = model(X).squeeze()
-                loss = self.criterion(outputs[outputs == outputs], targets[outputs == outputs])
+                loss = self.criterion(*self.drop_nan(outputs, targets))
                 if self.gradient_accumulation_steps > 1:
                     loss = loss / self.gradient_accumulation_steps
                 valid_loss.append(loss.detach().item())
@@ -0,0 +1,262 @@
+import os
+import json
+from multiprocessing import Pool
+import numpy as np
+from tqdm import tqdm
+
+WAVE_SHAPE = (3, 4096)
+
+
+class PackedWaveStore:
+    """
+    All waves of one split packed into a single (N, 3, 4096) array `waves.npy`, row i holding the id ids.npy[i].
+    The array is opened with np.memmap on first access, so forked DataLoader workers share the page cache
+    instead of opening one tiny file per sample.
+    Compact stores (see convert_store) keep float16 or int16 waves and are decoded to float32 on read.
+    Rows added by append_to_store live in extra part files listed in meta.json; a store keeps reading the parts
+    of the meta.json it was opened with, so appends never disturb running readers.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.encoding = self.meta.get('encoding', 'float32')
+        self.parts = self.meta.get('parts', [{'name': '', 'n': self.meta['n']}])
+        self.offsets = np.cumsum([0] + [part['n'] for part in self.parts])
+        self._waves = None
+        self._ids = None
+        self._scales = None
+
+    def _load_parts(self, prefix, **kwargs):
+        return [np.load(os.path.join(self.folder, f"{prefix}{part['name']}.npy"), **kwargs) for part in self.parts]
+
+    @property
+    def waves(self):
+        """waves of the first part, use read/read_batch to get rows of any part"""
+        return self.part_waves[0]
+
+    @property
+    def part_waves(self):
+        if self._waves is None:
+            self._waves = self._load_parts('waves', mmap_mode='r')
+        return self._waves
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            self._ids = np.concatenate(self._load_parts('ids'))
+        return self._ids
+
+    @property
+    def part_scales(self):
+        if self._scales is None:
+            self._scales = self._load_parts('scales', mmap_mode='r')
+        return self._scales
+
+    def __getstate__(self):
+        # never pickle the memmaps themselves, each process re-opens them
+        state = self.__dict__.copy()
+        state['_waves'] = None
+        state['_scales'] = None
+        return state
+
+    def __len__(self):
+        return self.meta['n']
+
+    def decode(self, waves, part, rows):
+        if self.encoding == 'int16':
+            return waves.astype(np.float32) * self.part_scales[part][rows][..., None]
+        if self.encoding == 'float16':
+            return waves.astype(np.float32) / self.meta['scale']
+        return waves
+
+    def read(self, row):
+        part = np.searchsorted(self.offsets, row, side='right') - 1
+        row = row - self.offsets[part]
+        return self.decode(np.array(self.part_waves[part][row]), part, row)
+
+    def read_batch(self, rows):
+        # one gather over sorted rows keeps the reads sequential, the result is put back in the asked order
+        order = np.argsort(rows, kind='stable')
+        sorted_rows = rows[order]
+        waves = np.empty((len(rows),) + WAVE_SHAPE, dtype=np.float32)
+        bounds = np.searchsorted(sorted_rows, self.offsets)
+        for part in range(len(self.parts)):
+            if bounds[part] == bounds[part + 1]:
+                continue
+            part_rows = sorted_rows[bounds[part]:bounds[part + 1]] - self.offsets[part]
+            waves[order[bounds[part]:bounds[part + 1]]] = self.decode(self.part_waves[part][part_rows], part, part_rows)
+        return waves
+
+
+class PackedWaveReader:
+    """
+    Reads waves by global row: train rows come first, test rows are offset by the size of the train store.
+    This is the same numbering as the `row` column added by `read_data`.
+    """
+
+    def __init__(self, train_folder, test_folder):
+        self.train_folder = train_folder
+        self.test_folder = test_folder
+        self._train = None
+        self._test = None
+
+    @property
+    def train(self):
+        if self._train is None:
+            self._train = PackedWaveStore(self.train_folder)
+        return self._train
+
+    @property
+    def test(self):
+        if self._test is None:
+            self._test = PackedWaveStore(self.test_folder)
+        return self._test
+
+    def read(self, row):
+        n_train = len(self.train)
+        if row < n_train:
+            return self.train.read(row)
+        return self.test.read(row - n_train)
+
+    def read_batch(self, rows):
+        rows = np.asarray(rows)
+        n_train = len(self.train)
+        is_train = rows < n_train
+        if is_train.all():
+            return self.train.read_batch(rows)
+        if not is_train.any():
+            return self.test.read_batch(rows - n_train)
+        waves = np.empty((len(rows),) + WAVE_SHAPE, dtype=np.float32)
+        waves[is_train] = self.train.read_batch(rows[is_train])
+        waves[~is_train] = self.test.read_batch(rows[~is_train] - n_train)
+        return waves
+
+
+def packed_folders(Config):
+    if Config.use_raw_wave:
+        return Config.packed_train_folder, Config.packed_test_folder
+    return Config.packed_whiten_train_folder, Config.packed_whiten_test_folder
+
+
+def get_wave_reader(Config):
+    if getattr(Config, 'data_backend', 'npy') != 'packed':
+        return None
+    return PackedWaveReader(*packed_folders(Config))
+
+
+def _load_float32(path):
+    return np.load(path).astype(np.float32)
+
+
+def build_packed_store(ids, paths, folder, num_workers=8, chunksize=256):
+    """pack the per-id .npy files in `paths` into `folder`, row i of the store is ids[i]"""
+    os.makedirs(folder, exist_ok=True)
+    n = len(paths)
+    waves = np.lib.format.open_memmap(os.path.join(folder, 'waves.npy'), mode='w+',
+                                      dtype=np.float32, shape=(n,) + WAVE_SHAPE)
+    with Pool(num_workers) as pool:
+        for i, w in enumerate(tqdm(pool.imap(_load_float32, paths, chunksize=chunksize), total=n)):
+            waves[i] = w
+    waves.flush()
+    del waves
+    np.save(os.path.join(folder, 'ids.npy'), np.asarray(ids, dtype=str))
+    # meta.json is written last, a store without it is incomplete
+    with open(os.path.join(folder, 'meta.json'), 'w') as f:
+        json.dump({'n': n, 'shape': list(WAVE_SHAPE), 'dtype': 'float32'}, f)
+    return PackedWaveStore(folder)
+
+
+def encode_waves(waves, encoding, scale=None):
+    """
+    float32 waves to the on-disk `encoding` of a store, with the per sample and channel scales for 'int16'
+    and the global `scale` of the store for 'float16'
+    """
+    if encoding == 'int16':
+        scales = np.abs(waves).max(-1) / np.iinfo(np.int16).max
+        scales[scales == 0] = 1
+        return np.round(waves / scales[..., None]).astype(np.int16), scales.astype(np.float32)
+    if encoding == 'float16':
+        return (waves * scale).astype(np.float16), None
+    return waves.astype(np.float32), None
+
+
+def convert_store(src_folder, dst_folder, encoding='int16', chunk_size=4096):
+    """
+    Re-encode a packed store into a compact one:
+    'float16' keeps x * scale with one global scale, 'int16' keeps round(x / scale) with one scale per sample and channel
+    """
+    src = PackedWaveStore(src_folder)
+    os.makedirs(dst_folder, exist_ok=True)
+    n = len(src)
+    dtype = np.int16 if encoding == 'int16' else np.float16
+    meta = dict(src.meta, dtype=np.dtype(dtype).name, encoding=encoding)
+    meta.pop('parts', None)
+    waves = np.lib.format.open_memmap(os.path.join(dst_folder, 'waves.npy'), mode='w+',
+                                      dtype=dtype, shape=(n,) + WAVE_SHAPE)
+    if encoding == 'int16':
+        scales = np.lib.format.open_memmap(os.path.join(dst_folder, 'scales.npy'), mode='w+',
+                                           dtype=np.float32, shape=(n, WAVE_SHAPE[0]))
+    else:
+        # bring the waves to unit std, raw strain is ~1e-20 and would underflow float16
+        meta['scale'] = float(1.0 / src.read_batch(np.arange(min(n, chunk_size))).std())
+
+    for start in tqdm(range(0, n, chunk_size)):
+        stop = min(n, start + chunk_size)
+        waves[start:stop], chunk_scales = encode_waves(src.read_batch(np.arange(start, stop)), encoding, meta.get('scale'))
+        if encoding == 'int16':
+            scales[start:stop] = chunk_scales
+    waves.flush()
+    if encoding == 'int16':
+        scales.flush()
+    np.save(os.path.join(dst_folder, 'ids.npy'), src.ids)
+    with open(os.path.join(dst_folder, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return PackedWaveStore(dst_folder)
+
+
+def publish_meta(folder, meta):
+    """replace meta.json in one step, readers see either the old or the new store"""
+    tmp_path = os.path.join(folder, 'meta.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(folder, 'meta.json'))
+
+
+def append_to_store(folder, ids, waves):
+    """
+    Append float32 (B, 3, 4096) `waves` with ids `ids` to the packed store in `folder` (created if missing) as one
+    new part, encoded like the rest of the store. Existing files are never rewritten and the rows only become
+    visible when the new meta.json is published. There should be a single writer per store.
+    """
+    os.makedirs(folder, exist_ok=True)
+    if os.path.exists(os.path.join(folder, 'meta.json')):
+        meta = PackedWaveStore(folder).meta
+    else:
+        meta = {'n': 0, 'shape': list(WAVE_SHAPE), 'dtype': 'float32'}
+    parts = meta.get('parts', [{'name': '', 'n': meta['n']}] if meta['n'] else [])
+    name = f'-{len(parts):04d}' if parts else ''
+    encoded, scales = encode_waves(np.asarray(waves, dtype=np.float32), meta.get('encoding', 'float32'),
+                                   meta.get('scale'))
+    np.save(os.path.join(folder, f'waves{name}.npy'), encoded)
+    np.save(os.path.join(folder, f'ids{name}.npy'), np.asarray(ids, dtype=str))
+    if scales is not None:
+        np.save(os.path.join(folder, f'scales{name}.npy'), scales)
+    meta = dict(meta, n=meta['n'] + len(encoded), parts=parts + [{'name': name, 'n': len(encoded)}])
+    publish_meta(folder, meta)
+    return meta['n'] - len(encoded) + np.arange(len(encoded))
+
+
+def compare_stores(ref_folder, folder, n_samples=10000, seed=0):
+    """error of the waves in `folder` against the same rows of `ref_folder`, on a random subset of rows"""
+    ref, store = PackedWaveStore(ref_folder), PackedWaveStore(folder)
+    rows = np.sort(np.random.RandomState(seed).choice(len(ref), min(n_samples, len(ref)), replace=False))
+    expected, waves = ref.read_batch(rows), store.read_batch(rows)
+    err = np.abs(waves - expected)
+    peak = np.abs(expected).max(-1, keepdims=True)
+    peak[peak == 0] = 1
+    return {'max_abs_err': float(err.max()),
+            'mean_abs_err': float(err.mean()),
+            'max_rel_err': float((err / peak).max()),  # relative to the peak of each channel
+            'ref_abs_max': float(np.abs(expected).max())}
@@ -0,0 +1,222 @@
+import os
+import json
+import hashlib
+from multiprocessing import Pool
+import torch
+import numpy as np
+from scipy import signal
+from tqdm import tqdm
+from torch import nn
+from .batch_augment import phase_ramp
+from .wave_store import PackedWaveStore, WAVE_SHAPE
+
+EXT_LEN = 4096 + 2 * 2048
+
+
+def get_window(window='tukey', alpha=0.5):
+    if window == 'tukey':
+        return torch.FloatTensor(signal.windows.tukey(EXT_LEN, alpha))
+    return torch.FloatTensor(signal.get_window(window, EXT_LEN, fftbins=False))
+
+
+def avr_w0_hash(avr_w0):
+    return hashlib.sha1(avr_w0.cpu().numpy().astype(np.float32).tobytes()).hexdigest()
+
+
+def extend_wave(c):
+    """reflect (n, 4096) waves around both end points to (n, 8192), as done before whitening in the models"""
+    return torch.cat([-c.flip(-1)[:, 4096 - 2049:-1] + 2 * c[:, 0].unsqueeze(-1), c,
+                      -c.flip(-1)[:, 1:2049] + 2 * c[:, -1].unsqueeze(-1)], 1)
+
+
+def whiten_batch(waves, window, avr_w0):
+    """
+    Whiten raw (B, 3, 4096) waves with the average spectrum avr_w0 (3, 8192), same as generate_whiten_wave.
+    avr_w0 is the mean |fft| of real waves, so it is symmetric and one rfft/irfft pair gives the same result
+    as the complex fft/ifft with half of the work.
+    """
+    shape = waves.shape
+    c = extend_wave(waves.reshape(-1, shape[-1]) * 1e20)
+    spec = torch.fft.rfft(c * window).view(shape[0], shape[1], -1)
+    x = torch.fft.irfft(spec / avr_w0[:, :EXT_LEN // 2 + 1], n=EXT_LEN)
+    return x[..., 2048:-2048]
+
+
+class WhitenFrontend(nn.Module):
+    """
+    Whitening of raw (B, C, 4096) waves at the start of the models: reflect to 8192 samples, Tukey window, divide
+    the spectrum by avr_w0 and back, returns (B, C, 8192). Same result as the complex fft/ifft the models used to
+    run, with one rfft/irfft pair: the real part of ifft(spec / avr_w0) only sees the mean of 1 / avr_w0 at bins
+    k and n - k, which is kept in the `filter` buffer. The reflected waves and the spectrum are written to buffers
+    kept from the previous batch of the same size.
+
+    With sdrop, the dropout on 1 / avr_w0 is drawn for bins k and n - k separately as before, so that it has the
+    same distribution. `shifts` (B,) are circular time shifts applied as a phase ramp, see BatchAugment.
+    """
+
+    def __init__(self, avr_w0_path, sdrop=0):
+        super().__init__()
+        self.window = nn.Parameter(get_window(), requires_grad=False)
+        self.avr_spec = nn.Parameter(torch.load(avr_w0_path), requires_grad=False)
+        self.sdrop = nn.Dropout(sdrop)
+        self.register_buffer('inv_spec', torch.empty(0), persistent=False)
+        self.register_buffer('filter', torch.empty(0), persistent=False)
+        self.update_filter()
+        self._ext, self._spec = None, None
+
+    def update_filter(self):
+        """1 / avr_spec at bins k and n - k for the rfft bins k, and their mean"""
+        bins = EXT_LEN // 2 + 1
+        inv_spec = 1.0 / self.avr_spec.detach().float()
+        mirror = (-torch.arange(bins, device=inv_spec.device)) % EXT_LEN
+        self.inv_spec = torch.stack([inv_spec[:, :bins], inv_spec[:, mirror]])
+        self.filter = self.inv_spec.mean(0)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        super()._load_from_state_dict(*args, **kwargs)
+        self.update_filter()
+
+    def buffers_for(self, rows, device):
+        if self._ext is None or self._ext.shape[0] != rows or self._ext.device != device:
+            self._ext = torch.empty(rows, EXT_LEN, device=device)
+            self._spec = torch.empty(rows, EXT_LEN // 2 + 1, dtype=torch.complex64, device=device)
+        return self._ext, self._spec
+
+    def forward(self, x, shifts=None):
+        with torch.no_grad():
+            with torch.cuda.amp.autocast(enabled=False):
+                shape = x.shape
+                c = x.reshape(shape[0] * shape[1], -1).float()
+                ext, spec = self.buffers_for(c.shape[0], c.device)
+                # extend_wave, written in place
+                ext[:, 2048:-2048] = c
+                torch.sub(2 * c[:, :1], c[:, 1:2049].flip(-1), out=ext[:, :2048])
+                torch.sub(2 * c[:, -1:], c[:, -2049:-1].flip(-1), out=ext[:, -2048:])
+                ext.mul_(self.window)
+                torch.fft.rfft(ext, out=spec)
+                spec = spec.view(shape[0], shape[1], -1)
+                if self.training and self.sdrop.p > 0:
+                    mask = self.sdrop(torch.ones((2,) + spec.shape, device=c.device))
+                    mask[1, ..., [0, -1]] = mask[0, ..., [0, -1]]  # bins 0 and n / 2 are their own mirror
+                    spec.mul_((mask * self.inv_spec[:, None]).mean(0))
+                else:
+                    spec.mul_(self.filter)
+                if shifts is not None:  # time shift of BatchAugment(fuse_time_shift=True)
+                    spec.mul_(phase_ramp(shifts, EXT_LEN, shape[1], spec.shape[-1]).view(spec.shape))
+                return torch.fft.irfft(spec, n=EXT_LEN)
+
+
+def legacy_whiten_keys(name):
+    """load_state_dict pre-hook moving the window and avr_spec of checkpoints saved before WhitenFrontend"""
+
+    def hook(state_dict, prefix, *args):
+        for key in ['window', 'avr_spec']:
+            if prefix + key in state_dict:
+                state_dict[f'{prefix}{name}.{key}'] = state_dict.pop(prefix + key)
+
+    return hook
+
+
+# transforms that give the same result, up to the edges, applied before or after the whitening filter
+COMMUTING_TRANSFORMS = ('vflip', 'shuffle01', 'time_shift', 'shift_channel')
+
+
+class WaveWhitener:
+    """whiten_batch for the loaders: raw (n, 3, 4096) waves to the whitened input of the models, in numpy"""
+
+    def __init__(self, avr_w0_path, window='tukey'):
+        self.window = get_window(window)
+        self.avr_w0 = torch.load(avr_w0_path).float()
+
+    def __call__(self, waves):
+        waves = torch.from_numpy(np.ascontiguousarray(waves, dtype=np.float32))
+        return whiten_batch(waves, self.window, self.avr_w0).numpy()
+
+
+def whiten_cache_fallback(Config):
+    """why the model of Config has to whiten its input itself, None if the loaders can hand out cached whitened waves"""
+    if not Config.shm_cache:
+        return "it needs shm_cache"
+    if Config.model_module not in ['V2SD', 'V2S']:
+        return f"{Config.model_module} whitens the reflected 8192 samples"
+    if Config.sdrop > 0:
+        return "sdrop draws a new whitening filter for every sample"
+    if Config.synthetic:
+        return "synthetic signals are injected into the raw waves"
+    live = [name for name in (Config.cons_func_names or []) + (Config.aggr_func_names or [])
+            if name not in COMMUTING_TRANSFORMS]
+    if live:
+        return f"{', '.join(live)} do not commute with the whitening"
+    return None
+
+
+def get_whitener(Config):
+    if not (Config.whiten_cache and Config.use_raw_wave):
+        return None
+    reason = whiten_cache_fallback(Config)
+    if reason is not None:
+        print(f"whiten_cache is off, {reason}")
+        return None
+    return WaveWhitener(Config.avr_w0_path)
+
+
+_worker = {}
+
+
+def _init_worker(source, window, avr_w0, out_path):
+    torch.set_num_threads(1)
+    _worker.update(source=source, window=window, avr_w0=avr_w0,
+                   out=np.load(out_path, mmap_mode='r+'))
+
+
+def _whiten_chunk(args):
+    chunk, start, stop = args
+    source = _worker['source']
+    if isinstance(source, PackedWaveStore):
+        waves = source.read_batch(np.arange(start, stop))
+    else:
+        waves = np.stack([np.load(path).astype(np.float32) for path in source[start:stop]])
+    out = _worker['out']
+    out[start:stop] = whiten_batch(torch.from_numpy(waves), _worker['window'], _worker['avr_w0']).numpy()
+    out.flush()
+    return chunk
+
+
+def whiten_to_store(ids, source, folder, avr_w0, window='tukey', alpha=0.5, chunk_size=4096, num_workers=8):
+    """
+    Whiten every wave of `source` (an array of .npy paths or a raw PackedWaveStore) into the packed store `folder`.
+    Finished chunks are recorded in done.npy, running again after a crash only processes the missing ones.
+    """
+    os.makedirs(folder, exist_ok=True)
+    n = len(ids)
+    params = {'n': n, 'shape': list(WAVE_SHAPE), 'dtype': 'float32', 'chunk_size': chunk_size,
+              'window': window, 'alpha': alpha, 'avr_w0_sha1': avr_w0_hash(avr_w0)}
+    out_path = os.path.join(folder, 'waves.npy')
+    params_path = os.path.join(folder, 'params.json')
+    done_path = os.path.join(folder, 'done.npy')
+    n_chunks = (n + chunk_size - 1) // chunk_size
+    if os.path.exists(params_path) and os.path.exists(out_path):
+        with open(params_path, 'r') as f:
+            previous = json.load(f)
+        if previous != params:
+            raise ValueError(f"{folder} was started with {previous}, remove it to whiten with {params}")
+        done = np.load(done_path) if os.path.exists(done_path) else np.zeros(n_chunks, dtype=bool)
+    else:
+        np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float32, shape=(n,) + WAVE_SHAPE).flush()
+        with open(params_path, 'w') as f:
+            json.dump(params, f)
+        done = np.zeros(n_chunks, dtype=bool)
+    todo = [(chunk, chunk * chunk_size, min(n, (chunk + 1) * chunk_size)) for chunk in np.flatnonzero(~done)]
+    print(f"{done.sum()}/{n_chunks} chunks already whitened")
+
+    with Pool(num_workers, initializer=_init_worker,
+              initargs=(source, get_window(window, alpha), avr_w0, out_path)) as pool:
+        for chunk in tqdm(pool.imap_unordered(_whiten_chunk, todo), total=len(todo)):
+            done[chunk] = True
+            np.save(done_path + '.tmp.npy', done)
+            os.replace(done_path + '.tmp.npy', done_path)
+
+    np.save(os.path.join(folder, 'ids.npy'), np.asarray(ids, dtype=str))
+    with open(os.path.join(folder, 'meta.json'), 'w') as f:
+        json.dump(params, f)
+    return PackedWaveStore(folder)
@@ -0,0 +1,227 @@
+import io
+import mmap
+import pickle
+import queue
+import random
+import itertools
+import traceback
+from collections import OrderedDict, deque
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import get_worker_info
+from torch.utils.data.dataloader import default_collate
+
+_worker_id = None  # id of this process in the pool, None outside of the pool workers
+
+
+def current_worker_id():
+    """id of the pool or DataLoader worker running this, None in the main process"""
+    if _worker_id is not None:
+        return _worker_id
+    info = get_worker_info()
+    return None if info is None else info.id
+
+
+def pin_memory(batch):
+    """`batch` with its tensors copied to page-locked memory"""
+    if isinstance(batch, torch.Tensor):
+        return batch.pin_memory()
+    if isinstance(batch, dict):
+        return {key: pin_memory(value) for key, value in batch.items()}
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(pin_memory(value) for value in batch)
+    return batch
+
+
+def _reduce_memmap(array):
+    mode = 'r' if array.mode == 'r' else 'r+'
+    order = 'F' if array.flags.f_contiguous and not array.flags.c_contiguous else 'C'
+    return np.memmap, (array.filename, array.dtype, mode, array.offset, array.shape, order)
+
+
+class _DatasetPickler(pickle.Pickler):
+    """pickles memory-mapped arrays (e.g. the synthetic bank) as their file, workers map them again"""
+
+    def reducer_override(self, obj):
+        if isinstance(obj, np.memmap) and isinstance(obj.base, mmap.mmap) and obj.filename is not None:
+            return _reduce_memmap(obj)
+        return NotImplemented
+
+
+def _dumps(obj):
+    buffer = io.BytesIO()
+    _DatasetPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+    return buffer.getvalue()
+
+
+def _worker_loop(worker_id, seed, task_queue, result_queue):
+    global _worker_id
+    _worker_id = worker_id  # see sample_cache.SharedWaveCache
+    torch.set_num_threads(1)
+    seed = seed + worker_id
+    random.seed(seed)
+    torch.manual_seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    datasets = {}
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        if task[0] == 'register':
+            datasets[task[1]] = pickle.loads(task[2])
+        elif task[0] == 'drop':
+            datasets.pop(task[1], None)
+        else:
+            _, key, task_id, indices, batched = task
+            try:
+                dataset, collate_fn = datasets[key]
+                batch = dataset[indices] if batched else collate_fn([dataset[i] for i in indices])
+                result_queue.put((task_id, batch, None))
+            except Exception:
+                result_queue.put((task_id, None, traceback.format_exc()))
+
+
+class WorkerPool:
+    """
+    Long-lived loader workers shared by every DataLoader-like loop of a run: the train and valid sets of all the
+    folds, the TTA variants of inference. The processes are started once, a dataset is pickled and sent to them
+    the first time a loader uses it (the `max_datasets` most recent ones are kept), batches are then only a list
+    of indices. Workers are forked when the pool is created, so Config has to be final by then.
+    Only one loader can be iterated at a time.
+    """
+
+    def __init__(self, num_workers, prefetch_factor=2, seed=42, max_datasets=4):
+        self.num_workers = num_workers
+        self.prefetch_factor = prefetch_factor
+        self.max_datasets = max_datasets
+        self.pin_memory = torch.cuda.is_available()
+        self.result_queue = mp.Queue()
+        self.task_queues, self.workers = [], []
+        for worker_id in range(num_workers):
+            task_queue = mp.Queue()
+            worker = mp.Process(target=_worker_loop,
+                                args=(worker_id, seed, task_queue, self.result_queue), daemon=True)
+            worker.start()
+            self.task_queues.append(task_queue)
+            self.workers.append(worker)
+        self.datasets = OrderedDict()  # id(dataset) -> (key, dataset), least recently used first
+        self._keys = itertools.count()
+        self._task_ids = itertools.count()
+        self._next_worker = itertools.cycle(range(num_workers))
+        self.worker_starts = num_workers
+        self.registrations = 0
+        self.passes = 0
+
+    def register(self, dataset, collate_fn=None):
+        """key of `dataset` in the workers, sending it to them if they do not have it"""
+        if id(dataset) in self.datasets:
+            self.datasets.move_to_end(id(dataset))
+            return self.datasets[id(dataset)][0]
+        key = next(self._keys)
+        try:
+            payload = _dumps((dataset, collate_fn or default_collate))
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            raise RuntimeError(f"{type(dataset).__name__} cannot be sent to the pool workers ({e}), "
+                               f"its transforms have to be module-level functions; set worker_pool = False") from e
+        for task_queue in self.task_queues:
+            task_queue.put(('register', key, payload))
+        # the reference keeps id(dataset) from being reused while the workers hold it
+        self.datasets[id(dataset)] = (key, dataset)
+        self.registrations += 1
+        while len(self.datasets) > self.max_datasets:
+            old_key, _ = self.datasets.popitem(last=False)[1]
+            for task_queue in self.task_queues:
+                task_queue.put(('drop', old_key))
+        return key
+
+    def _get(self):
+        while True:
+            try:
+                return self.result_queue.get(timeout=5)
+            except queue.Empty:
+                dead = [worker.pid for worker in self.workers if not worker.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Pool worker(s) {dead} exited unexpectedly")
+
+    def imap(self, key, batches, batched):
+        """batches of the dataset `key` for the lists of indices `batches`, in order"""
+        self.passes += 1
+        batches = iter(batches)
+        pending, done = set(), {}
+        order = deque()
+
+        def submit():
+            indices = next(batches, None)
+            if indices is None:
+                return False
+            task_id = next(self._task_ids)
+            pending.add(task_id)
+            order.append(task_id)
+            self.task_queues[next(self._next_worker)].put(('batch', key, task_id, indices, batched))
+            return True
+
+        for _ in range(self.prefetch_factor * self.num_workers):
+            if not submit():
+                break
+        while order:
+            task_id = order.popleft()
+            while task_id not in done:
+                result_id, batch, error = self._get()
+                if result_id not in pending:
+                    continue  # left over from a loop that was not run to the end
+                if error is not None:
+                    raise RuntimeError(f"Caught exception in pool worker:\n{error}")
+                pending.discard(result_id)
+                done[result_id] = batch
+            batch = done.pop(task_id)
+            submit()
+            yield pin_memory(batch) if self.pin_memory else batch
+
+    def stats(self):
+        return {'worker_starts': self.worker_starts, 'datasets': self.registrations, 'passes': self.passes,
+                'dataloader_worker_starts': self.passes * self.num_workers}
+
+    def report(self):
+        stats = self.stats()
+        print(f"worker pool: {stats['worker_starts']} worker starts for {stats['passes']} loader passes over "
+              f"{stats['datasets']} datasets (a DataLoader per pass: {stats['dataloader_worker_starts']})")
+
+    def close(self):
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PooledLoader:
+    """DataLoader stand-in that gets its batches from a WorkerPool"""
+
+    def __init__(self, pool, dataset, batch_sampler, batched=False):
+        self.pool = pool
+        self.dataset = dataset
+        self.batch_sampler = batch_sampler
+        self.batched = batched
+        self.collate_fn = None if batched else getattr(dataset, 'collate_fn', None)
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+    def __iter__(self):
+        key = self.pool.register(self.dataset, self.collate_fn)
+        return self.pool.imap(key, self.batch_sampler, self.batched)
+
+
+def get_worker_pool(Config):
+    if not Config.worker_pool or Config.num_workers == 0:
+        return None
+    return WorkerPool(Config.num_workers, seed=Config.seed)
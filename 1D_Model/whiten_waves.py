@@ -0,0 +1,39 @@
+import os
+from argparse import ArgumentParser
+import pandas as pd
+import torch
+from src.config import BaseConfig
+from src.util import id_2_path_wave
+from src.wave_store import PackedWaveStore
+from src.whiten import whiten_to_store
+
+
+def prepare_whiten_args():
+    parser = ArgumentParser()
+    parser.add_argument('--splits', nargs='+', default=['train', 'test'], help='splits to whiten')
+    parser.add_argument('--source', type=str, default='npy', choices=['npy', 'packed'],
+                        help='read raw waves from the competition .npy files or from the packed raw stores')
+    parser.add_argument('--window', type=str, default='tukey', help='window applied before the fft')
+    parser.add_argument('--alpha', type=float, default=0.5, help='shape parameter of the tukey window')
+    parser.add_argument('--chunk_size', type=int, default=4096, help='waves whitened per fft batch')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count(), help='worker processes')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arg = prepare_whiten_args()
+    Config = BaseConfig
+    Config.use_raw_wave = True
+    avr_w0 = torch.load(Config.avr_w0_path).float()
+    for split in arg.splits:
+        train = split == 'train'
+        csv = '/training_labels.csv' if train else '/sample_submission.csv'
+        df = pd.read_csv(Config.kaggleDataFolder + csv)
+        if arg.source == 'packed':
+            source = PackedWaveStore(Config.packed_train_folder if train else Config.packed_test_folder)
+        else:
+            source = df['id'].apply(lambda x: id_2_path_wave(x, Config, train)).values
+        folder = Config.packed_whiten_train_folder if train else Config.packed_whiten_test_folder
+        print(f"Whiten {len(df)} {split} waves into {folder}")
+        whiten_to_store(df['id'].values, source, folder, avr_w0, window=arg.window, alpha=arg.alpha,
+                        chunk_size=arg.chunk_size, num_workers=arg.num_workers)
@@ -0,0 +1,68 @@
+import time
+
+import torch
+from scipy import signal
+
+from src.datasets import GWDataModule, GWDataset
+from src.preprocessing import apply_whiten, biquad_bandpass_filter, get_design_curves
+from src.utils import prepare_args
+
+N_BATCHES = 200
+
+
+class PerSampleGWDataset(GWDataset):
+    """GWDataset with the preprocessing done sample by sample in __getitem__"""
+
+    collate_fn = None
+
+    def __init__(self, df, tukey_alpha=0.2, **kwargs):
+        super().__init__(df, tukey_alpha=tukey_alpha, **kwargs)
+        self.window = torch.tensor(signal.tukey(4096, tukey_alpha))
+        self.design_curves = torch.tensor(get_design_curves(("tukey", tukey_alpha)))
+
+    def __getitem__(self, index):
+        data, target = super().__getitem__(index)
+        data = data / torch.abs(data).max(-1, keepdim=True)[0] * self.window
+
+        if self.whiten:
+            data = apply_whiten(data, self.design_curves)
+        else:
+            data = data.to(dtype=torch.float32)
+
+        if self.lf and self.hf:
+            data = biquad_bandpass_filter(data, self.lf, self.hf, 2048)
+
+        return data, target
+
+
+def time_loader(loader, n_batches):
+    start = time.time()
+    n_samples = 0
+    for step, (data, _) in enumerate(loader, 1):
+        n_samples += len(data)
+        if step >= n_batches:
+            break
+    return n_samples / (time.time() - start)
+
+
+if __name__ == "__main__":
+    args = prepare_args()
+    dm = GWDataModule().from_argparse_args(args)
+    dm.setup("fit", args.fold - 1)
+    params = {
+        "tukey_alpha": dm.alpha,
+        "bp_lf": dm.lf,
+        "bp_hf": dm.hf,
+        "bp_order": dm.order,
+        "whiten": dm.whiten,
+    }
+    trn_df = dm.df.query(f"fold != {args.fold - 1}")
+    for name, dataset in [
+        ("per sample", PerSampleGWDataset(trn_df, **params)),
+        ("batched", GWDataset(trn_df, **params)),
+    ]:
+        dm.gw_train = dataset
+        # the first pass warms the page cache, report the second one
+        for _ in range(2):
+            speed = time_loader(dm.train_dataloader(), N_BATCHES)
+        print(f"{name}: {speed:.0f} samples/sec ({dm.num_workers} workers)")
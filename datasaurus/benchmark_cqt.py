@@ -0,0 +1,70 @@
+import time
+from argparse import ArgumentParser
+
+import torch
+import yaml
+from nnAudio import Spectrogram
+
+from src.config import CONFIG_PATH
+from src.cqt import FFTCQT
+from src.models import cnn1d_models
+
+CQT_PARAMS = ["fmin", "fmax", "hop_length", "bins_per_octave", "filter_scale", "window"]
+
+
+def cqt_configs(config_path):
+    """CQT settings of the 2D configs in hyperparams.yml -> names of the configs"""
+    with open(config_path, "r") as ymlfile:
+        cfg = yaml.load(ymlfile, Loader=yaml.FullLoader)
+    settings = {}
+    for name, params in cfg.items():
+        if params.get("cwt") or params.get("encoder") in cnn1d_models:
+            continue
+        key = tuple(params[p] for p in CQT_PARAMS) + (params.get("norm", 1),)
+        settings.setdefault(key, []).append(name)
+    return settings
+
+
+def time_transform(transform, x, repeats):
+    transform(x)  # builds the FFTCQT plan
+    times = []
+    for _ in range(repeats):
+        if x.is_cuda:
+            torch.cuda.synchronize()
+        start = time.time()
+        with torch.no_grad():
+            transform(x)
+        if x.is_cuda:
+            torch.cuda.synchronize()
+        times.append(time.time() - start)
+    return min(times) * 1000
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--config_path", default=CONFIG_PATH)
+    parser.add_argument("--batch_size", default=32, type=int)
+    parser.add_argument("--repeats", default=5, type=int)
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    args = parser.parse_args()
+
+    # the 3 detectors of every sample go through the CQT as separate rows
+    x = torch.randn(args.batch_size * 3, 4096, device=args.device)
+    print(f"{len(x)} rows of 4096 samples on {args.device}")
+    print("configs | bins x frames | hop | CQT1992v2 ms | FFTCQT ms | speedup | error")
+    for key, names in cqt_configs(args.config_path).items():
+        params = dict(zip(CQT_PARAMS + ["norm"], key))
+        conv = Spectrogram.CQT1992v2(sr=2048, verbose=False, **params).to(args.device)
+        fft = FFTCQT(sr=2048, verbose=False, **params).to(args.device)
+        with torch.no_grad():
+            reference = conv(x)
+            error = (fft(x) - reference).abs().max() / reference.abs().max()
+        conv_ms = time_transform(conv, x, args.repeats)
+        fft_ms = time_transform(fft, x, args.repeats)
+        print(
+            f"{', '.join(names)} | {reference.shape[1]} x {reference.shape[2]} "
+            f"| {params['hop_length']} | {conv_ms:.1f} | {fft_ms:.1f} "
+            f"| {conv_ms / fft_ms:.1f}x | {error:.1e}"
+        )
@@ -0,0 +1,101 @@
+import multiprocessing as mp
+import time
+from argparse import ArgumentParser
+
+import torch
+import yaml
+
+from src.config import CONFIG_PATH
+from src.cwt import CWT
+
+
+def cwt_configs(config_path):
+    """(fmin, fmax) of the CWT configs in hyperparams.yml -> names of the configs"""
+    with open(config_path, "r") as ymlfile:
+        cfg = yaml.load(ymlfile, Loader=yaml.FullLoader)
+    settings = {}
+    for name, params in cfg.items():
+        if params.get("cwt"):
+            settings.setdefault((params["fmin"], params["fmax"]), []).append(name)
+    return settings
+
+
+def time_transform(transform, x, repeats):
+    times = []
+    for _ in range(repeats):
+        if x.is_cuda:
+            torch.cuda.synchronize()
+        start = time.time()
+        with torch.no_grad():
+            transform(x)
+        if x.is_cuda:
+            torch.cuda.synchronize()
+        times.append(time.time() - start)
+    return min(times) * 1000
+
+
+def memory_status(field):
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(field))
+
+
+def forward_peak_rss(params, use_fft, shape):
+    """MB of peak RSS above the RSS before a forward pass, Linux only"""
+    transform = CWT(use_fft=use_fft, **params)
+    x = torch.randn(shape)
+    # reset the high water mark to the current RSS
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    rss = memory_status("VmRSS:")
+    with torch.no_grad():
+        transform(x)
+    return (memory_status("VmHWM:") - rss) / 2 ** 10
+
+
+def peak_memory(params, use_fft, x):
+    """MB allocated at the peak of a forward pass, above what was allocated before"""
+    if x.is_cuda:
+        transform = CWT(use_fft=use_fft, **params).to(x.device)
+        torch.cuda.reset_peak_memory_stats()
+        allocated = torch.cuda.memory_allocated()
+        with torch.no_grad():
+            transform(x)
+        return (torch.cuda.max_memory_allocated() - allocated) / 2 ** 20
+    # a fresh process, so the memory freed by earlier runs is not reused
+    with mp.get_context("spawn").Pool(1) as pool:
+        return pool.apply(forward_peak_rss, (params, use_fft, tuple(x.shape)))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--config_path", default=CONFIG_PATH)
+    parser.add_argument("--batch_size", default=32, type=int)
+    parser.add_argument("--repeats", default=5, type=int)
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    args = parser.parse_args()
+
+    x = torch.randn(args.batch_size, 3, 4096, device=args.device)
+    print(f"{args.batch_size} x 3 x 4096 on {args.device}, dj=0.125/8, hop_length=8")
+    print(
+        "configs | scales x frames | conv ms | fft ms | speedup | conv MB | fft MB "
+        "| error"
+    )
+    for (fmin, fmax), names in cwt_configs(args.config_path).items():
+        # as built by GWModel
+        params = dict(dj=0.125 / 8, dt=1 / 2048, fmin=fmin, fmax=fmax, hop_length=8)
+        conv = CWT(**params).to(args.device)
+        fft = CWT(use_fft=True, **params).to(args.device)
+        with torch.no_grad():
+            reference = conv(x)
+            error = (fft(x) - reference).abs().max() / reference.abs().max()
+        conv_ms = time_transform(conv, x, args.repeats)
+        fft_ms = time_transform(fft, x, args.repeats)
+        conv_mb = peak_memory(params, False, x)
+        fft_mb = peak_memory(params, True, x)
+        print(
+            f"{', '.join(names)} | {reference.shape[2]} x {reference.shape[3]} "
+            f"| {conv_ms:.0f} | {fft_ms:.0f} | {conv_ms / fft_ms:.1f}x "
+            f"| {conv_mb:.0f} | {fft_mb:.0f} | {error:.1e}"
+        )
@@ -0,0 +1,221 @@
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from nnAudio import Spectrogram
+
+
+class FFTCQT(nn.Module):
+    """
+    Drop-in for nnAudio's CQT1992v2 computed in the frequency domain. CQT1992v2
+    correlates the padded signal with one long complex kernel per bin and keeps
+    every hop_length-th output, here the signal goes through one FFT and every bin
+    is the inverse FFT of its product with the kernel spectrum:
+    - the kernels come from CQT1992v2 itself, their spectra are computed once per
+      input length and only the coefficients above `sparsity` times the peak of
+      the bin are kept, a narrow band around the bin frequency;
+    - the bins are processed a quarter octave at a time, the bands of which have
+      about the same width;
+    - the stride is applied by folding the spectrum to N / hop_length points
+      (aliasing it as the subsampling does) before a short inverse FFT.
+    Trainable kernels are not supported, use CQT1992v2 for train_filter. The error
+    against CQT1992v2 is about `sparsity` relative to the largest output.
+    """
+
+    def __init__(
+        self,
+        sr=22050,
+        hop_length=512,
+        fmin=32.70,
+        fmax=None,
+        n_bins=84,
+        bins_per_octave=12,
+        filter_scale=1,
+        norm=1,
+        window="hann",
+        center=True,
+        pad_mode="reflect",
+        output_format="Magnitude",
+        trainable=False,
+        verbose=True,
+        sparsity=1e-4,
+    ):
+        super().__init__()
+        if trainable:
+            raise ValueError("FFTCQT has fixed kernels, use CQT1992v2 for train_filter")
+        if output_format not in ["Magnitude", "Complex"]:
+            raise ValueError(f"FFTCQT has no output_format {output_format}")
+        reference = Spectrogram.CQT1992v2(
+            sr=sr,
+            hop_length=hop_length,
+            fmin=fmin,
+            fmax=fmax,
+            n_bins=n_bins,
+            bins_per_octave=bins_per_octave,
+            filter_scale=filter_scale,
+            norm=norm,
+            window=window,
+            verbose=verbose,
+        )
+        # same buffers as CQT1992v2, the checkpoints of both load into either
+        self.register_buffer("lenghts", reference.lenghts)
+        self.register_buffer("cqt_kernels_real", reference.cqt_kernels_real)
+        self.register_buffer("cqt_kernels_imag", reference.cqt_kernels_imag)
+        self.kernel_width = reference.kernel_width
+        self.frequencies = reference.frequencies
+        self.hop_length = hop_length
+        # bins whose bands are within 2 ** (1 / 4) of each other in width
+        self.group_size = max(1, int(bins_per_octave) // 4)
+        self.center = center
+        self.pad_mode = pad_mode
+        self.output_format = output_format
+        self.sparsity = sparsity
+        self.plans = {}
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        super()._load_from_state_dict(*args, **kwargs)
+        self.plans = {}
+
+    def plan(self, length, device):
+        """sparse kernel spectra for padded signals of `length` samples"""
+        key = (length, str(device))
+        if key in self.plans:
+            return self.plans[key]
+        n_fft = -(-length // self.hop_length) * self.hop_length
+        n_fold = n_fft // self.hop_length
+        # CQT1992v2 returns sqrt(length) times the correlation with conj(kernel)
+        real = self.cqt_kernels_real[:, 0].cpu().double().numpy()
+        imag = self.cqt_kernels_imag[:, 0].cpu().double().numpy()
+        lenghts = self.lenghts.cpu().double().numpy()
+        kernels = (real + 1j * imag) * np.sqrt(lenghts)[:, None]
+        spectra = np.fft.fft(kernels, n=n_fft).conj()
+        # z[t * hop] = ifft(folded spectrum)[t] / hop, given the 1 / n_fft of ifft
+        spectra /= self.hop_length
+        groups = []
+        for start in range(0, len(spectra), self.group_size):
+            block = spectra[start : start + self.group_size]
+            magnitude = np.abs(block)
+            keep = magnitude >= self.sparsity * magnitude.max(1, keepdims=True)
+            width = keep.sum(1).max()
+            # kept coefficients of every bin, padded with zero weights at index 0
+            index = np.zeros((len(block), width), dtype=np.int64)
+            weights = np.zeros((len(block), width), dtype=np.complex64)
+            for i, row in enumerate(keep):
+                kept = np.flatnonzero(row)
+                index[i, : len(kept)] = kept
+                weights[i, : len(kept)] = block[i, kept]
+            rows = np.arange(start, start + len(block))[:, None]
+            folded = index % n_fold + n_fold * rows
+            groups.append(
+                (
+                    torch.from_numpy(index).to(device),
+                    torch.from_numpy(weights).to(device),
+                    torch.from_numpy(folded.reshape(-1)).to(device),
+                )
+            )
+        self.plans[key] = (n_fft, n_fold, groups)
+        return self.plans[key]
+
+    def forward(self, x):
+        if x.ndim == 1:
+            x = x[None]
+        x = x.reshape(-1, x.shape[-1])
+        with torch.cuda.amp.autocast(enabled=False):
+            x = x.float()
+            if self.center:
+                pad = self.kernel_width // 2
+                x = F.pad(x[:, None], (pad, pad), mode=self.pad_mode)[:, 0]
+            n_frames = (x.shape[-1] - self.kernel_width) // self.hop_length + 1
+            n_fft, n_fold, groups = self.plan(x.shape[-1], x.device)
+            spec = torch.fft.fft(x, n=n_fft)
+            n_bins = len(self.lenghts)
+            bins = torch.zeros(len(x), n_bins * n_fold, 2, device=x.device)
+            for index, weights, folded in groups:
+                product = torch.view_as_real(spec[:, index] * weights)
+                bins.index_add_(1, folded, product.view(len(x), -1, 2))
+            bins = torch.view_as_complex(bins).view(len(x), n_bins, n_fold)
+            cqt = torch.view_as_real(torch.fft.ifft(bins)[..., :n_frames])
+        if self.output_format == "Complex":
+            return cqt
+        return torch.hypot(cqt[..., 0], cqt[..., 1])
+
+
+def drop_bins(transform, keep):
+    """keeps the bins of a CQT1992v2/FFTCQT `transform` where `keep` is True"""
+    keep = torch.from_numpy(np.asarray(keep))
+    for name in ["lenghts", "cqt_kernels_real", "cqt_kernels_imag"]:
+        buffer = getattr(transform, name)
+        setattr(transform, name, buffer[keep.to(buffer.device)])
+    transform.frequencies = transform.frequencies[keep.numpy()]
+    return transform
+
+
+class CQTImage(nn.Module):
+    """
+    (N, L) waves -> (N, height, width) CQT images computed at their final size instead
+    of interpolated to it:
+    - `width` frames centred every (stop - start) / width samples from sample `start`
+      on, only the samples these frames need are transformed (reflected at the ends
+      of the wave as with center=True);
+    - `height` bins log-spaced from fmin to fmax, the kernels keep the bandwidth of a
+      CQT with `bins_per_octave` and `filter_scale`, however dense the bins are;
+    - the bins inside the (low, high) Hz `drop_bands` are left out of the kernels,
+      the images are shorter by as many rows.
+    """
+
+    def __init__(
+        self,
+        size,
+        start,
+        stop,
+        fmin,
+        fmax,
+        drop_bands=(),
+        bins_per_octave=12,
+        filter_scale=1,
+        sr=2048,
+        norm=1,
+        window="hann",
+        fast_cqt=False,
+    ):
+        super().__init__()
+        height, width = size
+        self.width = width
+        self.start = start
+        self.hop_length = max(1, round((stop - start) / width))
+        image_bins_per_octave = (height - 1) / np.log2(fmax / fmin)
+        # Q of the reference CQT
+        Q = filter_scale / (2 ** (1 / bins_per_octave) - 1)
+        cqt = FFTCQT if fast_cqt else Spectrogram.CQT1992v2
+        self.transform = cqt(
+            sr=sr,
+            fmin=fmin,
+            n_bins=height,
+            bins_per_octave=image_bins_per_octave,
+            filter_scale=Q * (2 ** (1 / image_bins_per_octave) - 1),
+            hop_length=self.hop_length,
+            norm=norm,
+            window=window,
+            center=False,
+            output_format="Magnitude",
+            verbose=False,
+        )
+        frequencies = self.transform.frequencies
+        keep = np.ones(len(frequencies), dtype=bool)
+        for low, high in drop_bands:
+            keep &= (frequencies < low) | (frequencies > high)
+        if not keep.all():
+            drop_bins(self.transform, keep)
+        self.frequencies = self.transform.frequencies
+
+    def forward(self, x):
+        kernel_width = self.transform.kernel_width
+        left = self.start - kernel_width // 2
+        right = left + (self.width - 1) * self.hop_length + kernel_width
+        pad = (max(-left, 0), max(right - x.shape[-1], 0))
+        x = x[..., max(left, 0) : right]
+        if any(pad):
+            length = x.shape[-1] + sum(pad)
+            x = F.pad(x.reshape(-1, 1, x.shape[-1]), pad, mode="reflect")
+            x = x.view(-1, length)
+        return self.transform(x)
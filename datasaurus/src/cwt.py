@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.fft
 import scipy.special
 import torch
 import torch.nn as nn
@@ -7,6 +8,7 @@ from scipy import optimize
 from scipy.special import factorial, gamma, hermitenorm
 from ssqueezepy import Wavelet
 from timm.models.layers.conv2d_same import conv2d_same
+from timm.models.layers.padding import get_same_padding
 
 
 # https://github.com/tomrunia/PyTorchWavelets/blob/master/wavelets_pytorch/wavelets.py
@@ -329,7 +331,13 @@ class CWT(nn.Module):
         output_format="Magnitude",
         trainable=False,
         hop_length: int = 1,
+        signal_length: int = 4096,
+        use_fft: bool = False,
     ):
+        """
+        use_fft: apply the wavelet bank in the frequency domain instead of with
+        conv2d_same (same output up to ~1e-6), see fft_forward
+        """
         super().__init__()
         self.wavelet = wavelet
 
@@ -339,18 +347,28 @@ class CWT(nn.Module):
         self.fmax = fmax
         self.output_format = output_format
         self.trainable = trainable  # TODO make kernel a trainable parameter
+        self.hop_length = hop_length
         self.stride = (1, hop_length)
         # self.padding = 0  # "same"
+        self.use_fft = use_fft
 
         self._scale_minimum = self.compute_minimum_scale()
 
-        self.signal_length = None
-        self._channels = None
-
-        self._scales = None
-        self._kernel = None
-        self._kernel_real = None
-        self._kernel_imag = None
+        # the scales depend on the signal length, the bank is built for it up front
+        self.signal_length = signal_length
+        self._scales = self.compute_optimal_scales()
+        kernel = self._build_wavelet_bank()
+        # the conv2d_same kernels are not saved, as before
+        self.register_buffer("_kernel", None, False)
+        self.register_buffer("_kernel_real", None, False)
+        self.register_buffer("_kernel_imag", None, False)
+        if use_fft:
+            self.register_buffer("bank", self._build_bank_spectrum(kernel[:, 0, 0]))
+        elif kernel.is_complex():
+            self._kernel_real = kernel.real.contiguous()
+            self._kernel_imag = kernel.imag.contiguous()
+        else:
+            self._kernel = kernel
 
     def compute_optimal_scales(self):
         """
@@ -432,6 +450,63 @@ class CWT(nn.Module):
         # wavelet_bank = torch.cat([wavelet_bank] * self.channels, 2)
         return wavelet_bank
 
+    def _build_bank_spectrum(self, kernel):
+        """
+        conv2d_same(x, kernel, stride=hop)[j] = sum_m xpad[j * hop + m] * kernel[m] is a
+        correlation, i.e. a product with the spectrum of the reversed kernel. The bins
+        are laid out (scales, hop, fold): bin q * fold + r is bank[:, q, r], the
+        hop_length decimation sums the spectrum along q. The whole spectrum is kept,
+        the bands of the scales near fmax run past the Nyquist frequency.
+        """
+        n_scales, kernel_len = kernel.shape
+        length, hop = self.signal_length, self.hop_length
+        left = get_same_padding(length, kernel_len, hop, 1) // 2
+        # no wrap around for any output sample, fold has small prime factors
+        self.fold = scipy.fft.next_fast_len(-(-(length + kernel_len - 1) // hop))
+        self.n_fft = self.fold * hop
+        reversed_kernel = np.zeros((n_scales, self.n_fft), dtype=np.complex128)
+        m = np.arange(left - kernel_len + 1, left + 1)
+        kernel = kernel.numpy().astype(np.complex128)
+        reversed_kernel[:, m % self.n_fft] = kernel[:, left - m]
+        # ifft(folded)[j] = z[j * hop] * hop, the 1 / n_fft of the full ifft
+        spectrum = np.fft.fft(reversed_kernel, axis=1) / hop
+        bank = torch.from_numpy(spectrum.astype(np.complex64))
+        return bank.view(n_scales, hop, self.fold)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # the conv version keeps no bank, its checkpoints load into either version
+        if not self.use_fft:
+            state_dict.pop(prefix + "bank", None)
+        elif prefix + "bank" not in state_dict:
+            state_dict[prefix + "bank"] = self.bank
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def fft_forward(self, x, chunk=32):
+        """
+        One batched fft of the rows, for every fold bin r a (rows, hop) x (hop, scales)
+        matmul with the bank sums the decimated spectrum, and one batched ifft of fold
+        points per row and scale gives the hop_length-strided CWT. `chunk` scales at a
+        time, written into the output, keep the complex intermediates small.
+        """
+        shape = x.shape
+        with torch.cuda.amp.autocast(enabled=False):
+            x = x.reshape(-1, shape[-1]).float()
+            n_scales, hop, fold = self.bank.shape
+            spec = torch.fft.fft(x, n=self.n_fft).view(len(x), hop, fold)
+            spec = spec.permute(2, 0, 1)
+            n_frames = -(-shape[-1] // hop)
+            magnitude = self.output_format == "Magnitude"
+            parts = [] if magnitude else [2]
+            output = x.new_empty(len(x), n_scales, n_frames, *parts)
+            for start in range(0, n_scales, chunk):
+                bank = self.bank[start : start + chunk].permute(2, 1, 0)
+                folded = torch.matmul(spec, bank).permute(1, 2, 0)
+                cwt = torch.fft.ifft(folded)[..., :n_frames]
+                output[:, start : start + chunk] = (
+                    cwt.abs() if magnitude else torch.view_as_real(cwt)
+                )
+        return output.view(shape[0], shape[1], *output.shape[1:])
+
     def forward(self, x):
         """Compute CWT arrays from a batch of multi-channel inputs
 
@@ -441,19 +516,17 @@ class CWT(nn.Module):
         Returns:
             torch.tensor: Tensor of shape (batch_size, channels, widths, time)
         """
-        if self.signal_length is None:
-            self.signal_length = x.shape[-1]
-            self.channels = x.shape[-2]
-            self._scales = self.compute_optimal_scales()
-            self._kernel = self._build_wavelet_bank()
+        if x.shape[-1] != self.signal_length:
+            raise ValueError(
+                f"CWT built for signal_length {self.signal_length}, got {x.shape[-1]}"
+            )
 
-            if self._kernel.is_complex():
-                self._kernel_real = self._kernel.real
-                self._kernel_imag = self._kernel.imag
+        if self.use_fft:
+            return self.fft_forward(x)
 
         x = x.unsqueeze(1)
 
-        if self._kernel.is_complex():
+        if self._kernel is None:
             if (
                 x.dtype != self._kernel_real.dtype
                 or x.device != self._kernel_real.device
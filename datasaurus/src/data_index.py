@@ -0,0 +1,80 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import StratifiedKFold
+
+CSV_NAMES = {"train": "training_labels.csv", "test": "sample_submission.csv"}
+
+# Dataset index: one .npz with, per split, the ids, targets and relative paths in csv
+# order, plus one fold column `fold_{seed}` per seed asked so far.
+
+
+def _csv_stamp(data_folder):
+    paths = [Path(data_folder) / name for name in CSV_NAMES.values()]
+    return np.array([[os.path.getsize(p), os.path.getmtime(p)] for p in paths])
+
+
+def build_index(data_folder):
+    index = {"stamp": _csv_stamp(data_folder)}
+    for split, name in CSV_NAMES.items():
+        df = pd.read_csv(Path(data_folder) / name)
+        ids = df["id"]
+        relpath = ids.str[0] + "/" + ids.str[1] + "/" + ids.str[2] + "/" + ids + ".npy"
+        index[f"{split}_id"] = np.asarray(ids, dtype=str)
+        index[f"{split}_target"] = df["target"].values
+        index[f"{split}_relpath"] = np.asarray(relpath, dtype=str)
+    return index
+
+
+def assign_folds(target, seed, n_splits=5):
+    skf = StratifiedKFold(n_splits, shuffle=True, random_state=seed)
+    fold = np.full(len(target), -1, dtype=np.int8)
+    for k, (_, val_idx) in enumerate(skf.split(target, target)):
+        fold[val_idx] = k
+    return fold
+
+
+def save_index(index, index_path):
+    tmp_path = f"{index_path}.tmp.npz"
+    np.savez(tmp_path, **index)
+    os.replace(tmp_path, index_path)
+
+
+def load_index(data_folder, index_path, seed=None):
+    index = None
+    if Path(index_path).exists():
+        with np.load(index_path) as f:
+            index = dict(f)
+        if not np.array_equal(index["stamp"], _csv_stamp(data_folder)):
+            print("Dataset index is out of date")
+            index = None
+
+    changed = index is None
+    if changed:
+        print("Build dataset index")
+        appended = {}
+        if Path(index_path).exists():
+            # `appended_*` segments that follow the test rows, not part of the csv files
+            with np.load(index_path) as f:
+                appended = {k: f[k] for k in f if k.startswith("appended_")}
+        index = dict(build_index(data_folder), **appended)
+    if seed is not None and f"fold_{seed}" not in index:
+        index[f"fold_{seed}"] = assign_folds(index["train_target"], seed)
+        changed = True
+    if changed:
+        Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+        save_index(index, index_path)
+    return index
+
+
+def index_frame(index, split, seed=None):
+    offset = 0 if split == "train" else len(index["train_id"])
+    df = pd.DataFrame(
+        {"id": index[f"{split}_id"].astype(object), "target": index[f"{split}_target"]}
+    )
+    df["row"] = offset + np.arange(len(df))
+    if seed is not None and split == "train":
+        df["fold"] = index[f"fold_{seed}"]
+    return df
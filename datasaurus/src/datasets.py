@@ -2,17 +2,31 @@ import numpy as np
 import pandas as pd
 import pytorch_lightning as pl
 import torch
+import torch.distributed as dist
 from scipy import signal
 from scipy.special import expit, logit
-from sklearn.model_selection import StratifiedKFold
-from torch.utils.data import ConcatDataset, DataLoader, Dataset
+from torch.utils.data import ConcatDataset, DataLoader, Dataset, DistributedSampler
+from torch.utils.data.dataloader import default_collate
 from torchaudio.functional import lowpass_biquad
 
 from src.config import INPUT_PATH
-from src.preprocessing import apply_whiten, biquad_bandpass_filter, get_design_curves
+from src.data_index import index_frame, load_index
+from src.injection import detector_lags, load_gw_bank, shift_left
+from src.preprocessing import BatchPreprocess, biquad_bandpass_filter
+from src.sampler import (
+    BlockShuffleSampler,
+    PosNegBatchSampler,
+    dataset_keys,
+    dataset_targets,
+)
 
 
 class GWDataset(Dataset):
+    """
+    Raw waves and targets, the scaling, window, whitening and band-pass run on the
+    whole batch in `collate_fn` (see BatchPreprocess)
+    """
+
     def __init__(
         self,
         df,
@@ -27,8 +41,7 @@ class GWDataset(Dataset):
     ):
         self.df = df.reset_index(drop=True)
         self.folder = folder
-        self.window = torch.tensor(signal.tukey(4096, tukey_alpha))
-        self.design_curves = torch.tensor(get_design_curves(("tukey", tukey_alpha)))
+        self.preprocess = BatchPreprocess(tukey_alpha, bp_lf, bp_hf, whiten)
         self.lf = bp_lf
         self.hf = bp_hf
         self.order = bp_order
@@ -38,29 +51,34 @@ class GWDataset(Dataset):
     def load_file(self, id_):
         path = INPUT_PATH / self.folder / id_[0] / id_[1] / id_[2] / f"{id_}.npy"
         waves = np.load(path)
-        return waves / np.max(np.abs(waves), axis=1).reshape(3, 1)
-        # return waves / np.max(np.abs(waves))
+        return waves
 
     def __len__(self):
         return len(self.df)
 
     def __getitem__(self, index):
         target = torch.tensor([self.df.loc[index, "target"]], dtype=torch.float32)
-        data = self.load_file(self.df.loc[index, "id"])
-        data = torch.tensor(data) * self.window
+        data = torch.tensor(self.load_file(self.df.loc[index, "id"]))
+        return data, target
 
-        if self.whiten:
-            data = apply_whiten(data, self.design_curves)
-        else:
-            data = data.to(dtype=torch.float32)
+    def collate_fn(self, batch):
+        data, target = default_collate(batch)
+        return self.preprocess(data), target
 
-        if self.lf and self.hf:
-            data = biquad_bandpass_filter(data, self.lf, self.hf, 2048)
 
-        return data, target
+def get_collate_fn(dataset):
+    if isinstance(dataset, ConcatDataset):
+        dataset = dataset.datasets[0]
+    return getattr(dataset, "collate_fn", None)
 
 
 class GWSyntheticDataset(Dataset):
+    """
+    Negative samples that get a synthetic GW at collate time: `collate_fn` draws the
+    signals from the gw_sim bank, lags them per detector and adds, windows and
+    band-passes the whole batch at once.
+    """
+
     def __init__(
         self,
         df,
@@ -79,7 +97,7 @@ class GWSyntheticDataset(Dataset):
         self.lf = bp_lf
         self.hf = bp_hf
         self.order = bp_order
-        self.gw_paths = list((INPUT_PATH / "gw_sim").glob("*.npy"))
+        self.bank = load_gw_bank()
         self.amp_min = amplitude_min
         self.amp_max = amplitude_max
 
@@ -88,35 +106,6 @@ class GWSyntheticDataset(Dataset):
         waves = np.load(path)
         return waves
 
-    def prepare_gw(self, sig, sr=2048, error_ms=5):
-        if len(sig) < 4096:
-            pad = 4096 - len(sig)
-            sig = np.pad(sig, (0, pad))
-        # Time lags https://arxiv.org/abs/1706.04191
-        # https://www.kaggle.com/c/g2net-gravitational-wave-detection/discussion/251934#1387136
-
-        # Start the GW from Hanford
-        if np.random.rand() > 0.5:
-            hanford_delay = 0 + np.random.normal(scale=error_ms)
-            livingston_delay = 10 + np.random.normal(scale=error_ms)
-            virgo_delay = 26 + np.random.normal(scale=error_ms)
-        # Start the GW from Virgo
-        else:
-            hanford_delay = 27 + np.random.normal(scale=error_ms)
-            livingston_delay = 26 + np.random.normal(scale=error_ms)
-            virgo_delay = 0 + np.random.normal(scale=error_ms)
-
-        random_pad = np.random.randint(30, int(4096 * 0.85))
-
-        hanford_pad = int(sr * hanford_delay / 1000) + random_pad
-        livingston_pad = int(sr * livingston_delay / 1000) + random_pad
-        virgo_pad = int(sr * virgo_delay / 1000) + random_pad
-
-        hanford_sig = np.pad(sig, (0, hanford_pad))[-4096:]
-        livingston_sig = np.pad(sig, (0, livingston_pad))[-4096:]
-        virgo_sig = np.pad(sig, (0, virgo_pad))[-4096:]
-        return np.stack([hanford_sig, livingston_sig, virgo_sig])
-
     def __len__(self):
         return len(self.df)
 
@@ -124,17 +113,20 @@ class GWSyntheticDataset(Dataset):
         data = self.load_file(self.df.loc[index, "id"])
         data = torch.tensor(data, dtype=torch.float32)
         scale = torch.abs(data).max()
-
-        # if np.random.rand() > 0.5:
-        target = torch.tensor([1], dtype=torch.float32)
-        gw = np.load(np.random.choice(self.gw_paths))[1]
-        data_clean = torch.tensor(self.prepare_gw(gw), dtype=torch.float32)
-        data_clean *= np.random.uniform(low=self.amp_min, high=self.amp_max)
+        return data, scale
+
+    def collate_fn(self, batch):
+        data = torch.stack([b[0] for b in batch])
+        scale = torch.stack([b[1] for b in batch]).view(-1, 1, 1)
+        n = len(data)
+
+        target = torch.ones((n, 1), dtype=torch.float32)
+        picks = torch.randint(len(self.bank), (n,)).numpy()
+        gw = torch.from_numpy(np.asarray(self.bank[picks], dtype=np.float32))
+        data_clean = shift_left(gw[:, None].expand(-1, 3, -1), detector_lags(n))
+        data_clean *= torch.empty((n, 1, 1)).uniform_(self.amp_min, self.amp_max)
         data += data_clean
         data_clean /= scale
-        # else:
-        #     target = torch.tensor([0], dtype=torch.float32)
-        #     data_clean = torch.normal(mean=0, std=1e-10, size=data.shape)
 
         data /= scale
 
@@ -160,6 +152,11 @@ class GWDataModule(pl.LightningDataModule):
         test_transforms=None,
         num_workers: int = 4,
         pseudo_label: bool = False,
+        block_shuffle: bool = False,
+        block_size: int = 256,
+        block_window: int = 4,
+        balanced_batches: bool = False,
+        batch_pos_fraction: float = None,
     ):
         super().__init__()
         self.batch_size = batch_size
@@ -175,9 +172,15 @@ class GWDataModule(pl.LightningDataModule):
         self.test_transforms = test_transforms
         self.num_workers = num_workers
         self.pseudo_label = pseudo_label
-
-        self.df = pd.read_csv(INPUT_PATH / "training_labels.csv")
-        self.df_test = pd.read_csv(INPUT_PATH / "sample_submission.csv")
+        self.block_shuffle = block_shuffle
+        self.block_size = block_size
+        self.block_window = block_window
+        self.balanced_batches = balanced_batches
+        self.batch_pos_fraction = batch_pos_fraction
+
+        self.index = load_index(INPUT_PATH, INPUT_PATH / "dataset_index.npz", seed)
+        self.df = index_frame(self.index, "train")
+        self.df_test = index_frame(self.index, "test")
         self.df_pl = pd.read_csv(INPUT_PATH / "submission_power2_weight.csv")
         # self.df_pl = self.df_pl.query("(mean < 0.4) | (mean > 0.8 & mean < 0.99)")
         self.create_folds()
@@ -191,11 +194,8 @@ class GWDataModule(pl.LightningDataModule):
         # )
 
     def create_folds(self):
-        skf = StratifiedKFold(5, shuffle=True, random_state=self.seed)
-        splits = skf.split(self.df["id"], self.df["target"])
-        self.df["fold"] = -1
-        for fold, (_, val_idx) in enumerate(splits):
-            self.df.loc[val_idx, "fold"] = fold
+        # StratifiedKFold(5, shuffle=True, random_state=seed), cached in the dataset index
+        self.df["fold"] = self.index[f"fold_{self.seed}"]
 
     def setup(self, stage=None, fold_n: int = 0):
         trn_df = self.df.query(f"fold != {fold_n}")
@@ -232,20 +232,68 @@ class GWDataModule(pl.LightningDataModule):
             self.gw_test = GWDataset(self.df_test, folder="test", **params)
 
     def train_dataloader(self):
+        # Lightning does not replace these samplers (replace_sampler_ddp=False in
+        # train.py), so they split the blocks or batches between the DDP replicas
+        num_replicas, rank = 1, 0
+        if dist.is_available() and dist.is_initialized():
+            num_replicas, rank = dist.get_world_size(), dist.get_rank()
+        if self.balanced_batches:
+            batch_sampler = PosNegBatchSampler(
+                dataset_targets(self.gw_train),
+                self.batch_size,
+                self.batch_pos_fraction,
+                seed=self.seed,
+                num_replicas=num_replicas,
+                rank=rank,
+            )
+            return DataLoader(
+                self.gw_train,
+                batch_sampler=batch_sampler,
+                num_workers=self.num_workers,
+                collate_fn=get_collate_fn(self.gw_train),
+                pin_memory=True,
+            )
+
+        if self.block_shuffle:
+            sampler = BlockShuffleSampler(
+                dataset_keys(self.gw_train),
+                self.block_size,
+                self.block_window,
+                seed=self.seed,
+                num_replicas=num_replicas,
+                rank=rank,
+            )
+            return DataLoader(
+                self.gw_train,
+                batch_size=self.batch_size,
+                num_workers=self.num_workers,
+                sampler=sampler,
+                collate_fn=get_collate_fn(self.gw_train),
+                drop_last=True,
+                pin_memory=True,
+            )
+
         return DataLoader(
             self.gw_train,
             batch_size=self.batch_size,
             num_workers=self.num_workers,
             shuffle=True,
+            collate_fn=get_collate_fn(self.gw_train),
             drop_last=True,
             pin_memory=True,
         )
 
     def val_dataloader(self):
+        sampler = None
+        replace_sampler = self.block_shuffle or self.balanced_batches
+        if replace_sampler and dist.is_available() and dist.is_initialized():
+            sampler = DistributedSampler(self.gw_valid, shuffle=False)
         return DataLoader(
             self.gw_valid,
             batch_size=self.batch_size * 4,
             num_workers=self.num_workers,
+            sampler=sampler,
+            collate_fn=get_collate_fn(self.gw_valid),
             pin_memory=True,
         )
 
@@ -254,5 +302,6 @@ class GWDataModule(pl.LightningDataModule):
             self.gw_test,
             batch_size=self.batch_size * 4,
             num_workers=self.num_workers,
+            collate_fn=get_collate_fn(self.gw_test),
             pin_memory=True,
         )
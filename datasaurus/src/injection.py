@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from src.config import INPUT_PATH
+
+
+def shift_left(signals, shifts):
+    """
+    (B, C, L) signals shifted left by the (B, C) `shifts` and zero-filled at the end,
+    i.e. np.pad(sig, (0, s))[-L:] for every sample and channel in one gather.
+    """
+    length = signals.shape[-1]
+    index = (torch.arange(length) + shifts[..., None]).clamp(max=length)
+    return torch.gather(F.pad(signals, (0, 1)), -1, index.expand(signals.shape))
+
+
+def detector_lags(n, sr=2048, error_ms=5):
+    """
+    (n, 3) left shifts of the H1, L1 and V1 copies of a signal: the GW reaches Hanford
+    or Virgo first (https://arxiv.org/abs/1706.04191), plus a random shared offset
+    """
+    hanford_first = torch.rand(n, 1) > 0.5
+    delays = torch.where(
+        hanford_first, torch.tensor([0.0, 10.0, 26.0]), torch.tensor([27.0, 26.0, 0.0])
+    )
+    delays = delays + torch.normal(0.0, float(error_ms), (n, 3))
+    random_pad = torch.randint(30, int(4096 * 0.85), (n, 1))
+    return ((sr * delays / 1000).long() + random_pad).clamp(min=0)
+
+
+def load_gw_bank(folder=INPUT_PATH / "gw_sim", bank_path=INPUT_PATH / "gw_sim.npy"):
+    """
+    Channel 1 of every gw_sim/*.npy, padded or cut to its last 4096 samples, as one
+    memory-mapped (K, 4096) bank. Rebuilt when the number of files changes.
+    """
+    paths = sorted(folder.glob("*.npy"))
+    if bank_path.exists():
+        bank = np.load(bank_path, mmap_mode="r")
+        if len(bank) == len(paths):
+            return bank
+    print(f"Build {bank_path} from {len(paths)} signals")
+    bank = np.zeros((len(paths), 4096), dtype=np.float32)
+    for i, path in enumerate(paths):
+        sig = np.load(path)[1][-4096:]
+        bank[i, : len(sig)] = sig
+    tmp_path = f"{bank_path}.tmp.npy"
+    np.save(tmp_path, bank)
+    os.replace(tmp_path, bank_path)
+    return np.load(bank_path, mmap_mode="r")
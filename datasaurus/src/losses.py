@@ -28,33 +28,78 @@ import torch.nn.functional as F
 #         return loss
 
 
-def rank_loss_soft(input, target):
+class PairSoftplus(torch.autograd.Function):
+    """
+    Sum over all pairs i, j of relu(t_i - t_j) * softplus(m - s * (x_i - x_j))
+    without a B x B matrix: blocks of `chunk` rows are summed in turn and computed
+    again in the backward pass, so memory stays at chunk x B. Sorted by target,
+    row i only pairs with the prefix of smaller targets.
+    """
+
+    @staticmethod
+    def blocks(x, t, chunk):
+        ends = torch.searchsorted(t, t)  # columns with a smaller target, for every row
+        for start in range(0, len(x), chunk):
+            stop = min(start + chunk, len(x))
+            end = int(ends[stop - 1])
+            if end > 0:
+                yield start, stop, end
+
+    @staticmethod
+    def forward(ctx, x, t, s, m, chunk):
+        t, order = torch.sort(t)
+        x = x[order]
+        total = x.new_zeros(())
+        for start, stop, end in PairSoftplus.blocks(x, t, chunk):
+            a = torch.relu(t[start:stop, None] - t[None, :end])
+            x0 = x[start:stop, None] - x[None, :end]
+            total += (a * F.softplus(m - s * x0)).sum()
+        ctx.save_for_backward(x, t, order)
+        ctx.s, ctx.m, ctx.chunk = s, m, chunk
+        return total
+
+    @staticmethod
+    def backward(ctx, grad):
+        x, t, order = ctx.saved_tensors
+        s, m = ctx.s, ctx.m
+        grad_sorted = torch.zeros_like(x)
+        for start, stop, end in PairSoftplus.blocks(x, t, ctx.chunk):
+            a = torch.relu(t[start:stop, None] - t[None, :end])
+            x0 = x[start:stop, None] - x[None, :end]
+            d = a * torch.sigmoid(m - s * x0)
+            grad_sorted[start:stop] -= s * d.sum(1)
+            grad_sorted[:end] += s * d.sum(0)
+        grad_x = torch.empty_like(grad_sorted)
+        grad_x[order] = grad_sorted
+        return grad_x * grad, None, None, None, None
+
+
+def rank_loss_soft(input, target, chunk=1024):
+    """
+    Mean of (t_i - t_j) * softplus(m - s * (x_i - x_j)) over the pairs with
+    t_i > t_j, falls back to BCE if all targets are equal
+    """
     m, s = 5.0, 5.0
     input = input.view(-1).float()
-    target = target.view(-1)
-    w = (target[:, None] - target[None, :]).view(-1)
-    x0 = (input[:, None] - input[None, :]).view(-1)
-    x = x0[w.nonzero()]
-    w = w[w.nonzero()]
-    if len(x) == 0:
-        loss = F.binary_cross_entropy_with_logits(
-            input.view(-1), target.view(-1).float()
-        )
-    else:
-        loss = torch.where(
-            w < 0, -F.softplus(s * x + m) * w, F.softplus(-s * x + m) * w
-        ) + 1e-2 * F.smooth_l1_loss(x0, x0)
-    return loss.mean()
-
-
-def rank_loss(input, target):
+    target = target.view(-1).float()
+    t = torch.sort(target)[0]
+    n_pairs = int(torch.searchsorted(t, t).sum())
+    if n_pairs == 0:
+        return F.binary_cross_entropy_with_logits(input, target)
+    return PairSoftplus.apply(input, target, s, m, chunk) / n_pairs
+
+
+def rank_loss(input, target, chunk=1024):
+    """Mean of -logsigmoid(p - n) over the (positive, negative) pairs"""
     input = input.view(-1).float()
     target = target.view(-1)
     p = input[target == 1]
     n = input[target == 0]
     if len(p) == 0:
-        p = torch.Tensor([1]).to(input.device)
+        p = input.new_ones(1)
     if len(n) == 0:
-        n = torch.Tensor([-1]).to(input.device)
-    x = p[:, None] - n[None, :]
-    return -F.logsigmoid(x).mean() + 1e-4 * (input ** 2).mean()
+        n = -input.new_ones(1)
+    x = torch.cat([p, n])
+    t = torch.cat([torch.ones_like(p), torch.zeros_like(n)])
+    pairs = PairSoftplus.apply(x, t, 1.0, 0.0, chunk)
+    return pairs / (len(p) * len(n)) + 1e-4 * (input ** 2).mean()
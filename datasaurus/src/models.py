@@ -8,6 +8,7 @@ import torchmetrics
 from nnAudio import Spectrogram
 
 from src.augmentation import SpecAugmentation
+from src.cqt import CQTImage, FFTCQT
 from src.cwt import CWT
 from src.scalers import standard_scaler, standard_scaler_1d
 from src.utils import add_weight_decay, mixup_data
@@ -29,6 +30,10 @@ class GWModel(pl.LightningModule):
         fmax: int = 500,
         hop_length: int = 16,
         train_filter: bool = False,
+        fast_cqt: bool = False,
+        fast_cwt: bool = False,
+        native_image: bool = False,
+        drop_bands: list = [],
         cwt: bool = False,
         mixup_alpha: float = 0.0,
         window: str = "hann",
@@ -64,10 +69,36 @@ class GWModel(pl.LightningModule):
 
             if cwt:
                 self.spec_transform = CWT(
-                    dj=0.125 / 8, dt=1 / 2048, fmin=fmin, fmax=fmax, hop_length=8
+                    dj=0.125 / 8,
+                    dt=1 / 2048,
+                    fmin=fmin,
+                    fmax=fmax,
+                    hop_length=8,
+                    use_fft=fast_cwt,
+                )
+            elif native_image:
+                if train_filter:
+                    raise ValueError("native_image needs fixed CQT kernels")
+                # the band of the CQT1992v2 below, img_size or its own size
+                n_bins = int(np.ceil(bins_per_octave * np.log2(fmax / fmin)))
+                self.spec_transform = CQTImage(
+                    img_size or (n_bins, 4096 // hop_length),
+                    start=0,
+                    stop=4096,
+                    fmin=fmin,
+                    fmax=fmin * 2 ** ((n_bins - 1) / bins_per_octave),
+                    drop_bands=drop_bands,
+                    bins_per_octave=bins_per_octave,
+                    filter_scale=filter_scale,
+                    sr=2048,
+                    norm=norm,
+                    window=window,
+                    fast_cqt=fast_cqt,
                 )
             else:
-                self.spec_transform = Spectrogram.CQT1992v2(
+                # the FFT version has fixed kernels
+                cqt = FFTCQT if fast_cqt and not train_filter else Spectrogram.CQT1992v2
+                self.spec_transform = cqt(
                     sr=2048,
                     fmin=fmin,
                     fmax=fmax,
@@ -103,7 +134,7 @@ class GWModel(pl.LightningModule):
             spec = self.spec_transform(x_reshaped)
             spec = spec.reshape(bs, 3, spec.shape[1], spec.shape[2])
 
-        if self.hparams.img_size:
+        if self.hparams.img_size and not self.hparams.native_image:
             spec = nn.functional.interpolate(
                 spec, tuple(self.hparams.img_size), mode="bilinear"
             )
@@ -254,6 +285,8 @@ class GWDenoisingModel(pl.LightningModule):
         fmax: int = 500,
         hop_length: int = 16,
         train_filter: bool = False,
+        fast_cqt: bool = False,
+        fast_cwt: bool = False,
         cwt: bool = False,
         mixup_alpha: float = 0.0,
         window: str = "hann",
@@ -268,10 +301,17 @@ class GWDenoisingModel(pl.LightningModule):
 
         if cwt:
             self.spec_transform = CWT(
-                dj=0.125 / 8, dt=1 / 2048, fmin=fmin, fmax=fmax, hop_length=8
+                dj=0.125 / 8,
+                dt=1 / 2048,
+                fmin=fmin,
+                fmax=fmax,
+                hop_length=8,
+                use_fft=fast_cwt,
             )
         else:
-            self.spec_transform = Spectrogram.CQT1992v2(
+            # the FFT version has fixed kernels
+            cqt = FFTCQT if fast_cqt and not train_filter else Spectrogram.CQT1992v2
+            self.spec_transform = cqt(
                 sr=2048,
                 fmin=fmin,
                 fmax=fmax,
@@ -58,7 +58,10 @@ def get_design_curves(window=("tukey", 0.2)):
     if (INPUT_PATH / f"{fname}.npy").exists():
         return np.load(INPUT_PATH / f"{fname}.npy")
     else:
-        print(f"{fname}.npy not found. Building design curves")
+        print(
+            f"{fname}.npy not found. Building design curves",
+            "(1D_Model/estimate_psd.py builds them on all cores)",
+        )
         return build_design_curves(window)
 
 
@@ -156,3 +159,58 @@ class BiquadBandpass(nn.Module):
         )
 
         return output_waveform
+
+
+def biquad_response(central_freq, Q, sample_rate=2048, n=4096):
+    """rfft-bin frequency response of torchaudio's bandpass_biquad (const_skirt_gain=False)"""
+    w0 = 2 * np.pi * central_freq / sample_rate
+    alpha = np.sin(w0) / 2 / Q
+    b = [alpha, 0, -alpha]
+    a = [1 + alpha, -2 * np.cos(w0), 1 - alpha]
+    _, h = signal.freqz(b, a, worN=n // 2 + 1, include_nyquist=True)
+    return torch.from_numpy(h)
+
+
+class BatchPreprocess:
+    """
+    GWDataset preprocessing for a whole (B, 3, 4096) batch: per-channel max scaling,
+    window, whitening with the design curves and band-pass, with one rFFT, one
+    frequency-domain multiply and one iFFT.
+
+    Whitening gives the same result as apply_whiten: its real part of the iFFT of the
+    positive frequencies is the iRFFT of half of them (the DC bin in full), and the
+    per-channel max comes from the same iFFT call. The band-pass multiplies by the
+    biquad's frequency response, which differs from the causal lfilter of
+    biquad_bandpass_filter only over its start-up transient (the first ~64 samples).
+    """
+
+    def __init__(self, tukey_alpha=0.2, lf=None, hf=None, whiten=False, n=4096):
+        self.n = n
+        self.window = torch.tensor(signal.tukey(n, tukey_alpha))
+        self.whiten = whiten
+        self.bandpass = bool(lf and hf)
+        gains = []
+        if whiten:
+            design_curves = torch.tensor(get_design_curves(("tukey", tukey_alpha)))
+            gain = torch.zeros((3, n // 2 + 1), dtype=torch.float64)
+            gain[:, : design_curves.shape[-1]] = 0.5 / design_curves
+            gain[:, 0] *= 2
+            gains.append(gain * np.sqrt(n / 2))
+        if self.bandpass:
+            response = biquad_response((hf + lf) / 2, (hf - lf) / (hf + lf), n=n)
+            gains.append(response * (gains[0] if whiten else 1))
+        # (G, 3, n // 2 + 1): whitening only, band-pass only or both
+        self.gains = torch.stack([g.to(torch.complex128) for g in gains]) if gains else None
+
+    def __call__(self, data):
+        data = data / torch.abs(data).max(-1, keepdim=True)[0] * self.window
+        if self.gains is None:
+            return data.to(dtype=torch.float32)
+
+        x = torch.fft.irfft(torch.fft.rfft(data).unsqueeze(1) * self.gains, n=self.n)
+        data = x[:, -1]
+        if self.whiten:
+            data = data / torch.abs(x[:, 0]).max(-1, keepdim=True)[0]
+        if self.bandpass:
+            data = data.clamp(-1, 1)  # lfilter clamps its output
+        return data.to(dtype=torch.float32)
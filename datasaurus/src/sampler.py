@@ -0,0 +1,128 @@
+import numpy as np
+from torch.utils.data import ConcatDataset, Sampler
+
+
+class BlockShuffleSampler(Sampler):
+    """
+    Shuffle that keeps reads local: samples are sorted by `keys` (e.g. file path), cut
+    into blocks of `block_size` neighbours on disk, the blocks are shuffled and the
+    samples of every `window` consecutive blocks are shuffled together.
+    The order depends on seed + epoch only, so DDP replicas agree on how they split
+    the blocks.
+    """
+
+    def __init__(self, keys, block_size=256, window=4, seed=0, num_replicas=1, rank=0):
+        order = np.argsort(np.asarray(keys), kind="stable")
+        if num_replicas > 1:
+            # every replica gets the same number of whole blocks
+            step = block_size * num_replicas
+            order = np.resize(order, -(-len(order) // step) * step)
+        self.blocks = [
+            order[i : i + block_size] for i in range(0, len(order), block_size)
+        ]
+        self.window = window
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+
+    def __len__(self):
+        return sum(len(b) for b in self.blocks[self.rank :: self.num_replicas])
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        self.epoch += 1
+        perm = rng.permutation(len(self.blocks))[self.rank :: self.num_replicas]
+        blocks = [self.blocks[i] for i in perm]
+        indices = [
+            rng.permutation(np.concatenate(blocks[i : i + self.window]))
+            for i in range(0, len(blocks), self.window)
+        ]
+        return iter(np.concatenate(indices).tolist())
+
+
+class PosNegBatchSampler(Sampler):
+    """
+    Batches with a fixed mix of positives (target 1) and negatives (target 0), so
+    that the rank losses always have pairs: `pos_fraction` of the hard-labelled
+    samples of a batch are positives (their share in the data if None), at least
+    one of each. Soft targets (pseudo labels) keep their share of every batch.
+    Each group is drawn from its own shuffled order, started again when used up.
+    Replicas take every num_replicas-th batch.
+    """
+
+    def __init__(
+        self, targets, batch_size, pos_fraction=None, seed=0, num_replicas=1, rank=0
+    ):
+        targets = np.asarray(targets, dtype=float)
+        self.groups = [
+            np.flatnonzero(targets == 1),
+            np.flatnonzero(targets == 0),
+            np.flatnonzero((targets != 0) & (targets != 1)),
+        ]
+        n_pos, n_neg, n_soft = [len(group) for group in self.groups]
+        n_soft = int(round(batch_size * n_soft / len(targets)))
+        hard = batch_size - n_soft
+        if pos_fraction is None:
+            pos_fraction = n_pos / max(n_pos + n_neg, 1)
+        n_pos = int(
+            np.clip(round(hard * pos_fraction), min(1, n_pos), hard - min(1, n_neg))
+        )
+        self.counts = [n_pos, hard - n_pos, n_soft]
+        for name, group, count in zip(
+            ["positives", "negatives"], self.groups, self.counts
+        ):
+            if count and not len(group):
+                raise ValueError(
+                    f"pos_fraction={pos_fraction} needs {count} {name} per batch, "
+                    "targets has none"
+                )
+        self.n_batches = len(targets) // batch_size
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+
+    def __len__(self):
+        return len(range(self.rank, self.n_batches, self.num_replicas))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def draw(self, rng, group, count):
+        """`count` indices per batch from `group`, reshuffled when it runs out"""
+        if count == 0:
+            return np.empty((self.n_batches, 0), dtype=int)
+        total = self.n_batches * count
+        perms = [rng.permutation(group) for _ in range(-(-total // len(group)))]
+        return np.concatenate(perms)[:total].reshape(self.n_batches, count)
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        self.epoch += 1
+        batches = np.concatenate(
+            [
+                self.draw(rng, group, count)
+                for group, count in zip(self.groups, self.counts)
+            ],
+            1,
+        )
+        for batch in batches[self.rank :: self.num_replicas]:
+            yield rng.permutation(batch).tolist()
+
+
+def dataset_keys(dataset):
+    """path of every sample of a GWDataset (or a ConcatDataset of them), in order"""
+    if isinstance(dataset, ConcatDataset):
+        return np.concatenate([dataset_keys(d) for d in dataset.datasets])
+    return np.array([f"{dataset.folder}/{id_}" for id_ in dataset.df["id"]])
+
+
+def dataset_targets(dataset):
+    """target of every sample of a GWDataset (or a ConcatDataset of them), in order"""
+    if isinstance(dataset, ConcatDataset):
+        return np.concatenate([dataset_targets(d) for d in dataset.datasets])
+    return dataset.df["target"].values
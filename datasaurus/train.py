@@ -45,6 +45,7 @@ def run_fold(fold: int, args):
         callbacks=callbacks,
         resume_from_checkpoint=resume,
         plugins=DDPPlugin(find_unused_parameters=False),
+        replace_sampler_ddp=not (args.block_shuffle or args.balanced_batches),
         # fast_dev_run=True,
         # auto_lr_find=True,
     )